@@ -0,0 +1,253 @@
+"""
+Фоновые задания AI-анализа тендеров.
+
+Задание фиксирует список тендеров по фильтру (analysis_job_items) и
+обрабатывается пулом из settings.ai_job_workers корутин в event loop
+приложения. Каждая генерация идёт через общий LLMClient, поэтому задания
+делят с интерактивными запросами одни и те же лимиты; при переполненной
+очереди воркер ждёт и повторяет попытку. Ответы кладутся в кэш LLM и в
+tender_analyses (последний анализ тендера), прогресс — в analysis_jobs.
+
+Раннеру передаются LLMClient и функция подготовки промпта, так что в тестах
+его можно запустить с LLMClient(transport=<заглушка>) вместо Ollama.
+"""
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .db import SessionLocal
+from .llm import LLMBusyError, LLMClient
+from .llm_cache import llm_cache
+from .models import AnalysisJob, AnalysisJobItem, Tender, TenderAnalysis
+from .schemas import AnalysisJobCreate
+
+logger = logging.getLogger(__name__)
+
+# (db, tender_id) -> (промпт, ключ кэша, ответ из кэша или None); None — тендера нет
+PrepareFn = Callable[[Session, int], Optional[Tuple[str, str, Optional[str]]]]
+
+# дольше этого не ждём между попытками при переполненной очереди LLM, секунды
+MAX_BUSY_WAIT = 30.0
+
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+class AnalysisJobRunner:
+    def __init__(
+        self,
+        llm: LLMClient,
+        prepare: PrepareFn,
+        workers: int = settings.ai_job_workers,
+    ):
+        self.llm = llm
+        self.prepare = prepare
+        self.workers = max(1, workers)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        # задания, отменённые пользователем (а не остановкой процесса)
+        self._cancelled: Set[int] = set()
+
+    # ----- создание и запуск -----
+
+    def create_job(self, db: Session, filters: AnalysisJobCreate) -> AnalysisJob:
+        """Отбирает тендеры по фильтру и сохраняет задание (синхронно, без запуска)."""
+        q = db.query(Tender.id)
+        if filters.risk_level:
+            q = q.filter(Tender.risk_level == filters.risk_level)
+        if filters.category:
+            q = q.filter(Tender.category == filters.category)
+        if filters.date_from:
+            q = q.filter(Tender.created_at >= datetime.combine(filters.date_from, time.min))
+        if filters.date_to:
+            day_after = datetime.combine(filters.date_to + timedelta(days=1), time.min)
+            q = q.filter(Tender.created_at < day_after)
+        tender_ids = [tender_id for (tender_id,) in q.order_by(Tender.id)]
+
+        job = AnalysisJob(**filters.model_dump(), total=len(tender_ids))
+        db.add(job)
+        db.flush()
+        if tender_ids:
+            db.execute(
+                AnalysisJobItem.__table__.insert(),
+                [{"job_id": job.id, "tender_id": t} for t in tender_ids],
+            )
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def start(self, job_id: int) -> None:
+        """Запускает обработку в текущем event loop."""
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self.run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    def resume_unfinished(self) -> List[int]:
+        """Перезапускает задания, прерванные остановкой процесса."""
+        with SessionLocal() as db:
+            job_ids = [
+                job_id
+                for (job_id,) in db.query(AnalysisJob.id).filter(
+                    AnalysisJob.status.notin_(FINISHED_STATUSES)
+                )
+            ]
+        for job_id in job_ids:
+            self.start(job_id)
+        return job_ids
+
+    async def cancel(self, job_id: int) -> bool:
+        """
+        Останавливает задание и ждёт, пока задача запишет статус cancelled.
+        Вызывается из event loop: задачи и их учёт принадлежат ему.
+        """
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        self._cancelled.add(job_id)
+        task.cancel()
+        await asyncio.wait({task})
+        if job_id in self._cancelled:
+            # задачу отменили до начала run: статус записываем сами
+            self._cancelled.discard(job_id)
+            await run_in_threadpool(self._finish, job_id, "cancelled")
+        return True
+
+    # ----- обработка -----
+
+    async def run(self, job_id: int) -> None:
+        try:
+            # отмена во время _begin: поток дорабатывает, затем CancelledError
+            pending = await run_in_threadpool(self._begin, job_id)
+            queue: "asyncio.Queue[int]" = asyncio.Queue()
+            for tender_id in pending:
+                queue.put_nowait(tender_id)
+            await asyncio.gather(
+                *(self._worker(job_id, queue) for _ in range(self.workers))
+            )
+        except asyncio.CancelledError:
+            # при остановке процесса задание остаётся running и продолжится
+            # после перезапуска (resume_unfinished)
+            if job_id in self._cancelled:
+                self._cancelled.discard(job_id)
+                await run_in_threadpool(self._finish, job_id, "cancelled")
+            raise
+        except Exception as e:
+            logger.exception("Задание AI-анализа %s прервано", job_id)
+            await run_in_threadpool(self._finish, job_id, "failed", str(e))
+            return
+        await run_in_threadpool(self._finish, job_id, "done")
+
+    async def _worker(self, job_id: int, queue: "asyncio.Queue[int]") -> None:
+        while True:
+            try:
+                tender_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._analyze(job_id, tender_id)
+
+    async def _analyze(self, job_id: int, tender_id: int) -> None:
+        try:
+            prepared = await run_in_threadpool(self._prepare, tender_id)
+            if prepared is None:
+                raise LookupError("Тендер не найден")
+            prompt, key, reply = prepared
+            if reply is None:
+                reply = await self._generate(prompt)
+                await run_in_threadpool(
+                    llm_cache.put, key, reply, self.llm.model, tender_id
+                )
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            await run_in_threadpool(self._record, job_id, tender_id, None, error)
+        else:
+            await run_in_threadpool(self._record, job_id, tender_id, reply, None)
+
+    async def _generate(self, prompt: str) -> str:
+        while True:
+            try:
+                return await self.llm.generate(prompt)
+            except LLMBusyError as e:
+                # очередь занята интерактивными запросами — уступаем им
+                await asyncio.sleep(min(max(e.retry_after, 1.0), MAX_BUSY_WAIT))
+
+    # ----- работа с БД (в пуле потоков) -----
+
+    def _prepare(self, tender_id: int):
+        with SessionLocal() as db:
+            return self.prepare(db, tender_id)
+
+    def _begin(self, job_id: int) -> List[int]:
+        with SessionLocal() as db:
+            job = db.get(AnalysisJob, job_id)
+            job.status = "running"
+            job.started_at = job.started_at or datetime.utcnow()
+            db.commit()
+            return list(
+                db.scalars(
+                    select(AnalysisJobItem.tender_id)
+                    .where(
+                        AnalysisJobItem.job_id == job_id,
+                        AnalysisJobItem.status == "pending",
+                    )
+                    .order_by(AnalysisJobItem.tender_id)
+                )
+            )
+
+    def _record(
+        self,
+        job_id: int,
+        tender_id: int,
+        reply: Optional[str],
+        error: Optional[str],
+    ) -> None:
+        with SessionLocal() as db:
+            db.execute(
+                update(AnalysisJobItem)
+                .where(
+                    AnalysisJobItem.job_id == job_id,
+                    AnalysisJobItem.tender_id == tender_id,
+                )
+                .values(status="failed" if error else "done", error=error)
+            )
+            if error:
+                counter = {"failed": AnalysisJob.failed + 1}
+            else:
+                counter = {"done": AnalysisJob.done + 1}
+                # Core-вставка: сам тендер не меняется (и его кэш не сбрасывается)
+                stmt = insert(TenderAnalysis).values(
+                    tender_id=tender_id,
+                    job_id=job_id,
+                    model=self.llm.model,
+                    analysis=reply,
+                    created_at=datetime.utcnow(),
+                )
+                db.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[TenderAnalysis.tender_id],
+                        set_={
+                            "job_id": stmt.excluded.job_id,
+                            "model": stmt.excluded.model,
+                            "analysis": stmt.excluded.analysis,
+                            "created_at": stmt.excluded.created_at,
+                        },
+                    )
+                )
+            db.execute(
+                update(AnalysisJob).where(AnalysisJob.id == job_id).values(**counter)
+            )
+            db.commit()
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        with SessionLocal() as db:
+            job = db.get(AnalysisJob, job_id)
+            job.status = status
+            job.error = error
+            job.finished_at = datetime.utcnow()
+            db.commit()
@@ -0,0 +1,227 @@
+"""
+Инкрементальная статистика цен по категориям.
+
+Для каждой категории хранятся количество, сумма и сумма квадратов цен
+(category_stats), а также логарифмическая гистограмма цен
+(category_price_buckets) — сливаемый скетч в духе DDSketch с относительной
+точностью квантилей SKETCH_ACCURACY.
+
+Статистика обновляется автоматически после каждого flush сессии, в которой
+тендеры добавлялись, удалялись или меняли цену/категорию, поэтому правило
+OVERPRICE получает агрегаты категории одним чтением по первичному ключу.
+Массовые операции в обход ORM (query.delete, сырой SQL) событий не вызывают —
+после них статистику нужно пересобрать через rebuild_category_stats.
+"""
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import CategoryPriceBucket, CategoryStats, Tender
+
+SKETCH_ACCURACY = 0.01
+_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# отдельная корзина для нулевых и отрицательных цен
+ZERO_BUCKET = -(10**9)
+
+
+def price_bucket(price: float) -> int:
+    if price <= 0:
+        return ZERO_BUCKET
+    return math.ceil(math.log(price) / _LOG_GAMMA)
+
+
+def bucket_value(bucket: int) -> float:
+    """Представитель корзины (оценка с относительной ошибкой <= SKETCH_ACCURACY)."""
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return 2 * _GAMMA**bucket / (_GAMMA + 1)
+
+
+def _counts_in_stats(category: Optional[str], price: Optional[float]) -> bool:
+    return bool(category) and price is not None
+
+
+def committed_value(obj, attr: str):
+    """Значение атрибута до изменений в текущем flush."""
+    hist = inspect(obj).attrs[attr].history
+    if hist.deleted:
+        return hist.deleted[0]
+    if hist.unchanged:
+        return hist.unchanged[0]
+    # атрибут не загружался и не менялся
+    return getattr(obj, attr)
+
+
+class _Deltas:
+    """Накопитель изменений статистики в рамках одного flush."""
+
+    def __init__(self):
+        self.stats: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+        self.buckets: Dict[Tuple[str, int], int] = defaultdict(int)
+
+    def add(self, category: Optional[str], price: Optional[float], sign: int):
+        if not _counts_in_stats(category, price):
+            return
+        s = self.stats[category]
+        s[0] += sign
+        s[1] += sign * price
+        s[2] += sign * price * price
+        self.buckets[(category, price_bucket(price))] += sign
+
+    def __bool__(self):
+        return bool(self.stats)
+
+
+class CategoryAgg(NamedTuple):
+    count: int
+    total: float
+    version: int
+
+
+def _apply_deltas(connection, deltas: _Deltas, base_version: int = 1) -> None:
+    stats_rows = [
+        {
+            "category": cat,
+            "price_count": c,
+            "price_sum": s,
+            "price_sumsq": sq,
+            "version": base_version,
+        }
+        for cat, (c, s, sq) in deltas.stats.items()
+    ]
+    stmt = sqlite_insert(CategoryStats)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[CategoryStats.category],
+            set_={
+                "price_count": CategoryStats.price_count + stmt.excluded.price_count,
+                "price_sum": CategoryStats.price_sum + stmt.excluded.price_sum,
+                "price_sumsq": CategoryStats.price_sumsq + stmt.excluded.price_sumsq,
+                "version": CategoryStats.version + 1,
+            },
+        ),
+        stats_rows,
+    )
+
+    bucket_rows = [
+        {"category": cat, "bucket": b, "count": n}
+        for (cat, b), n in deltas.buckets.items()
+        if n != 0
+    ]
+    if bucket_rows:
+        stmt = sqlite_insert(CategoryPriceBucket)
+        connection.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[CategoryPriceBucket.category, CategoryPriceBucket.bucket],
+                set_={"count": CategoryPriceBucket.count + stmt.excluded.count},
+            ),
+            bucket_rows,
+        )
+        connection.execute(
+            CategoryPriceBucket.__table__.delete().where(CategoryPriceBucket.count <= 0)
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_category_stats(session: Session, flush_context) -> None:
+    # в after_flush списки new/dirty/deleted и история атрибутов ещё до-flush-овые
+    deltas = _Deltas()
+    for obj in session.new:
+        if isinstance(obj, Tender):
+            deltas.add(obj.category, obj.price_amount, +1)
+    for obj in session.deleted:
+        if isinstance(obj, Tender):
+            deltas.add(
+                committed_value(obj, "category"),
+                committed_value(obj, "price_amount"),
+                -1,
+            )
+    for obj in session.dirty:
+        if not isinstance(obj, Tender):
+            continue
+        old_cat = committed_value(obj, "category")
+        old_price = committed_value(obj, "price_amount")
+        if old_cat == obj.category and old_price == obj.price_amount:
+            continue
+        deltas.add(old_cat, old_price, -1)
+        deltas.add(obj.category, obj.price_amount, +1)
+
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+
+
+def get_category_stats(
+    db: Session, categories: Iterable[str]
+) -> Dict[str, CategoryAgg]:
+    """Количество, сумма цен и версия по категориям — чтение по первичному ключу."""
+    categories = list({c for c in categories if c})
+    if not categories:
+        return {}
+    rows = db.execute(
+        select(
+            CategoryStats.category,
+            CategoryStats.price_count,
+            CategoryStats.price_sum,
+            CategoryStats.version,
+        ).where(CategoryStats.category.in_(categories))
+    ).all()
+    return {cat: CategoryAgg(cnt, total, ver) for cat, cnt, total, ver in rows}
+
+
+def category_quantiles(
+    db: Session, category: str, qs: Iterable[float] = (0.5, 0.9)
+) -> Dict[float, Optional[float]]:
+    """Квантили цен категории по скетчу."""
+    buckets = db.execute(
+        select(CategoryPriceBucket.bucket, CategoryPriceBucket.count)
+        .where(CategoryPriceBucket.category == category)
+        .order_by(CategoryPriceBucket.bucket)
+    ).all()
+    total = sum(n for _, n in buckets)
+    result: Dict[float, Optional[float]] = {}
+    for q in qs:
+        if total == 0:
+            result[q] = None
+            continue
+        rank = q * (total - 1)
+        seen = 0
+        for b, n in buckets:
+            seen += n
+            if seen > rank:
+                result[q] = bucket_value(b)
+                break
+    return result
+
+
+def rebuild_category_stats(db: Session) -> int:
+    """
+    Полная пересборка статистики по таблице тендеров.
+    Версии продолжают расти, чтобы ранее сохранённые оценки риска считались
+    устаревшими. Возвращает количество категорий.
+    """
+    base_version = (db.query(func.max(CategoryStats.version)).scalar() or 0) + 1
+    db.execute(CategoryPriceBucket.__table__.delete())
+    db.execute(CategoryStats.__table__.delete())
+
+    deltas = _Deltas()
+    rows = db.execute(
+        select(Tender.category, Tender.price_amount).execution_options(yield_per=10000)
+    )
+    for category, price in rows:
+        deltas.add(category, price, +1)
+    if deltas:
+        _apply_deltas(db.connection(), deltas, base_version)
+    db.commit()
+    return len(deltas.stats)
+
+
+def ensure_category_stats(db: Session) -> None:
+    """Строит статистику при первом запуске на уже заполненной базе."""
+    has_stats = db.query(CategoryStats.category).first() is not None
+    if not has_stats and db.query(func.count(Tender.id)).scalar():
+        rebuild_category_stats(db)
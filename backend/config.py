@@ -0,0 +1,52 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """Настройки backend; переопределяются переменными окружения AI_PROCURE_*."""
+
+    model_config = SettingsConfigDict(env_prefix="AI_PROCURE_")
+
+    # --- LLM (Ollama) ---
+    ollama_host: str = "http://127.0.0.1:11434"
+    llm_model: str = "llama3"
+    # одновременных генераций и ожидающих в очереди запросов
+    llm_max_concurrency: int = 2
+    llm_max_queue: int = 8
+    # таймаут одной генерации, секунды
+    llm_timeout_seconds: float = 120.0
+
+    # --- кэш ответов LLM ---
+    llm_cache_enabled: bool = True
+    # записей в памяти процесса (LRU)
+    llm_cache_memory_entries: int = 256
+    # срок жизни записи и предельный объём ответов в SQLite
+    llm_cache_ttl_seconds: float = 7 * 24 * 3600
+    llm_cache_max_bytes: int = 50 * 1024 * 1024
+
+    # --- фоновые задания AI-анализа ---
+    # одновременно обрабатываемых тендеров; остальные места пула генераций
+    # остаются интерактивным запросам
+    ai_job_workers: int = 1
+
+    # --- поиск похожих тендеров ---
+    # размерность хэшированных векторов TF-IDF (при изменении нужна пересборка)
+    similarity_dim: int = 256
+
+    # --- контекст тендеров для чата ---
+    # сколько упомянутых в сообщении тендеров подставлять в промпт
+    chat_max_tenders: int = 5
+    # кэш собранных блоков контекста
+    context_cache_entries: int = 512
+    context_cache_ttl_seconds: float = 300.0
+
+    # --- бюджет промпта ---
+    # оценка размера без токенизатора: символов на токен
+    prompt_chars_per_token: float = 3.0
+    # предельный размер промпта, токены; окно Ollama по умолчанию — 2048
+    # токенов на промпт и ответ вместе
+    prompt_max_tokens: int = 1500
+    # предел для одного длинного поля (описание тендера), токены
+    prompt_field_tokens: int = 400
+
+
+settings = Settings()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./ai_procure.db"
@@ -7,6 +7,16 @@ engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: читатели не блокируются пишущей транзакцией и наоборот
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -20,3 +30,54 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def migrate_schema():
+    """
+    Создаёт таблицы и добавляет недостающие колонки и индексы в уже
+    существующие таблицы SQLite (create_all сам по себе их не меняет).
+    """
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} "
+                ddl += col.type.compile(dialect=engine.dialect)
+                if col.default is not None and col.default.is_scalar:
+                    ddl += f" DEFAULT {_sql_literal(col.default.arg)}"
+                conn.exec_driver_sql(ddl)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def init_storage():
+    """
+    Схема и производные данные (поисковый индекс, статистика категорий,
+    векторы похожести) — для backend и для скриптов, пишущих в ту же базу.
+    Импорт модулей заодно регистрирует их слушатели сессии.
+    """
+    from .category_stats import ensure_category_stats
+    from .search import ensure_search_index
+    from .similarity import ensure_similarity_index
+    from .suppliers import ensure_supplier_categories
+    from . import llm_cache  # noqa: F401  сброс кэша LLM при изменении тендеров
+
+    migrate_schema()
+    with engine.begin() as conn:
+        ensure_search_index(conn)
+    with SessionLocal() as db:
+        ensure_category_stats(db)
+        ensure_supplier_categories(db)
+        ensure_similarity_index(db)
@@ -0,0 +1,100 @@
+"""
+Потоковая выгрузка тендеров вместе с флагами риска (NDJSON или CSV).
+
+Тендеры читаются курсором порциями по EXPORT_CHUNK_SIZE (yield_per), флаги
+для каждой порции подгружаются одним запросом по id, и строки сразу отдаются
+клиенту — в памяти находится только текущая порция, сколько бы ни было строк.
+"""
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import select
+
+from .db import SessionLocal
+from .models import RiskFlag, Tender
+from .schemas import TenderOut
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FIELDS: List[str] = list(TenderOut.model_fields)
+CSV_FIELDS: List[str] = EXPORT_FIELDS + ["risk_flag_codes", "risk_flags_json"]
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def iter_tenders_with_flags(
+    category: Optional[str] = None,
+    platform: Optional[str] = None,
+    risk_level: Optional[str] = None,
+) -> Iterator[Dict]:
+    """Тендеры (dict) с ключом risk_flags, в порядке id; своя сессия на всю выгрузку."""
+    stmt = select(*(getattr(Tender, f) for f in EXPORT_FIELDS)).order_by(Tender.id)
+    if category:
+        stmt = stmt.where(Tender.category == category)
+    if platform:
+        stmt = stmt.where(Tender.platform == platform)
+    if risk_level:
+        stmt = stmt.where(Tender.risk_level == risk_level)
+
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for chunk in result.partitions():
+            rows = [dict(zip(EXPORT_FIELDS, map(_plain, row))) for row in chunk]
+            flags: Dict[int, List[Dict]] = defaultdict(list)
+            flag_rows = db.execute(
+                select(
+                    RiskFlag.tender_id,
+                    RiskFlag.code,
+                    RiskFlag.description,
+                    RiskFlag.weight,
+                )
+                .where(RiskFlag.tender_id.in_([r["id"] for r in rows]))
+                .order_by(RiskFlag.id)
+            )
+            for tender_id, code, description, weight in flag_rows:
+                flags[tender_id].append(
+                    {"code": code, "description": description, "weight": weight}
+                )
+            for row in rows:
+                row["risk_flags"] = flags.get(row["id"], [])
+                yield row
+    finally:
+        db.close()
+
+
+def iter_ndjson(rows: Iterator[Dict]) -> Iterator[str]:
+    lines: List[str] = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines.clear()
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def iter_csv(rows: Iterator[Dict]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        flags = row.pop("risk_flags")
+        row["risk_flag_codes"] = ";".join(f["code"] for f in flags)
+        row["risk_flags_json"] = json.dumps(flags, ensure_ascii=False)
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_CHUNK_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    yield buf.getvalue()
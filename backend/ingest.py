@@ -0,0 +1,425 @@
+import csv
+import io
+import time
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import models
+from . import suppliers  # noqa: F401  синхронизация supplier_categories при flush
+from .risk_engine import RISK_CHUNK_SIZE, compute_risk_for_tenders
+from .schemas import TenderCreate
+
+DEFAULT_BATCH_SIZE = 1000
+# Размер блока чтения загруженного файла (байт)
+READ_CHUNK_SIZE = 1024 * 1024
+# Сколько отклонённых строк возвращать в ответе (остальные только считаются)
+MAX_REJECTED_REPORTED = 100
+# Поля тендера, которые берутся из строки CSV или записи парсера
+TENDER_ROW_FIELDS = (
+    "external_id",
+    "platform",
+    "customer_name",
+    "subject",
+    "description_raw",
+    "price_amount",
+    "price_currency",
+    "category",
+    "region",
+)
+
+
+def tender_data_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Проверенные схемой поля тендера из строки CSV или записи парсера."""
+    return TenderCreate(
+        external_id=row.get("external_id"),
+        platform=row.get("platform"),
+        customer_name=row.get("customer_name"),
+        subject=row.get("subject"),
+        description_raw=row.get("description_raw"),
+        price_amount=(
+            float(row["price_amount"]) if row.get("price_amount") else None
+        ),
+        price_currency=row.get("price_currency") or "KZT",
+        category=row.get("category"),
+        region=row.get("region"),
+    ).model_dump()
+
+
+def tender_from_csv_row(row: Dict[str, str]) -> models.Tender:
+    """Преобразует строку CSV в модель тендера (через схему валидации)."""
+    return models.Tender(**tender_data_from_row(row))
+
+
+def supplier_from_csv_row(row: Dict[str, str]) -> models.Supplier:
+    """Преобразует строку CSV в модель поставщика."""
+    return models.Supplier(
+        name=row.get("name"),
+        bin_iin=row.get("bin_iin"),
+        region=row.get("region"),
+        categories=row.get("categories"),
+        avg_contract_size=(
+            float(row["avg_contract_size"]) if row.get("avg_contract_size") else None
+        ),
+        contracts_count=(
+            int(row["contracts_count"]) if row.get("contracts_count") else None
+        ),
+        win_rate=float(row["win_rate"]) if row.get("win_rate") else None,
+        risk_score=float(row["risk_score"]) if row.get("risk_score") else 0.0,
+    )
+
+
+def iter_csv_rows(
+    fileobj: BinaryIO, chunk_size: int = READ_CHUNK_SIZE
+) -> Iterator[Dict[str, str]]:
+    """
+    Потоково читает CSV из бинарного файла блоками по chunk_size байт.
+    В памяти одновременно находится только текущий блок, а не весь файл.
+    BOM (utf-8-sig от Excel/pandas) снимается автоматически.
+    """
+    buffered = io.BufferedReader(fileobj, buffer_size=chunk_size)
+    text = io.TextIOWrapper(buffered, encoding="utf-8-sig", newline="")
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        # отвязываем обёртки, чтобы они не закрыли исходный файл
+        text.detach().detach()
+
+
+class IngestTimer:
+    """Накопительный таймер фаз загрузки (секунды на фазу)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def add(self, phase: str, since: float) -> float:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - since)
+        return now
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+
+def _add_batch(db: Session, batch: List) -> Dict[str, List[int]]:
+    db.add_all(batch)
+    db.flush()
+    return {"new_ids": [obj.id for obj in batch], "updated_ids": []}
+
+
+def _upsert_batch(
+    db: Session, batch: List[Tuple[Dict[str, Any], List[str]]]
+) -> Dict[str, List[int]]:
+    """
+    Вставка и обновление пачки по (platform, external_id), flush без commit.
+    У известных тендеров меняются только поля, присутствующие в строке
+    (категорию или регион, проставленные вручную, строка без них не затирает);
+    тендер без фактических изменений не обновляется. Тендеры без external_id
+    всегда вставляются.
+    """
+    T = models.Tender
+    keys = {(d["platform"], d["external_id"]) for d, _ in batch if d["external_id"]}
+    existing: Dict[Tuple, models.Tender] = {}
+    for platform in {p for p, _ in keys}:
+        ext_ids = [e for p, e in keys if p == platform]
+        for start in range(0, len(ext_ids), RISK_CHUNK_SIZE):
+            chunk = ext_ids[start : start + RISK_CHUNK_SIZE]
+            known = db.query(T).filter(
+                T.platform == platform, T.external_id.in_(chunk)
+            )
+            for t in known:
+                existing[(t.platform, t.external_id)] = t
+
+    new: List[models.Tender] = []
+    updated: List[models.Tender] = []
+    for data, fields in batch:
+        key = (data["platform"], data["external_id"])
+        tender = existing.get(key) if data["external_id"] else None
+        if tender is None:
+            tender = models.Tender(**data)
+            db.add(tender)
+            new.append(tender)
+            if data["external_id"]:
+                existing[key] = tender
+            continue
+        for field in fields:
+            setattr(tender, field, data[field])
+        # id есть только у уже сохранённых (у новых из этой пачки его ещё нет)
+        if tender.id is not None and db.is_modified(tender):
+            updated.append(tender)
+    db.flush()
+    return {
+        "new_ids": [t.id for t in new],
+        "updated_ids": sorted({t.id for t in updated}),
+    }
+
+
+def _tender_upsert_row(row: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Поля тендера и список тех из них, что есть в строке (для обновления)."""
+    return tender_data_from_row(row), [f for f in TENDER_ROW_FIELDS if f in row]
+
+
+def _insert_in_batches(
+    db: Session,
+    rows: Iterator[Dict[str, str]],
+    build: Callable[[Dict[str, str]], object],
+    batch_size: int,
+    timer: IngestTimer,
+    write: Callable[[Session, List], Dict[str, List[int]]] = _add_batch,
+    on_batch: Optional[Callable[[Dict[str, List[int]]], None]] = None,
+) -> Dict:
+    """
+    Общая часть загрузки: разбор строк, отбраковка невалидных и запись
+    пачками через flush (без commit; commit может сделать on_batch).
+    Возвращает id вставленных и обновлённых записей и сведения об
+    отклонённых строках.
+    """
+    new_ids: List[int] = []
+    updated_ids: List[int] = []
+    rejected: List[Dict] = []
+    rejected_count = 0
+    batch: List = []
+    row_no = 0
+
+    def flush_batch():
+        t = time.perf_counter()
+        ids = write(db, batch)
+        new_ids.extend(ids["new_ids"])
+        updated_ids.extend(ids["updated_ids"])
+        batch.clear()
+        timer.add("insert", t)
+        if on_batch is not None:
+            on_batch(ids)
+
+    t = time.perf_counter()
+    for row in rows:
+        row_no += 1
+        try:
+            batch.append(build(row))
+        except (ValueError, ValidationError) as e:
+            rejected_count += 1
+            if len(rejected) < MAX_REJECTED_REPORTED:
+                rejected.append({"row": row_no, "error": str(e).splitlines()[0]})
+        t = timer.add("parse", t)
+        if len(batch) >= batch_size:
+            flush_batch()
+            t = time.perf_counter()
+    timer.add("parse", t)
+    if batch:
+        flush_batch()
+
+    return {
+        "new_ids": new_ids,
+        "updated_ids": updated_ids,
+        "rows_total": row_no,
+        "rejected": rejected_count,
+        "rejected_rows": rejected,
+    }
+
+
+def _summary(result: Dict, batch_size: int, timer: IngestTimer) -> Dict:
+    total = timer.total
+    written = len(result["new_ids"]) + len(result["updated_ids"])
+    return {
+        "rows_total": result["rows_total"],
+        "inserted": len(result["new_ids"]),
+        "updated": len(result["updated_ids"]),
+        "rejected": result["rejected"],
+        "rejected_rows": result["rejected_rows"],
+        "batch_size": batch_size,
+        "rows_per_second": written / total if total > 0 else 0.0,
+        "total_seconds": total,
+    }
+
+
+def _risk_dirty_ids(db: Session, tender_ids: List[int]) -> List[int]:
+    """Тендеры, чей риск нужно пересчитать (новые и с изменёнными полями правил)."""
+    T = models.Tender
+    result: List[int] = []
+    for start in range(0, len(tender_ids), RISK_CHUNK_SIZE):
+        chunk = tender_ids[start : start + RISK_CHUNK_SIZE]
+        result.extend(
+            tid
+            for (tid,) in db.query(T.id).filter(T.id.in_(chunk), T.risk_dirty.is_(True))
+        )
+    return result
+
+
+def _comparable_price_ids(db: Session, tender_ids: List[int]) -> List[int]:
+    """Тендеры с ценой, но без категории — их цена сравнивается с похожими."""
+    T = models.Tender
+    result: List[int] = []
+    for start in range(0, len(tender_ids), RISK_CHUNK_SIZE):
+        chunk = tender_ids[start : start + RISK_CHUNK_SIZE]
+        result.extend(
+            tid
+            for (tid,) in db.query(T.id).filter(
+                T.id.in_(chunk),
+                T.price_amount.is_not(None),
+                (T.category.is_(None)) | (T.category == ""),
+            )
+        )
+    return result
+
+
+def bulk_ingest_tenders(
+    db: Session,
+    rows: Iterator[Dict[str, str]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict:
+    """
+    Пакетная загрузка тендеров в одной транзакции.
+
+    Строки записываются пачками по batch_size (flush без commit): новые
+    тендеры вставляются, уже известные по (platform, external_id)
+    обновляются, поэтому повторная загрузка того же файла не создаёт дублей.
+    Затем один проход расчёта риска по новым и изменившимся тендерам и один
+    commit. Возвращает сводку: количество строк, отклонённые строки, скорость
+    и время каждой фазы.
+    """
+    timer = IngestTimer()
+    try:
+        result = _insert_in_batches(
+            db, rows, _tender_upsert_row, batch_size, timer, write=_upsert_batch
+        )
+
+        # один проход расчёта риска по новым и изменившимся тендерам
+        t = time.perf_counter()
+        stale = _risk_dirty_ids(db, result["new_ids"] + result["updated_ids"])
+        compute_risk_for_tenders(db, stale, commit=False)
+        t = timer.add("risk", t)
+
+        db.commit()
+        t = timer.add("commit", t)
+    except Exception:
+        db.rollback()
+        raise
+
+    # OVERPRICE_SIMILAR ищет похожие тендеры среди закоммиченных векторов,
+    # поэтому тендеры без категории из этой загрузки досчитываем после commit
+    uncategorized = _comparable_price_ids(db, result["new_ids"])
+    if uncategorized:
+        compute_risk_for_tenders(db, uncategorized)
+        timer.add("risk", t)
+
+    summary = _summary(result, batch_size, timer)
+    summary.update(
+        parse_seconds=timer.phases.get("parse", 0.0),
+        insert_seconds=timer.phases.get("insert", 0.0),
+        risk_seconds=timer.phases.get("risk", 0.0),
+        commit_seconds=timer.phases.get("commit", 0.0),
+    )
+    return summary
+
+
+def stream_ingest_tenders(
+    db: Session,
+    records: Iterable[Dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_batch: Optional[Callable[[Dict], None]] = None,
+) -> Dict:
+    """
+    Поточная загрузка записей тендеров (например, прямо из парсера) без
+    промежуточного CSV, с тем же upsert по (platform, external_id).
+
+    Каждая пачка из batch_size записей — отдельная транзакция: upsert,
+    обновление статистики категорий (слушателем при flush), пересчёт риска
+    новых и изменившихся тендеров и commit. Прерванная загрузка сохраняет уже
+    принятые пачки, память не растёт с объёмом выгрузки. on_batch получает
+    накопленные счётчики после каждой пачки.
+    """
+    timer = IngestTimer()
+    totals = {"inserted": 0, "updated": 0, "rescored": 0, "batches": 0}
+
+    def commit_batch(ids: Dict[str, List[int]]) -> None:
+        t = time.perf_counter()
+        try:
+            stale = _risk_dirty_ids(db, ids["new_ids"] + ids["updated_ids"])
+            compute_risk_for_tenders(db, stale, commit=False)
+            t = timer.add("risk", t)
+            db.commit()
+            t = timer.add("commit", t)
+        except Exception:
+            db.rollback()
+            raise
+        # см. bulk_ingest_tenders: похожие тендеры видны только после commit
+        uncategorized = _comparable_price_ids(db, ids["new_ids"])
+        if uncategorized:
+            compute_risk_for_tenders(db, uncategorized)
+            timer.add("risk", t)
+        totals["inserted"] += len(ids["new_ids"])
+        totals["updated"] += len(ids["updated_ids"])
+        totals["rescored"] += len(stale)
+        totals["batches"] += 1
+        if on_batch is not None:
+            on_batch(dict(totals))
+
+    try:
+        result = _insert_in_batches(
+            db,
+            records,
+            _tender_upsert_row,
+            batch_size,
+            timer,
+            write=_upsert_batch,
+            on_batch=commit_batch,
+        )
+    except Exception:
+        db.rollback()
+        raise
+    summary = _summary(result, batch_size, timer)
+    summary.update(
+        rescored=totals["rescored"],
+        batches=totals["batches"],
+        **{f"{phase}_seconds": v for phase, v in timer.phases.items()},
+    )
+    return summary
+
+
+def load_checkpoint(db: Session, source: str) -> Optional[Tuple[str, str]]:
+    """Отметка синхронизации источника: (announce_date, last_id) или None."""
+    cp = db.get(models.SyncCheckpoint, source)
+    if cp is None or cp.announce_date is None:
+        return None
+    return cp.announce_date, cp.last_id
+
+
+def save_checkpoint(db: Session, source: str, announce_date: str, last_id: str) -> None:
+    cp = db.get(models.SyncCheckpoint, source)
+    if cp is None:
+        cp = models.SyncCheckpoint(source=source)
+        db.add(cp)
+    cp.announce_date = announce_date
+    cp.last_id = last_id
+    db.commit()
+
+
+def bulk_ingest_suppliers(
+    db: Session,
+    rows: Iterator[Dict[str, str]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict:
+    """Пакетная загрузка поставщиков в одной транзакции."""
+    timer = IngestTimer()
+    try:
+        result = _insert_in_batches(
+            db, rows, supplier_from_csv_row, batch_size, timer
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return _summary(result, batch_size, timer)
@@ -0,0 +1,240 @@
+"""
+Асинхронные задания загрузки CSV.
+
+Клиент создаёт задание (POST /ingest/jobs), затем передаёт файл телом
+PUT-запроса — как есть, без multipart, обычно chunked. Блоки тела по мере
+получения уходят через ограниченную очередь потоку загрузки, который
+разбирает CSV и пишет пачками: тендеры — через stream_ingest_tenders
+(commit и расчёт риска на каждую пачку), поставщики — bulk_ingest_suppliers.
+Временных файлов нет, в памяти не больше QUEUE_CHUNKS блоков: если загрузка
+не успевает, приём тела ждёт её.
+
+PUT отвечает, как только тело получено целиком; прогресс и итог клиент
+смотрит через GET /ingest/jobs/{id}. Тело нигде не сохраняется, поэтому
+задание, прерванное перезапуском сервера, помечается failed и файл нужно
+отправить заново.
+"""
+import csv
+import io
+import logging
+import queue
+import threading
+from datetime import datetime
+from typing import AsyncIterator, Dict
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from .db import SessionLocal
+from .ingest import bulk_ingest_suppliers, iter_csv_rows, stream_ingest_tenders
+from .models import IngestJob
+from .schemas import IngestJobCreate
+
+logger = logging.getLogger(__name__)
+
+# сколько полученных блоков тела может ждать разбора
+QUEUE_CHUNKS = 16
+# как часто приём тела проверяет, жив ли поток загрузки, секунды
+PUT_POLL_SECONDS = 1.0
+
+FINISHED_STATUSES = ("done", "failed")
+ACTIVE_STATUSES = ("receiving", "running")
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Файл только для чтения поверх очереди блоков: None в очереди — конец
+    данных, исключение — обрыв передачи (поднимается в читающем потоке).
+    """
+
+    def __init__(self, chunks: "queue.Queue"):
+        self._chunks = chunks
+        self._buf = memoryview(b"")
+        self._eof = False
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf and not self._eof:
+            item = self._chunks.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                self._buf = memoryview(item)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        self.bytes_read += n
+        return n
+
+
+class IngestJobRunner:
+    def __init__(self):
+        self._threads: Dict[int, threading.Thread] = {}
+
+    def create_job(self, db: Session, params: IngestJobCreate) -> IngestJob:
+        job = IngestJob(**params.model_dump())
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+
+    # ----- приём тела (event loop) -----
+
+    async def receive(self, job: IngestJob, chunks: AsyncIterator[bytes]) -> bool:
+        """
+        Передаёт тело запроса потоку загрузки. False — задание уже не ждёт
+        данных (повторный PUT). Возвращается, когда тело получено целиком,
+        клиент оборвал передачу или загрузка остановилась с ошибкой.
+        """
+        claimed = await run_in_threadpool(
+            self._update, job.id, ("pending",), status="receiving"
+        )
+        if not claimed:
+            return False
+
+        chunk_queue: "queue.Queue" = queue.Queue(maxsize=QUEUE_CHUNKS)
+        reader = _ChunkReader(chunk_queue)
+        thread = threading.Thread(
+            target=self._run,
+            args=(job.id, job.kind, job.batch_size, reader),
+            name=f"ingest-job-{job.id}",
+            daemon=True,
+        )
+        self._threads[job.id] = thread
+        thread.start()
+
+        received = 0
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                received += len(chunk)
+                if not await run_in_threadpool(self._put, chunk_queue, chunk, thread):
+                    # загрузка остановилась (ошибка в CSV) — остаток тела не нужен
+                    return True
+        except ClientDisconnect:
+            # клиент оборвал передачу: загрузка откатит текущую пачку
+            self._put_nowait(chunk_queue, ConnectionError("Передача файла прервана"))
+            return True
+        except BaseException:
+            self._put_nowait(chunk_queue, ConnectionError("Передача файла прервана"))
+            raise
+        await run_in_threadpool(self._put, chunk_queue, None, thread)
+        await run_in_threadpool(self._received, job.id, received)
+        return True
+
+    def _received(self, job_id: int, received: int) -> None:
+        # загрузка могла успеть закончиться: статус меняем, только если нет
+        self._update(job_id, ("receiving",), status="running")
+        self._update(
+            job_id, ACTIVE_STATUSES + FINISHED_STATUSES, bytes_received=received
+        )
+
+    @staticmethod
+    def _put(chunk_queue: "queue.Queue", item, thread: threading.Thread) -> bool:
+        """Кладёт блок в очередь; False, если поток загрузки уже завершился."""
+        while thread.is_alive():
+            try:
+                chunk_queue.put(item, timeout=PUT_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _put_nowait(chunk_queue: "queue.Queue", item) -> None:
+        # в полную очередь место освобождаем: данные всё равно не нужны
+        while True:
+            try:
+                chunk_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    chunk_queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    # ----- загрузка (отдельный поток) -----
+
+    def _run(self, job_id: int, kind: str, batch_size: int, reader: _ChunkReader):
+        def progress(totals: Dict) -> None:
+            self._update(
+                job_id,
+                ACTIVE_STATUSES,
+                bytes_read=reader.bytes_read,
+                inserted=totals["inserted"],
+                updated=totals["updated"],
+            )
+
+        try:
+            with SessionLocal() as db:
+                rows = iter_csv_rows(reader)
+                if kind == "tenders":
+                    summary = stream_ingest_tenders(db, rows, batch_size, progress)
+                else:
+                    summary = bulk_ingest_suppliers(db, rows, batch_size)
+        except ConnectionError as e:
+            logger.warning("Задание загрузки %s: %s", job_id, e)
+            self._finish(job_id, reader, "failed", error=str(e))
+        except (UnicodeDecodeError, csv.Error) as e:
+            logger.warning("Задание загрузки %s: некорректный CSV: %s", job_id, e)
+            self._finish(job_id, reader, "failed", error=f"Некорректный CSV: {e}")
+        except Exception as e:
+            logger.exception("Задание загрузки %s прервано", job_id)
+            self._finish(job_id, reader, "failed", error=str(e) or type(e).__name__)
+        else:
+            self._finish(
+                job_id,
+                reader,
+                "done",
+                rows_total=summary["rows_total"],
+                inserted=summary["inserted"],
+                updated=summary["updated"],
+                rejected=summary["rejected"],
+            )
+        finally:
+            self._threads.pop(job_id, None)
+
+    def _finish(self, job_id: int, reader: _ChunkReader, status: str, **values):
+        self._update(
+            job_id,
+            ACTIVE_STATUSES,
+            status=status,
+            bytes_read=reader.bytes_read,
+            finished_at=datetime.utcnow(),
+            **values,
+        )
+
+    @staticmethod
+    def _update(job_id: int, statuses, **values) -> bool:
+        """Обновляет задание, если оно в одном из statuses (без гонок статусов)."""
+        with SessionLocal() as db:
+            updated = db.execute(
+                update(IngestJob)
+                .where(IngestJob.id == job_id, IngestJob.status.in_(statuses))
+                .values(**values)
+            ).rowcount
+            db.commit()
+        return bool(updated)
+
+    def fail_interrupted(self) -> int:
+        """Помечает failed задания, оборванные остановкой процесса."""
+        with SessionLocal() as db:
+            count = db.execute(
+                update(IngestJob)
+                .where(IngestJob.status.in_(ACTIVE_STATUSES))
+                .values(
+                    status="failed",
+                    error="Загрузка прервана перезапуском сервера",
+                    finished_at=datetime.utcnow(),
+                )
+            ).rowcount
+            db.commit()
+        return count
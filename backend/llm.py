@@ -0,0 +1,226 @@
+"""
+Асинхронный клиент LLM с ограничением параллелизма и контролем очереди.
+
+Генерации выполняются через ollama.AsyncClient в event loop и не занимают
+пул потоков FastAPI, поэтому медленные ответы модели не мешают CRUD-запросам.
+Одновременно идёт не больше llm_max_concurrency генераций, ещё
+llm_max_queue запросов могут ждать; остальные сразу получают LLMBusyError
+с оценкой времени ожидания (endpoint отвечает 429 + Retry-After).
+"""
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Protocol
+
+from ollama import AsyncClient
+
+from .config import settings
+from .prompt_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class LLMBusyError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM перегружена, повторите через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+class LLMTimeoutError(Exception):
+    pass
+
+
+class LLMTransport(Protocol):
+    async def generate(self, model: str, prompt: str) -> str: ...
+
+    def stream(self, model: str, prompt: str) -> AsyncIterator[str]: ...
+
+
+class OllamaTransport:
+    def __init__(self, host: str, timeout: float):
+        self._client = AsyncClient(host=host, timeout=timeout)
+
+    async def generate(self, model: str, prompt: str) -> str:
+        res = await self._client.generate(model=model, prompt=prompt)
+        return res["response"]
+
+    async def stream(self, model: str, prompt: str) -> AsyncIterator[str]:
+        parts = await self._client.generate(model=model, prompt=prompt, stream=True)
+        async for part in parts:
+            if part["response"]:
+                yield part["response"]
+
+
+class LLMClient:
+    # вес нового замера в скользящей средней длительности генерации
+    EMA_ALPHA = 0.2
+
+    def __init__(
+        self,
+        transport: Optional[LLMTransport] = None,
+        model: str = settings.llm_model,
+        max_concurrency: int = settings.llm_max_concurrency,
+        max_queue: int = settings.llm_max_queue,
+        timeout: float = settings.llm_timeout_seconds,
+    ):
+        self.transport = transport or OllamaTransport(settings.ollama_host, timeout)
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.completed = 0
+        # начальная оценка длительности одной генерации, секунды
+        self.avg_seconds = 20.0
+        # среднее время до первого токена при потоковой генерации
+        self.avg_first_token_seconds: Optional[float] = None
+        # оценка размера промптов, токены
+        self.avg_prompt_tokens: Optional[float] = None
+        self.max_prompt_tokens = 0
+
+    def estimated_wait(self) -> float:
+        """Сколько ждать новому запросу, если он встанет в конец очереди."""
+        rounds = (self.waiting + 1) / self.max_concurrency
+        return math.ceil(rounds) * self.avg_seconds
+
+    def check_admission(self) -> None:
+        """LLMBusyError, если очередь заполнена (до отправки заголовков ответа)."""
+        if self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise LLMBusyError(self.estimated_wait())
+
+    @asynccontextmanager
+    async def slot(self):
+        """Место в пуле генераций; при переполненной очереди — LLMBusyError."""
+        self.check_admission()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            elapsed = time.perf_counter() - started
+            self.avg_seconds += self.EMA_ALPHA * (elapsed - self.avg_seconds)
+
+    def _record_prompt(self, prompt: str) -> int:
+        tokens = estimate_tokens(prompt)
+        self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+        if self.avg_prompt_tokens is None:
+            self.avg_prompt_tokens = float(tokens)
+        else:
+            self.avg_prompt_tokens += self.EMA_ALPHA * (tokens - self.avg_prompt_tokens)
+        if tokens > settings.prompt_max_tokens:
+            logger.warning(
+                "Промпт ~%d токенов превышает бюджет %d",
+                tokens,
+                settings.prompt_max_tokens,
+            )
+        return tokens
+
+    async def generate(self, prompt: str, model: Optional[str] = None) -> str:
+        tokens = self._record_prompt(prompt)
+        started = time.perf_counter()
+        async with self.slot():
+            try:
+                reply = await asyncio.wait_for(
+                    self.transport.generate(model or self.model, prompt),
+                    timeout=self.timeout,
+                )
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise LLMTimeoutError(
+                    f"LLM не ответила за {self.timeout:.0f} с"
+                ) from None
+        self.completed += 1
+        logger.info(
+            "Генерация: промпт ~%d токенов, %.1f с с учётом очереди",
+            tokens,
+            time.perf_counter() - started,
+        )
+        return reply
+
+    async def stream(
+        self, prompt: str, model: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Токены ответа по мере генерации. Занимает место в пуле на всё время
+        потока; таймаут считается на генерацию целиком.
+        Допуск в очередь проверяйте заранее через check_admission().
+        """
+        tokens = self._record_prompt(prompt)
+        async with self.slot():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            deadline = started + self.timeout
+            parts = self.transport.stream(model or self.model, prompt).__aiter__()
+            first = True
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    try:
+                        token = await asyncio.wait_for(parts.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        break
+                    if first:
+                        self._record_first_token(loop.time() - started)
+                        logger.info(
+                            "Потоковая генерация: промпт ~%d токенов, "
+                            "первый токен через %.1f с",
+                            tokens,
+                            loop.time() - started,
+                        )
+                        first = False
+                    yield token
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise LLMTimeoutError(
+                    f"LLM не ответила за {self.timeout:.0f} с"
+                ) from None
+            finally:
+                aclose = getattr(parts, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+        self.completed += 1
+
+    def _record_first_token(self, seconds: float) -> None:
+        if self.avg_first_token_seconds is None:
+            self.avg_first_token_seconds = seconds
+        else:
+            self.avg_first_token_seconds += self.EMA_ALPHA * (
+                seconds - self.avg_first_token_seconds
+            )
+
+    def status(self) -> dict:
+        return {
+            "model": self.model,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "avg_generation_seconds": self.avg_seconds,
+            "avg_first_token_seconds": self.avg_first_token_seconds,
+            "avg_prompt_tokens": self.avg_prompt_tokens,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "prompt_budget_tokens": settings.prompt_max_tokens,
+            "estimated_wait_seconds": self.estimated_wait(),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+llm_client = LLMClient()
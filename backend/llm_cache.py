@@ -0,0 +1,270 @@
+"""
+Кэш ответов LLM по (модель, хэш промпта, версия тендера).
+
+Два уровня: LRU в памяти процесса и таблица llm_cache в SQLite (переживает
+перезапуск и общая для всех воркеров). Записи живут llm_cache_ttl_seconds;
+когда суммарный объём ответов в SQLite превышает llm_cache_max_bytes,
+удаляются давно не использованные.
+
+Записи тендера удаляются автоматически, когда тендер меняется через ORM
+(повторная загрузка, пересчёт риска) — см. слушатель after_flush ниже; пакетный
+пересчёт риска, который пишет в обход ORM, вызывает invalidate_tenders сам.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .db import SessionLocal
+from .models import LLMCacheEntry, Tender
+
+logger = logging.getLogger(__name__)
+
+# сколько id тендеров удалять одним запросом
+INVALIDATE_CHUNK_SIZE = 500
+
+_table = LLMCacheEntry.__table__
+
+
+def tender_version(tender: Tender) -> str:
+    """Версия тендера для ключа кэша: время изменения и версия статистики риска."""
+    updated = tender.updated_at.isoformat() if tender.updated_at else ""
+    return f"{updated}:{tender.risk_stats_version}"
+
+
+def cache_key(model: str, prompt: str, version: str = "") -> str:
+    digest = hashlib.sha256()
+    for part in (model, version, prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(
+        self,
+        memory_entries: int = settings.llm_cache_memory_entries,
+        ttl_seconds: float = settings.llm_cache_ttl_seconds,
+        max_bytes: int = settings.llm_cache_max_bytes,
+        enabled: bool = settings.llm_cache_enabled,
+    ):
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # key -> (ответ, tender_id, момент записи по time.time())
+        self._lru: "OrderedDict[str, Tuple[str, Optional[int], float]]" = OrderedDict()
+        self._by_tender: Dict[int, Set[str]] = {}
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # ----- уровень в памяти -----
+
+    def _remember(
+        self, key: str, response: str, tender_id: Optional[int], stored: float
+    ) -> None:
+        with self._lock:
+            self._lru[key] = (response, tender_id, stored)
+            self._lru.move_to_end(key)
+            if tender_id is not None:
+                self._by_tender.setdefault(tender_id, set()).add(key)
+            while len(self._lru) > self.memory_entries:
+                old_key, (_, old_tender, _) = self._lru.popitem(last=False)
+                self._unlink(old_key, old_tender)
+
+    def _unlink(self, key: str, tender_id: Optional[int]) -> None:
+        if tender_id is None:
+            return
+        keys = self._by_tender.get(tender_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_tender[tender_id]
+
+    def _forget_tenders(self, tender_ids: Iterable[int]) -> None:
+        with self._lock:
+            for tender_id in tender_ids:
+                for key in self._by_tender.pop(tender_id, ()):
+                    self._lru.pop(key, None)
+
+    # ----- публичный интерфейс -----
+
+    def get(self, key: str) -> Optional[str]:
+        """Ответ из кэша или None. Синхронный: из async-кода — через threadpool."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None and now - hit[2] > self.ttl_seconds:
+                del self._lru[key]
+                self._unlink(key, hit[1])
+                hit = None
+            if hit is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return hit[0]
+
+        try:
+            with SessionLocal() as db:
+                entry = db.get(LLMCacheEntry, key)
+                if entry is None:
+                    response = None
+                elif entry.created_at < datetime.utcnow() - timedelta(
+                    seconds=self.ttl_seconds
+                ):
+                    db.delete(entry)
+                    db.commit()
+                    response = None
+                else:
+                    response, tender_id = entry.response, entry.tender_id
+                    stored = now - (datetime.utcnow() - entry.created_at).total_seconds()
+                    entry.last_used_at = datetime.utcnow()
+                    db.commit()
+        except SQLAlchemyError:
+            logger.exception("Чтение кэша LLM не удалось")
+            response = None
+
+        if response is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self._remember(key, response, tender_id, stored)
+        return response
+
+    def put(
+        self, key: str, response: str, model: str, tender_id: Optional[int] = None
+    ) -> None:
+        if not self.enabled or not response:
+            return
+        self._remember(key, response, tender_id, time.time())
+        self.puts += 1
+        try:
+            with SessionLocal() as db:
+                now = datetime.utcnow()
+                db.merge(
+                    LLMCacheEntry(
+                        key=key,
+                        tender_id=tender_id,
+                        model=model,
+                        response=response,
+                        size=len(response.encode("utf-8")),
+                        created_at=now,
+                        last_used_at=now,
+                    )
+                )
+                db.flush()
+                self._evict(db)
+                db.commit()
+        except SQLAlchemyError:
+            # кэш — оптимизация: ошибка записи не должна ломать ответ пользователю
+            logger.exception("Запись в кэш LLM не удалась")
+
+    def _evict(self, db: Session) -> None:
+        """Удаляет просроченные записи и самые старые по использованию сверх max_bytes."""
+        expired_before = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        removed = db.execute(
+            delete(LLMCacheEntry).where(LLMCacheEntry.created_at < expired_before)
+        ).rowcount
+        total = db.execute(select(func.coalesce(func.sum(LLMCacheEntry.size), 0))).scalar()
+        if total > self.max_bytes:
+            victims: List[str] = []
+            rows = db.execute(
+                select(LLMCacheEntry.key, LLMCacheEntry.size).order_by(
+                    LLMCacheEntry.last_used_at
+                )
+            )
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                victims.append(key)
+                total -= size
+            db.execute(delete(LLMCacheEntry).where(LLMCacheEntry.key.in_(victims)))
+            removed += len(victims)
+        self.evictions += removed
+
+    def invalidate_tenders(
+        self, tender_ids: Iterable[int], connection: Optional[Connection] = None
+    ) -> None:
+        """
+        Удаляет записи тендеров. С connection — в её транзакции (удаление
+        откатится вместе с ней), иначе отдельной транзакцией.
+        """
+        ids = sorted(set(tender_ids))
+        if not ids:
+            return
+        self._forget_tenders(ids)
+        self.invalidations += len(ids)
+        if connection is None:
+            with SessionLocal() as db:
+                self._delete_tenders(db.connection(), ids)
+                db.commit()
+        else:
+            self._delete_tenders(connection, ids)
+
+    @staticmethod
+    def _delete_tenders(connection: Connection, ids: List[int]) -> None:
+        for start in range(0, len(ids), INVALIDATE_CHUNK_SIZE):
+            chunk = ids[start : start + INVALIDATE_CHUNK_SIZE]
+            connection.execute(_table.delete().where(_table.c.tender_id.in_(chunk)))
+
+    def clear(self) -> int:
+        with self._lock:
+            self._lru.clear()
+            self._by_tender.clear()
+        with SessionLocal() as db:
+            removed = db.execute(delete(LLMCacheEntry)).rowcount
+            db.commit()
+        return removed
+
+    def status(self) -> dict:
+        with SessionLocal() as db:
+            entries, size = db.execute(
+                select(func.count(), func.coalesce(func.sum(LLMCacheEntry.size), 0))
+            ).one()
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._lru),
+            "stored_entries": entries,
+            "stored_bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+            "puts": self.puts,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+llm_cache = LLMResponseCache()
+
+
+@event.listens_for(Session, "after_flush")
+def _invalidate_changed_tenders(session: Session, flush_context) -> None:
+    # изменённые (в т.ч. пересчитан риск) и удалённые тендеры
+    ids = [
+        obj.id
+        for obj in session.dirty
+        if isinstance(obj, Tender) and session.is_modified(obj)
+    ]
+    ids += [obj.id for obj in session.deleted if isinstance(obj, Tender)]
+    if ids:
+        llm_cache.invalidate_tenders(ids, session.connection())
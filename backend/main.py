@@ -1,21 +1,83 @@
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query
+from fastapi import (
+    FastAPI,
+    UploadFile,
+    File,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session, load_only
+from typing import AsyncIterator, List, Literal, Optional, Tuple
 import csv
-import io
-import re
+import hashlib
+import json
+import math
 
-import ollama
 from pydantic import BaseModel
 
-from .db import Base, engine, get_db
+from .db import SessionLocal, get_db, init_storage
 from . import models
-from .schemas import TenderCreate, TenderOut, TenderReport, RiskFlagOut, SupplierOut
-from .risk_engine import compute_risk_for_tender
+from .schemas import (
+    TenderOut,
+    TenderReport,
+    TenderIngestReport,
+    IngestSummary,
+    CategoryStatsOut,
+    RiskRecomputeReport,
+    RuleStatsOut,
+    TenderPage,
+    TenderSearchPage,
+    SimilarTenderOut,
+    SimilarTenders,
+    RiskFlagOut,
+    SupplierOut,
+    TenderRisks,
+    TenderSuppliers,
+    TenderAnalysisOut,
+    AnalysisJobCreate,
+    AnalysisJobOut,
+    AnalysisJobResult,
+    AnalysisJobResults,
+    IngestJobCreate,
+    IngestJobOut,
+)
+from .risk_engine import (
+    ensure_risk_fresh,
+    load_staleness_aggregates,
+    risk_is_stale,
+    stats_version_for,
+)
+from .risk_batch import recompute_all_risk
+from .risk_rules import rule_metrics
+from .suppliers import rank_suppliers
+from .pagination import CursorError, keyset_page, parse_fields
+from .search import SearchQueryError, search_page
+from .similarity import comparable_price, rebuild_similarity_index
+from .prompt_budget import context_budget
+from .tender_context import (
+    build_tender_context,
+    chat_context,
+    context_cache,
+    find_similar_tenders,
+)
+from .export import iter_csv, iter_ndjson, iter_tenders_with_flags
+from .category_stats import category_quantiles, rebuild_category_stats
+from .llm import LLMBusyError, LLMTimeoutError, llm_client
+from .llm_cache import cache_key, llm_cache, tender_version
+from .ai_jobs import FINISHED_STATUSES, AnalysisJobRunner
+from .ingest import (
+    DEFAULT_BATCH_SIZE,
+    bulk_ingest_suppliers,
+    bulk_ingest_tenders,
+    iter_csv_rows,
+)
+from .ingest_jobs import IngestJobRunner
 
-Base.metadata.create_all(bind=engine)
+init_storage()
 
 app = FastAPI(title="AI-Procure")
 
@@ -28,93 +90,107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# =====================================================================
+#                        ОШИБКИ ОЧЕРЕДИ К LLM
+# =====================================================================
+
+
+@app.exception_handler(LLMBusyError)
+async def llm_busy_handler(request: Request, exc: LLMBusyError):
+    # очередь к модели заполнена — клиент должен повторить позже
+    retry_after = max(1, math.ceil(exc.retry_after))
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "estimated_wait_seconds": retry_after},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+@app.exception_handler(LLMTimeoutError)
+async def llm_timeout_handler(request: Request, exc: LLMTimeoutError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
 # =====================================================================
 #                            ЗАГРУЗКА ДАННЫХ
 # =====================================================================
 
 
-@app.post("/tenders/ingest_csv", response_model=List[TenderOut])
-async def ingest_tenders_csv(
-    file: UploadFile = File(...), db: Session = Depends(get_db)
+def _ingest_upload(ingest, file: UploadFile, batch_size: int, db: Session):
+    """Потоково разбирает загруженный CSV и передаёт строки в пакетную загрузку."""
+    try:
+        return ingest(db, iter_csv_rows(file.file), batch_size=batch_size)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный CSV: {e}")
+
+
+# обычный def: тяжёлая работа с БД выполняется в пуле потоков, не блокируя event loop
+@app.post("/tenders/ingest_csv", response_model=TenderIngestReport)
+def ingest_tenders_csv(
+    file: UploadFile = File(...),
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=50000),
+    db: Session = Depends(get_db),
 ):
-    content = await file.read()
-    text = content.decode("utf-8")
-    reader = csv.DictReader(io.StringIO(text))
-
-    created_tenders: List[models.Tender] = []
-
-    for row in reader:
-        data = TenderCreate(
-            external_id=row.get("external_id"),
-            platform=row.get("platform"),
-            customer_name=row.get("customer_name"),
-            subject=row.get("subject"),
-            description_raw=row.get("description_raw"),
-            price_amount=(
-                float(row["price_amount"]) if row.get("price_amount") else None
-            ),
-            price_currency=row.get("price_currency") or "KZT",
-            category=row.get("category"),
-            region=row.get("region"),
-        )
+    """
+    Пакетная загрузка тендеров: потоковое чтение файла, вставка пачками
+    в одной транзакции (известные по platform + external_id тендеры
+    обновляются), затем один проход расчёта риска по новым и изменившимся.
+    """
+    return _ingest_upload(bulk_ingest_tenders, file, batch_size, db)
+
+
+@app.post("/suppliers/ingest_csv", response_model=IngestSummary)
+def ingest_suppliers_csv(
+    file: UploadFile = File(...),
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=50000),
+    db: Session = Depends(get_db),
+):
+    return _ingest_upload(bulk_ingest_suppliers, file, batch_size, db)
+
+
+# ----- задания загрузки: тело файла передаётся PUT-запросом, прогресс — GET -----
+
+ingest_jobs = IngestJobRunner()
+
+
+@app.on_event("startup")
+async def fail_interrupted_ingest_jobs():
+    ingest_jobs.fail_interrupted()
 
-        tender = models.Tender(**data.dict())
-        db.add(tender)
-        db.commit()
-        db.refresh(tender)
 
-        # первичный расчёт риска
-        compute_risk_for_tender(db, tender)
+def _get_ingest_job(db: Session, job_id: int) -> models.IngestJob:
+    job = db.get(models.IngestJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return job
 
-        created_tenders.append(tender)
 
-    return created_tenders
+@app.post("/ingest/jobs", response_model=IngestJobOut, status_code=201)
+def create_ingest_job(params: IngestJobCreate, db: Session = Depends(get_db)):
+    """Создаёт задание загрузки; данные передаются в PUT /ingest/jobs/{id}/data."""
+    return ingest_jobs.create_job(db, params)
 
 
-@app.post("/suppliers/ingest_csv", response_model=List[SupplierOut])
-async def ingest_suppliers_csv(
-    file: UploadFile = File(...), db: Session = Depends(get_db)
+@app.put("/ingest/jobs/{job_id}/data", response_model=IngestJobOut, status_code=202)
+async def upload_ingest_job_data(
+    job_id: int, request: Request, db: Session = Depends(get_db)
 ):
-    content = await file.read()
-    text = content.decode("utf-8")
-    reader = csv.DictReader(io.StringIO(text))
-
-    suppliers: List[models.Supplier] = []
-
-    for row in reader:
-        s = models.Supplier(
-            name=row.get("name"),
-            bin_iin=row.get("bin_iin"),
-            region=row.get("region"),
-            categories=row.get("categories"),
-            avg_contract_size=(
-                float(row["avg_contract_size"])
-                if row.get("avg_contract_size")
-                else None
-            ),
-            contracts_count=(
-                int(row["contracts_count"]) if row.get("contracts_count") else None
-            ),
-            win_rate=float(row["win_rate"]) if row.get("win_rate") else None,
-            risk_score=float(row["risk_score"]) if row.get("risk_score") else 0.0,
-        )
-        db.add(s)
-        db.commit()
-        db.refresh(s)
-        suppliers.append(s)
+    """
+    Тело запроса — CSV как есть (можно chunked). Строки пишутся пачками
+    по мере получения; ответ приходит, когда тело принято целиком, итог
+    загрузки — в GET /ingest/jobs/{id}.
+    """
+    job = await run_in_threadpool(_get_ingest_job, db, job_id)
+    if not await ingest_jobs.receive(job, request.stream()):
+        raise HTTPException(status_code=409, detail="Данные задания уже переданы")
+    await run_in_threadpool(db.refresh, job)
+    return job
 
-    result = [
-        SupplierOut(
-            id=s.id,
-            name=s.name,
-            region=s.region,
-            match_score=None,
-            avg_contract_size=s.avg_contract_size,
-            win_rate=s.win_rate,
-        )
-        for s in suppliers
-    ]
-    return result
+
+@app.get("/ingest/jobs/{job_id}", response_model=IngestJobOut)
+def get_ingest_job(job_id: int, db: Session = Depends(get_db)):
+    return _get_ingest_job(db, job_id)
 
 
 # =====================================================================
@@ -122,13 +198,25 @@ async def ingest_suppliers_csv(
 # =====================================================================
 
 
-@app.get("/tenders", response_model=List[TenderOut])
+@app.get("/tenders", response_model=TenderPage)
 def list_tenders(
     db: Session = Depends(get_db),
     category: Optional[str] = Query(None),
     platform: Optional[str] = Query(None),
     risk_level: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+    fields: Optional[str] = Query(
+        None, description="Поля через запятую, например id,subject,price_amount"
+    ),
+    with_total: bool = Query(False, description="Посчитать общее число тендеров"),
 ):
+    """Постраничный список тендеров (keyset по created_at, id) с проекцией полей."""
+    try:
+        columns = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     q = db.query(models.Tender)
     if category:
         q = q.filter(models.Tender.category == category)
@@ -137,8 +225,76 @@ def list_tenders(
     if risk_level:
         q = q.filter(models.Tender.risk_level == risk_level)
 
-    q = q.order_by(models.Tender.created_at.desc())
-    return q.all()
+    try:
+        items, next_cursor = keyset_page(q, columns, limit, cursor)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    total = q.order_by(None).count() if with_total else None
+    return TenderPage(items=items, next_cursor=next_cursor, total=total)
+
+
+# объявлен до /tenders/{tender_id}, иначе "search" попадёт в tender_id
+@app.get("/tenders/search", response_model=TenderSearchPage)
+def search_tenders(
+    q: str = Query(..., min_length=1, description="Слова для поиска"),
+    db: Session = Depends(get_db),
+    category: Optional[str] = Query(None),
+    platform: Optional[str] = Query(None),
+    risk_level: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0, le=10000),
+    fields: Optional[str] = Query(
+        "id,subject,customer_name,price_amount,category,region,risk_level",
+        description="Поля через запятую",
+    ),
+):
+    """
+    Полнотекстовый поиск по предмету, описанию и требованиям (FTS5),
+    по убыванию релевантности, с фрагментами совпадений.
+    """
+    try:
+        columns = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    base = db.query(models.Tender)
+    if category:
+        base = base.filter(models.Tender.category == category)
+    if platform:
+        base = base.filter(models.Tender.platform == platform)
+    if risk_level:
+        base = base.filter(models.Tender.risk_level == risk_level)
+
+    try:
+        items, has_more = search_page(base, q, columns, limit, offset)
+    except SearchQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return TenderSearchPage(
+        items=items, next_offset=offset + limit if has_more else None
+    )
+
+
+# объявлен до /tenders/{tender_id}, иначе "export" попадёт в tender_id
+@app.get("/tenders/export")
+def export_tenders(
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    category: Optional[str] = Query(None),
+    platform: Optional[str] = Query(None),
+    risk_level: Optional[str] = Query(None),
+):
+    """Потоковая выгрузка всех тендеров с флагами риска (память не зависит от объёма)."""
+    rows = iter_tenders_with_flags(category, platform, risk_level)
+    if format == "csv":
+        body, media_type = iter_csv(rows), "text/csv; charset=utf-8"
+    else:
+        body, media_type = iter_ndjson(rows), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tenders.{format}"'},
+    )
 
 
 @app.get("/tenders/{tender_id}", response_model=TenderOut)
@@ -149,146 +305,299 @@ def get_tender(tender_id: int, db: Session = Depends(get_db)):
     return tender
 
 
+@app.get("/tenders/{tender_id}/similar", response_model=SimilarTenders)
+def get_similar_tenders(
+    tender_id: int,
+    k: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """Похожие по предмету и описанию тендеры и сравнение цены с ними."""
+    tender = db.query(models.Tender).get(tender_id)
+    if not tender:
+        raise HTTPException(status_code=404, detail="Tender not found")
+
+    similar = find_similar_tenders(db, [tender_id], k)[tender_id]
+    _, median = comparable_price(
+        [(t.id, score, t.price_amount) for t, score in similar]
+    )
+    items = [
+        SimilarTenderOut(
+            id=t.id,
+            subject=t.subject,
+            customer_name=t.customer_name,
+            category=t.category,
+            region=t.region,
+            price_amount=t.price_amount,
+            risk_level=t.risk_level,
+            similarity=score,
+        )
+        for t, score in similar
+    ]
+    ratio = tender.price_amount / median if median and tender.price_amount else None
+    return SimilarTenders(
+        tender_id=tender_id, items=items, median_price=median, price_ratio=ratio
+    )
+
+
 # =====================================================================
 #                       ОТЧЁТ ПО ТЕНДЕРУ + ПОДБОР ПОСТАВЩИКОВ
 # =====================================================================
 
 
 @app.get("/tenders/{tender_id}/report", response_model=TenderReport)
-def get_tender_report(tender_id: int, db: Session = Depends(get_db)):
+def get_tender_report(
+    tender_id: int,
+    k: int = Query(5, ge=1, le=100, description="Сколько лучших поставщиков вернуть"),
+    db: Session = Depends(get_db),
+):
     tender = db.query(models.Tender).get(tender_id)
     if not tender:
         raise HTTPException(status_code=404, detail="Tender not found")
 
-    # пересчёт риска
-    compute_risk_for_tender(db, tender)
+    # пересчёт риска только если сохранённый результат устарел
+    ensure_risk_fresh(db, tender)
 
     flags = (
         db.query(models.RiskFlag).filter(models.RiskFlag.tender_id == tender.id).all()
     )
 
-    suppliers_q = db.query(models.Supplier)
-    if tender.category:
-        suppliers_q = suppliers_q.filter(
-            models.Supplier.categories.ilike(f"%{tender.category}%")
-        )
-    if tender.region:
-        suppliers_q = suppliers_q.filter(
-            (models.Supplier.region == tender.region)
-            | (models.Supplier.region.is_(None))
+    supplier_out = [
+        SupplierOut(
+            id=s.id,
+            name=s.name,
+            region=s.region,
+            match_score=score,
+            avg_contract_size=s.avg_contract_size,
+            win_rate=s.win_rate,
         )
+        for s, score in rank_suppliers(db, tender, k)
+    ]
 
-    suppliers = suppliers_q.limit(5).all()
+    flags_out = [
+        RiskFlagOut(id=f.id, code=f.code, description=f.description, weight=f.weight)
+        for f in flags
+    ]
+
+    tender_out = TenderOut.from_orm(tender)
+
+    analysis = db.get(models.TenderAnalysis, tender.id)
+
+    return TenderReport(
+        tender=tender_out,
+        risk_flags=flags_out,
+        suppliers=supplier_out,
+        ai_analysis=TenderAnalysisOut.model_validate(analysis) if analysis else None,
+    )
 
-    supplier_out: List[SupplierOut] = []
-    for s in suppliers:
-        base_score = 0.5
-        if s.avg_contract_size and tender.price_amount:
-            ratio = tender.price_amount / s.avg_contract_size
-            if 0.5 <= ratio <= 2:
-                base_score += 0.3
-        if s.win_rate is not None:
-            base_score += min(s.win_rate, 0.2)
 
-        supplier_out.append(
+def _etag_response(
+    request: Request, payload: BaseModel, version: str = ""
+) -> Response:
+    """
+    JSON-ответ с ETag по содержимому (и version — данным, от которых ответ
+    зависит, но которых нет в теле); если клиент прислал тот же ETag
+    в If-None-Match — 304 без тела.
+    """
+    body = payload.model_dump_json().encode("utf-8")
+    digest = hashlib.sha256(body + version.encode("utf-8")).hexdigest()
+    etag = '"' + digest[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    sent = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if etag in sent or "*" in sent:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.get("/tenders/{tender_id}/risks", response_model=TenderRisks)
+def get_tender_risks(tender_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Сохранённые риск и флаги тендера без пересчёта (в отличие от /report).
+    Поддерживает If-None-Match.
+    """
+    T = models.Tender
+    tender = (
+        db.query(T)
+        .options(
+            load_only(
+                T.risk_score,
+                T.risk_level,
+                T.risk_dirty,
+                T.risk_stats_version,
+                T.price_amount,
+                T.category,
+            )
+        )
+        .filter(T.id == tender_id)
+        .first()
+    )
+    if tender is None:
+        raise HTTPException(status_code=404, detail="Tender not found")
+    # та же проверка, что перед пересчётом: поля тендера или статистика категории
+    aggregates = load_staleness_aggregates(db, [tender])
+    stats_version = stats_version_for(tender, aggregates)
+    flags = (
+        db.query(models.RiskFlag)
+        .filter(models.RiskFlag.tender_id == tender_id)
+        .order_by(models.RiskFlag.id)
+    )
+    payload = TenderRisks(
+        tender_id=tender_id,
+        risk_score=tender.risk_score or 0.0,
+        risk_level=tender.risk_level or "low",
+        risk_stale=risk_is_stale(tender, aggregates),
+        risk_flags=[RiskFlagOut.model_validate(f) for f in flags],
+    )
+    version = f"{tender.risk_stats_version}:{stats_version}"
+    return _etag_response(request, payload, version)
+
+
+@app.get("/tenders/{tender_id}/suppliers", response_model=TenderSuppliers)
+def get_tender_suppliers(
+    tender_id: int,
+    request: Request,
+    k: int = Query(5, ge=1, le=100, description="Сколько лучших поставщиков вернуть"),
+    db: Session = Depends(get_db),
+):
+    """Лучшие поставщики для тендера (без расчёта риска). Поддерживает If-None-Match."""
+    T = models.Tender
+    tender = (
+        db.query(T)
+        .options(load_only(T.category, T.region, T.price_amount))
+        .filter(T.id == tender_id)
+        .first()
+    )
+    if tender is None:
+        raise HTTPException(status_code=404, detail="Tender not found")
+    payload = TenderSuppliers(
+        tender_id=tender_id,
+        suppliers=[
             SupplierOut(
                 id=s.id,
                 name=s.name,
                 region=s.region,
-                match_score=min(base_score, 1.0),
+                match_score=score,
                 avg_contract_size=s.avg_contract_size,
                 win_rate=s.win_rate,
             )
-        )
+            for s, score in rank_suppliers(db, tender, k)
+        ],
+    )
+    return _etag_response(request, payload)
 
-    flags_out = [
-        RiskFlagOut(id=f.id, code=f.code, description=f.description, weight=f.weight)
-        for f in flags
-    ]
 
-    tender_out = TenderOut.from_orm(tender)
+# =====================================================================
+#                       ПАКЕТНЫЙ ПЕРЕСЧЁТ РИСКА
+# =====================================================================
+
+
+@app.post("/risk/recompute", response_model=RiskRecomputeReport)
+def risk_recompute(db: Session = Depends(get_db)):
+    """Векторизованный пересчёт риска по всем тендерам (одна транзакция)."""
+    return recompute_all_risk(db)
+
 
-    return TenderReport(tender=tender_out, risk_flags=flags_out, suppliers=supplier_out)
+@app.get("/risk/rules/stats", response_model=List[RuleStatsOut])
+def risk_rules_stats():
+    """Время выполнения, число проверок и доля срабатываний по каждому правилу."""
+    return rule_metrics()
 
 
 # =====================================================================
-#                      ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ КОНТЕКСТА
+#                       СТАТИСТИКА ЦЕН ПО КАТЕГОРИЯМ
 # =====================================================================
 
 
-def build_tender_context(db: Session, tender_id: int) -> Optional[str]:
-    """Формирует текстовый контекст по тендеру для ИИ."""
-    tender = db.query(models.Tender).get(tender_id)
-    if not tender:
-        return None
+@app.get("/categories/stats", response_model=List[CategoryStatsOut])
+def list_category_stats(db: Session = Depends(get_db)):
+    result: List[CategoryStatsOut] = []
+    for st in db.query(models.CategoryStats).order_by(models.CategoryStats.category):
+        n = st.price_count
+        mean = st.price_sum / n if n else None
+        std = None
+        if n > 1:
+            var = (st.price_sumsq - n * mean * mean) / (n - 1)
+            std = math.sqrt(max(var, 0.0))
+        q = category_quantiles(db, st.category, (0.5, 0.9))
+        result.append(
+            CategoryStatsOut(
+                category=st.category,
+                price_count=n,
+                price_mean=mean,
+                price_std=std,
+                price_p50=q[0.5],
+                price_p90=q[0.9],
+            )
+        )
+    return result
 
-    compute_risk_for_tender(db, tender)
 
-    flags = (
-        db.query(models.RiskFlag).filter(models.RiskFlag.tender_id == tender.id).all()
-    )
+@app.post("/similarity/rebuild")
+def rebuild_similarity_endpoint(db: Session = Depends(get_db)):
+    """Пересчёт векторов похожести по текущим частотам слов."""
+    return {"tenders": rebuild_similarity_index(db)}
 
-    suppliers_q = db.query(models.Supplier)
-    if tender.category:
-        suppliers_q = suppliers_q.filter(
-            models.Supplier.categories.ilike(f"%{tender.category}%")
-        )
-    if tender.region:
-        suppliers_q = suppliers_q.filter(
-            (models.Supplier.region == tender.region)
-            | (models.Supplier.region.is_(None))
-        )
-    suppliers = suppliers_q.limit(5).all()
-
-    parts = []
-    parts.append(f"ID (в БД): {tender.id}")
-    if tender.external_id:
-        parts.append(f"Внешний номер: {tender.external_id}")
-    if tender.platform:
-        parts.append(f"Площадка: {tender.platform}")
-    if tender.customer_name:
-        parts.append(f"Заказчик: {tender.customer_name}")
-    if tender.subject:
-        parts.append(f"Предмет закупки: {tender.subject}")
-    if tender.description_raw:
-        parts.append(f"Описание: {tender.description_raw}")
-    if tender.price_amount:
-        parts.append(f"Цена: {tender.price_amount} {tender.price_currency or 'KZT'}")
-    if tender.category:
-        parts.append(f"Категория: {tender.category}")
-    if tender.region:
-        parts.append(f"Регион: {tender.region}")
-
-    if flags:
-        parts.append("\nФлаги риска:")
-        for f in flags:
-            parts.append(f"- [{f.code}] {f.description} (вес {f.weight})")
-    else:
-        parts.append("\nФлаги риска: не найдены.")
-
-    if suppliers:
-        parts.append("\nРекомендованные поставщики:")
-        for s in suppliers:
-            parts.append(
-                f"- {s.name} (регион: {s.region or 'не указан'}, "
-                f"средний контракт: {s.avg_contract_size or 'N/A'}, "
-                f"win_rate: {s.win_rate or 'N/A'})"
+
+@app.post("/categories/stats/rebuild")
+def rebuild_category_stats_endpoint(db: Session = Depends(get_db)):
+    """Полная пересборка статистики (после правок таблицы тендеров в обход API)."""
+    return {"categories": rebuild_category_stats(db)}
+
+
+# =====================================================================
+#                    ПОТОКОВАЯ ОТДАЧА ТОКЕНОВ (SSE)
+# =====================================================================
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return (f"event: {event}\n" if event else "") + f"data: {payload}\n\n"
+
+
+async def _sse_tokens(
+    prompt: str, cache: Optional[Tuple[str, int]] = None
+) -> AsyncIterator[str]:
+    """
+    События: data {"token": ...} на каждый фрагмент, в конце event: done;
+    при ошибке генерации — event: error с полем detail.
+    cache = (ключ, tender_id): полный ответ сохраняется в кэш LLM.
+    """
+    tokens: List[str] = []
+    try:
+        async for token in llm_client.stream(prompt):
+            tokens.append(token)
+            yield _sse({"token": token})
+        if cache:
+            key, tender_id = cache
+            await run_in_threadpool(
+                llm_cache.put, key, "".join(tokens), llm_client.model, tender_id
             )
-    else:
-        parts.append("\nПодходящие поставщики: не найдены.")
+        yield _sse({}, "done")
+    except LLMTimeoutError as e:
+        yield _sse({"detail": str(e)}, "error")
+    except Exception as e:
+        yield _sse({"detail": f"Ошибка LLM: {e}"}, "error")
 
-    return "\n".join(parts)
 
+async def _sse_cached(reply: str) -> AsyncIterator[str]:
+    yield _sse({"token": reply, "cached": True})
+    yield _sse({}, "done")
 
-def extract_tender_id_from_text(text: str) -> Optional[int]:
-    """Ищем в тексте что-то вроде 'тендер 5' или 'tender 10'."""
-    m = re.search(r"(тендер|tender)\D*(\d+)", text, re.IGNORECASE)
-    if m:
-        try:
-            return int(m.group(2))
-        except ValueError:
-            return None
-    return None
+
+def _event_stream(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def sse_response(
+    prompt: str, cache: Optional[Tuple[str, int]] = None
+) -> StreamingResponse:
+    # 429 можно вернуть только до начала потока, поэтому допуск проверяем здесь
+    llm_client.check_admission()
+    return _event_stream(_sse_tokens(prompt, cache))
 
 
 # =====================================================================
@@ -301,13 +610,8 @@ class AIAnalysisResponse(BaseModel):
     analysis: str
 
 
-@app.get("/ai/analyze_tender/{tender_id}", response_model=AIAnalysisResponse)
-def ai_analyze_tender(tender_id: int, db: Session = Depends(get_db)):
-    context = build_tender_context(db, tender_id)
-    if not context:
-        raise HTTPException(status_code=404, detail="Tender not found")
-
-    prompt = f"""
+def build_analysis_prompt(context: str) -> str:
+    return f"""
 Ты — AI-ассистент по тендерам и закупкам банка.
 Ниже приведены данные по конкретному тендеру.
 
@@ -322,12 +626,147 @@ def ai_analyze_tender(tender_id: int, db: Session = Depends(get_db)):
 Не придумывай факты, которых нет в контексте.
 """
 
-    res = ollama.generate(
-        model="llama3",
-        prompt=prompt,
+
+def _analysis_request(
+    db: Session, tender_id: int
+) -> Optional[Tuple[str, str, Optional[str]]]:
+    """
+    Промпт анализа, ключ кэша и ответ из кэша (или None); None, если тендера нет.
+    Ключ учитывает версию тендера, поэтому после изменения тендера или
+    пересчёта его риска старый ответ не используется.
+    """
+    budget = context_budget(build_analysis_prompt(""))
+    context = build_tender_context(db, tender_id, budget)
+    if not context:
+        return None
+    tender = db.query(models.Tender).get(tender_id)
+    prompt = build_analysis_prompt(context)
+    key = cache_key(llm_client.model, prompt, tender_version(tender))
+    return prompt, key, llm_cache.get(key)
+
+
+def _with_session(fn, *args):
+    """
+    fn(db, *args) в короткой сессии. Для async-эндпоинтов с LLM: соединение
+    из пула и снимок чтения SQLite освобождаются до ожидания модели, а не
+    держатся, как у Depends(get_db), до конца запроса.
+    """
+    with SessionLocal() as db:
+        return fn(db, *args)
+
+
+async def _prepared_analysis(tender_id: int) -> Tuple[str, str, Optional[str]]:
+    # работа с БД синхронная — выносим её из event loop
+    prepared = await run_in_threadpool(_with_session, _analysis_request, tender_id)
+    if prepared is None:
+        raise HTTPException(status_code=404, detail="Tender not found")
+    return prepared
+
+
+@app.get("/ai/analyze_tender/{tender_id}", response_model=AIAnalysisResponse)
+async def ai_analyze_tender(tender_id: int):
+    prompt, key, analysis = await _prepared_analysis(tender_id)
+
+    if analysis is None:
+        analysis = await llm_client.generate(prompt)
+        await run_in_threadpool(
+            llm_cache.put, key, analysis, llm_client.model, tender_id
+        )
+
+    return AIAnalysisResponse(tender_id=tender_id, analysis=analysis)
+
+
+@app.get("/ai/analyze_tender/{tender_id}/stream")
+async def ai_analyze_tender_stream(tender_id: int):
+    """То же, что /ai/analyze_tender, но токены отдаются по мере генерации (SSE)."""
+    prompt, key, analysis = await _prepared_analysis(tender_id)
+    if analysis is not None:
+        return _event_stream(_sse_cached(analysis))
+    return sse_response(prompt, (key, tender_id))
+
+
+# =====================================================================
+#                    AI: ФОНОВЫЕ ЗАДАНИЯ АНАЛИЗА
+# =====================================================================
+
+analysis_jobs = AnalysisJobRunner(llm_client, _analysis_request)
+
+
+@app.on_event("startup")
+async def resume_analysis_jobs():
+    analysis_jobs.resume_unfinished()
+
+
+def _get_job(db: Session, job_id: int) -> models.AnalysisJob:
+    job = db.get(models.AnalysisJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/ai/jobs", response_model=AnalysisJobOut, status_code=202)
+async def create_analysis_job(
+    filters: AnalysisJobCreate, db: Session = Depends(get_db)
+):
+    """Ставит в очередь AI-анализ всех тендеров, подходящих под фильтр."""
+    job = await run_in_threadpool(analysis_jobs.create_job, db, filters)
+    analysis_jobs.start(job.id)
+    return job
+
+
+@app.get("/ai/jobs/{job_id}", response_model=AnalysisJobOut)
+def get_analysis_job(job_id: int, db: Session = Depends(get_db)):
+    return _get_job(db, job_id)
+
+
+@app.get("/ai/jobs/{job_id}/results", response_model=AnalysisJobResults)
+def get_analysis_job_results(
+    job_id: int,
+    after: Optional[int] = Query(None, description="tender_id, после которого продолжить"),
+    limit: int = Query(50, ge=1, le=500),
+    status: Optional[Literal["pending", "done", "failed"]] = None,
+    db: Session = Depends(get_db),
+):
+    _get_job(db, job_id)
+    q = (
+        db.query(
+            models.AnalysisJobItem.tender_id,
+            models.AnalysisJobItem.status,
+            models.AnalysisJobItem.error,
+            models.TenderAnalysis.analysis,
+        )
+        .outerjoin(
+            models.TenderAnalysis,
+            models.TenderAnalysis.tender_id == models.AnalysisJobItem.tender_id,
+        )
+        .filter(models.AnalysisJobItem.job_id == job_id)
     )
+    if status:
+        q = q.filter(models.AnalysisJobItem.status == status)
+    if after is not None:
+        q = q.filter(models.AnalysisJobItem.tender_id > after)
+    rows = q.order_by(models.AnalysisJobItem.tender_id).limit(limit + 1).all()
+
+    items = [
+        AnalysisJobResult(
+            tender_id=tender_id,
+            status=item_status,
+            error=error,
+            analysis=analysis if item_status == "done" else None,
+        )
+        for tender_id, item_status, error, analysis in rows[:limit]
+    ]
+    next_after = items[-1].tender_id if len(rows) > limit else None
+    return AnalysisJobResults(items=items, next_after=next_after)
+
 
-    return AIAnalysisResponse(tender_id=tender_id, analysis=res["response"])
+@app.post("/ai/jobs/{job_id}/cancel", response_model=AnalysisJobOut)
+async def cancel_analysis_job(job_id: int):
+    job = await run_in_threadpool(_with_session, _get_job, job_id)
+    if job.status in FINISHED_STATUSES or not await analysis_jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job is not running")
+    # статус cancelled записан задачей после отмены — отдаём его, а не прежний
+    return await run_in_threadpool(_with_session, _get_job, job_id)
 
 
 # =====================================================================
@@ -343,24 +782,15 @@ class ChatResponse(BaseModel):
     reply: str
 
 
-@app.post("/chat/send", response_model=ChatResponse)
-def chat_send(msg: ChatMessage, db: Session = Depends(get_db)):
-    user_msg = msg.message.strip()
-
-    # Пытаемся вытащить ID тендера из текста
-    tender_id = extract_tender_id_from_text(user_msg)
-    tender_context = None
-    if tender_id is not None:
-        tender_context = build_tender_context(db, tender_id)
-
+def build_chat_prompt(user_msg: str, tender_context: Optional[str]) -> str:
     if tender_context:
-        prompt = f"""
+        return f"""
 Ты — AI-ассистент по тендерам и закупкам для банка.
 
 Пользователь задал вопрос:
 \"\"\"{user_msg}\"\"\".
 
-Ниже — данные из внутренней системы по тендеру (и связанным объектам),
+Ниже — данные из внутренней системы по тендерам (и связанным объектам),
 которые НУЖНО считать единственным источником правды:
 
 {tender_context}
@@ -370,11 +800,11 @@ def chat_send(msg: ChatMessage, db: Session = Depends(get_db)):
 - если каких-то параметров нет (например, нет сроков, дат, объёма работ),
   так и скажи: "в доступных данных это не указано";
 - не выдумывай цены, даты или участников, которых нет в контексте;
+- если тендеров несколько — сравни их по цене, срокам и рискам;
 - отвечай структурировано, на деловом русском языке.
 """
-    else:
-        # Нет конкретного тендера — даём общий экспертный ответ без "фейковых" фактов
-        prompt = f"""
+    # Нет конкретного тендера — даём общий экспертный ответ без "фейковых" фактов
+    return f"""
 Ты — AI-ассистент по тендерам и закупкам.
 Пользователь задаёт общий вопрос (контекст по конкретному тендеру не найден):
 
@@ -388,9 +818,44 @@ def chat_send(msg: ChatMessage, db: Session = Depends(get_db)):
   указать его номер, например: "тендер 5".
 """
 
-    res = ollama.generate(
-        model="llama3",
-        prompt=prompt,
-    )
 
-    return ChatResponse(reply=res["response"])
+def _chat_prompt(db: Session, user_msg: str) -> str:
+    """Промпт чата с контекстом упомянутых тендеров в пределах бюджета токенов."""
+    # шаблон с непустым контекстом без данных: сколько остаётся на сами данные
+    budget = context_budget(build_chat_prompt(user_msg, " "))
+    return build_chat_prompt(user_msg, chat_context(db, user_msg, budget))
+
+
+@app.post("/chat/send", response_model=ChatResponse)
+async def chat_send(msg: ChatMessage):
+    user_msg = msg.message.strip()
+    prompt = await run_in_threadpool(_with_session, _chat_prompt, user_msg)
+
+    reply = await llm_client.generate(prompt)
+
+    return ChatResponse(reply=reply)
+
+
+@app.post("/chat/stream")
+async def chat_stream(msg: ChatMessage):
+    """Потоковый вариант /chat/send: события SSE с токенами ответа."""
+    user_msg = msg.message.strip()
+    prompt = await run_in_threadpool(_with_session, _chat_prompt, user_msg)
+    return sse_response(prompt)
+
+
+@app.get("/ai/status")
+def ai_status():
+    """Загрузка пула генераций: активные, ожидающие, средняя длительность."""
+    return llm_client.status()
+
+
+@app.get("/ai/cache")
+def ai_cache_status():
+    """Кэш ответов LLM и кэш контекста тендеров: попадания, промахи, объём."""
+    return {**llm_cache.status(), "context": context_cache.status()}
+
+
+@app.delete("/ai/cache")
+def ai_cache_clear():
+    return {"removed": llm_cache.clear()}
@@ -1,4 +1,5 @@
 from datetime import datetime, date
+from typing import Optional
 from sqlalchemy import (
     Column,
     Integer,
@@ -8,6 +9,9 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Text,
+    Boolean,
+    Index,
+    LargeBinary,
 )
 from sqlalchemy.orm import relationship
 from .db import Base
@@ -15,6 +19,12 @@ from .db import Base
 
 class Tender(Base):
     __tablename__ = "tenders"
+    __table_args__ = (
+        # keyset-пагинация списка тендеров: ORDER BY created_at DESC, id DESC
+        Index("ix_tenders_created_at_id", "created_at", "id"),
+        # upsert при загрузке: поиск уже известных тендеров площадки
+        Index("ix_tenders_platform_external_id", "platform", "external_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     external_id = Column(String, index=True, nullable=True)
@@ -36,6 +46,10 @@ class Tender(Base):
 
     risk_score = Column(Float, default=0.0)
     risk_level = Column(String, default="low")
+    # риск нужно пересчитать (новый тендер или изменились входные поля правил)
+    risk_dirty = Column(Boolean, default=True, nullable=False)
+    # версия статистики категории, по которой считался риск
+    risk_stats_version = Column(Integer, nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -60,6 +74,18 @@ class Supplier(Base):
     tender_suppliers = relationship("TenderSupplier", back_populates="supplier")
 
 
+class SupplierCategory(Base):
+    """Нормализованная категория поставщика (разбор поля Supplier.categories)."""
+
+    __tablename__ = "supplier_categories"
+    __table_args__ = (
+        Index("ix_supplier_categories_category_supplier", "category", "supplier_id"),
+    )
+
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"), primary_key=True)
+    category = Column(String, primary_key=True)
+
+
 class TenderSupplier(Base):
     __tablename__ = "tender_suppliers"
 
@@ -82,3 +108,156 @@ class RiskFlag(Base):
     weight = Column(Float, default=0.0)
 
     tender = relationship("Tender", back_populates="risk_flags")
+
+
+class CategoryStats(Base):
+    """Агрегаты цен по категории для правила OVERPRICE (поддерживаются инкрементально)."""
+
+    __tablename__ = "category_stats"
+
+    category = Column(String, primary_key=True)
+    price_count = Column(Integer, default=0, nullable=False)
+    price_sum = Column(Float, default=0.0, nullable=False)
+    price_sumsq = Column(Float, default=0.0, nullable=False)
+    # увеличивается при каждом изменении агрегатов категории
+    version = Column(Integer, default=1, nullable=False)
+
+
+class CategoryPriceBucket(Base):
+    """Логарифмическая гистограмма цен по категории (сливаемый скетч квантилей)."""
+
+    __tablename__ = "category_price_buckets"
+
+    category = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+
+class LLMCacheEntry(Base):
+    """Сохранённый ответ LLM — постоянный уровень кэша (см. llm_cache)."""
+
+    __tablename__ = "llm_cache"
+
+    key = Column(String, primary_key=True)  # sha256(модель, промпт, версия тендера)
+    tender_id = Column(Integer, index=True, nullable=True)
+    model = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+    size = Column(Integer, nullable=False)  # байт в response (UTF-8)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+
+
+class SyncCheckpoint(Base):
+    """Отметка инкрементальной синхронизации: последний загруженный тендер."""
+
+    __tablename__ = "sync_checkpoints"
+
+    source = Column(String, primary_key=True)  # например, "goszakup"
+    announce_date = Column(String, nullable=True)  # как в ответе API
+    last_id = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IngestJob(Base):
+    """Асинхронное задание загрузки CSV, тело которого передаётся потоком."""
+
+    __tablename__ = "ingest_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # tenders / suppliers
+    # pending (ждёт данных) / receiving / running / done / failed
+    status = Column(String, default="pending", nullable=False)
+    batch_size = Column(Integer, nullable=False)
+
+    bytes_total = Column(Integer, nullable=True)  # размер файла, если известен
+    bytes_received = Column(Integer, default=0, nullable=False)
+    bytes_read = Column(Integer, default=0, nullable=False)  # разобрано загрузкой
+    rows_total = Column(Integer, default=0, nullable=False)
+    inserted = Column(Integer, default=0, nullable=False)
+    updated = Column(Integer, default=0, nullable=False)
+    rejected = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    @property
+    def progress(self) -> Optional[float]:
+        """Доля разобранных байт файла, 0..1; None — размер неизвестен."""
+        if self.status == "done":
+            return 1.0
+        if not self.bytes_total:
+            return None
+        return min(self.bytes_read / self.bytes_total, 1.0)
+
+
+class AnalysisJob(Base):
+    """Фоновое задание AI-анализа тендеров по фильтру (см. ai_jobs)."""
+
+    __tablename__ = "analysis_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String, default="queued", nullable=False)
+    # фильтр, по которому отобраны тендеры
+    risk_level = Column(String, nullable=True)
+    category = Column(String, nullable=True)
+    date_from = Column(Date, nullable=True)
+    date_to = Column(Date, nullable=True)
+
+    total = Column(Integer, default=0, nullable=False)
+    done = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    @property
+    def progress(self) -> float:
+        """Доля обработанных тендеров, 0..1."""
+        return (self.done + self.failed) / self.total if self.total else 1.0
+
+
+class AnalysisJobItem(Base):
+    """Тендер в составе задания и состояние его обработки."""
+
+    __tablename__ = "analysis_job_items"
+
+    job_id = Column(Integer, ForeignKey("analysis_jobs.id"), primary_key=True)
+    tender_id = Column(Integer, primary_key=True)
+    status = Column(String, default="pending", nullable=False)  # pending/done/failed
+    error = Column(Text, nullable=True)
+
+
+class TenderAnalysis(Base):
+    """Последний сохранённый AI-анализ тендера."""
+
+    __tablename__ = "tender_analyses"
+
+    tender_id = Column(Integer, ForeignKey("tenders.id"), primary_key=True)
+    job_id = Column(Integer, nullable=True)
+    model = Column(String, nullable=False)
+    analysis = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class TenderVector(Base):
+    """Вектор TF-IDF тендера для поиска похожих (см. similarity)."""
+
+    __tablename__ = "tender_vectors"
+
+    tender_id = Column(Integer, ForeignKey("tenders.id"), primary_key=True)
+    # float16 x similarity_dim; NULL — тендер удалён (надгробие до пересборки)
+    vector = Column(LargeBinary, nullable=True)
+    # порядковый номер записи: процессы догружают в память строки с seq больше своего
+    seq = Column(Integer, index=True, nullable=False)
+
+
+class SimilarityTerm(Base):
+    """Документная частота слова (по хэшу) для весов IDF."""
+
+    __tablename__ = "similarity_terms"
+
+    term = Column(Integer, primary_key=True)
+    df = Column(Integer, default=0, nullable=False)
@@ -0,0 +1,89 @@
+"""
+Keyset-пагинация и проекция полей для списков тендеров.
+
+Страницы упорядочены по (created_at DESC, id DESC); курсор хранит ключ
+последней строки страницы, и следующая страница начинается сразу после него
+по индексу (created_at, id) — без OFFSET, поэтому стоимость запроса не растёт
+с номером страницы. Тендеры без created_at (NULL) в SQLite при DESC идут
+в конце списка, по убыванию id; курсор на них хранит None вместо даты.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, tuple_
+from sqlalchemy.orm import Query
+
+from .models import Tender
+from .schemas import TenderOut
+
+# Поля, которые можно запросить через fields=
+TENDER_FIELDS: Tuple[str, ...] = tuple(TenderOut.model_fields)
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: Optional[datetime], tender_id: int) -> str:
+    key = created_at.isoformat() if created_at is not None else None
+    raw = json.dumps([key, tender_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, tender_id = json.loads(base64.urlsafe_b64decode(padded))
+        if created_at is not None:
+            created_at = datetime.fromisoformat(created_at)
+        return created_at, int(tender_id)
+    except (ValueError, TypeError) as e:
+        raise CursorError(f"Некорректный курсор: {cursor}") from e
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Список полей проекции; без fields= возвращаются все поля TenderOut."""
+    if not fields:
+        return list(TENDER_FIELDS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in TENDER_FIELDS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    # id нужен всегда — по нему клиент открывает карточку тендера
+    return ["id"] + [f for f in requested if f != "id"]
+
+
+def keyset_page(
+    q: Query, fields: List[str], limit: int, cursor: Optional[str]
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Одна страница тендеров после курсора. q — запрос с уже применёнными
+    фильтрами. Возвращает (строки в виде dict с полями fields, следующий курсор).
+    """
+    columns = [getattr(Tender, f) for f in fields]
+    q = q.with_entities(Tender.created_at, Tender.id, *columns)
+    if cursor:
+        created_at, tender_id = decode_cursor(cursor)
+        if created_at is None:
+            q = q.filter(Tender.created_at.is_(None), Tender.id < tender_id)
+        else:
+            # сравнение кортежей с NULL не истинно: хвост без даты — отдельно
+            q = q.filter(
+                or_(
+                    tuple_(Tender.created_at, Tender.id)
+                    < tuple_(created_at, tender_id),
+                    Tender.created_at.is_(None),
+                )
+            )
+    q = q.order_by(Tender.created_at.desc(), Tender.id.desc()).limit(limit + 1)
+
+    rows = q.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [dict(zip(fields, row[2:])) for row in rows]
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+    return items, next_cursor
@@ -0,0 +1,81 @@
+"""
+Бюджет токенов промпта.
+
+Токенизатор модели не подключаем: размер оценивается по числу символов
+(settings.prompt_chars_per_token; для русского текста у llama3 это около
+трёх символов на токен). Точность оценки — десятки процентов, для выбора
+между "влезает" и "не влезает" в окно модели этого достаточно.
+
+Длинные поля (описание тендера) ужимаются до своей доли бюджета: текст
+делится на предложения, первое сохраняется всегда, остальные берутся по
+числу общих слов с запросом (например, предметом закупки) и выводятся
+в исходном порядке; пропуски отмечаются многоточием.
+"""
+import math
+import re
+from typing import List, Set
+
+from .config import settings
+from .search import stem_words
+
+# слова сравниваются по началу основы ("серверное" ~ "серверного")
+TERM_PREFIX = 5
+ELLIPSIS = "…"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / settings.prompt_chars_per_token)
+
+
+def _terms(text: str) -> Set[str]:
+    return {word[:TERM_PREFIX] for word in stem_words(text) if len(word) > 2}
+
+
+def _cut(text: str, max_chars: int) -> str:
+    """Начало текста не длиннее max_chars, по границе слова."""
+    head = text[: max(max_chars - 1, 0)]
+    if " " in head:
+        head = head.rsplit(" ", 1)[0]
+    return head.rstrip() + ELLIPSIS if head else ""
+
+
+def fit_text(text: str, max_tokens: int, query: str = "") -> str:
+    """Текст, ужатый до max_tokens: самые близкие к query предложения."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = int(max_tokens * settings.prompt_chars_per_token)
+    sentences = [s.strip() for s in _SENTENCE_END.split(text) if s.strip()]
+    if max_chars <= len(ELLIPSIS) or not sentences:
+        return ""
+
+    wanted = _terms(query)
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (i != 0, -len(wanted & _terms(sentences[i])), i),
+    )
+    chosen: List[int] = []
+    used = len(ELLIPSIS)
+    for i in ranked:
+        # +2 на разделитель " …" между несмежными предложениями
+        cost = len(sentences[i]) + 2
+        if used + cost <= max_chars:
+            chosen.append(i)
+            used += cost
+    if not chosen:
+        return _cut(sentences[0], max_chars)
+
+    parts = []
+    prev = -1
+    for i in sorted(chosen):
+        parts.append(sentences[i] if i == prev + 1 else f"{ELLIPSIS} {sentences[i]}")
+        prev = i
+    if prev != len(sentences) - 1:
+        parts.append(ELLIPSIS)
+    return " ".join(parts)
+
+
+def context_budget(template: str) -> int:
+    """Сколько токенов остаётся на контекст при заданном шаблоне промпта."""
+    return max(settings.prompt_max_tokens - estimate_tokens(template), 0)
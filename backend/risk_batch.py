@@ -0,0 +1,127 @@
+"""
+Векторизованный пересчёт риска по всей базе.
+
+Колонки, объявленные правилами реестра (risk_rules), загружаются одним
+запросом в DataFrame, правила применяются операциями pandas/NumPy (group-by
+по категории вместо выборки категории на каждый тендер), после чего
+risk_flags заменяются целиком в одной транзакции, а в tenders обновляются
+только изменившиеся или устаревшие оценки.
+"""
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Date, Float, select, update
+from sqlalchemy.orm import Session
+
+from .llm_cache import llm_cache
+from .models import CategoryStats, RiskFlag, Tender
+from .risk_rules import evaluate_rules_frame, required_columns
+
+WRITE_CHUNK_SIZE = 50000
+
+
+def _load_frame(db: Session) -> pd.DataFrame:
+    """Один запрос за всеми колонками, которые объявили зарегистрированные правила."""
+    rule_columns = [getattr(Tender, col) for col in required_columns()]
+    stmt = select(
+        Tender.id,
+        *rule_columns,
+        Tender.risk_score,
+        Tender.risk_level,
+        Tender.risk_dirty,
+        Tender.risk_stats_version,
+        CategoryStats.version.label("category_version"),
+    ).outerjoin(CategoryStats, CategoryStats.category == Tender.category)
+    df = pd.read_sql(stmt, db.connection())
+    for col in rule_columns:
+        if isinstance(col.type, Date):
+            df[col.key] = pd.to_datetime(df[col.key])
+        elif isinstance(col.type, Float):
+            df[col.key] = df[col.key].astype("float64")
+    return df
+
+
+def _flag_records(df: pd.DataFrame, results) -> List[Dict]:
+    records: List[Dict] = []
+    for code, (rule, mask, detail) in results.items():
+        for tender_id, d in zip(df["id"][mask], detail[mask]):
+            records.append(
+                {
+                    "tender_id": int(tender_id),
+                    "code": code,
+                    "description": rule.describe(d),
+                    "weight": rule.weight,
+                }
+            )
+    return records
+
+
+def recompute_all_risk(db: Session) -> Dict:
+    """Пересчитывает риск всех тендеров и заменяет risk_flags одной транзакцией."""
+    started = time.perf_counter()
+
+    df = _load_frame(db)
+    loaded = time.perf_counter()
+
+    results = evaluate_rules_frame(df)
+    score = pd.Series(0.0, index=df.index)
+    for rule, mask, _ in results.values():
+        score += mask * rule.weight
+    score = np.minimum(score, 100.0)
+    level = np.select([score >= 60, score >= 30], ["high", "medium"], default="low")
+    flags = _flag_records(df, results)
+    # версия статистики категории, которой помечается свежий результат
+    new_version = df["category_version"].where(
+        df["category"].notna() & (df["category"] != "")
+    )
+    old_version = df["risk_stats_version"]
+    same_version = (old_version == new_version) | (
+        old_version.isna() & new_version.isna()
+    )
+    changed = (
+        (df["risk_score"].to_numpy() != score.to_numpy())
+        | (df["risk_level"].to_numpy() != level)
+        | df["risk_dirty"].fillna(True).astype(bool).to_numpy()
+        | ~same_version.to_numpy()
+    )
+    updates = [
+        {
+            "id": int(i),
+            "risk_score": float(s),
+            "risk_level": str(lv),
+            "risk_dirty": False,
+            "risk_stats_version": None if pd.isna(v) else int(v),
+        }
+        for i, s, lv, v in zip(
+            df["id"][changed], score[changed], level[changed], new_version[changed]
+        )
+    ]
+    evaluated = time.perf_counter()
+
+    try:
+        db.execute(RiskFlag.__table__.delete())
+        for start in range(0, len(flags), WRITE_CHUNK_SIZE):
+            db.execute(
+                RiskFlag.__table__.insert(), flags[start : start + WRITE_CHUNK_SIZE]
+            )
+        for start in range(0, len(updates), WRITE_CHUNK_SIZE):
+            db.execute(update(Tender), updates[start : start + WRITE_CHUNK_SIZE])
+        # пишем в обход ORM, слушатель кэша LLM изменений не увидит
+        llm_cache.invalidate_tenders((u["id"] for u in updates), db.connection())
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    written = time.perf_counter()
+
+    return {
+        "tenders": len(df),
+        "flags": len(flags),
+        "changed": len(updates),
+        "load_seconds": loaded - started,
+        "evaluate_seconds": evaluated - loaded,
+        "write_seconds": written - evaluated,
+        "total_seconds": written - started,
+    }
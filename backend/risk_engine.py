@@ -1,82 +1,169 @@
-from typing import List, Dict, Tuple
+from typing import Any, List, Dict, Tuple
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
 from .models import Tender, RiskFlag
+from .risk_rules import evaluate_rules, load_aggregates, required_columns
 
+# Сколько тендеров пересчитывать за один запрос при пакетном расчёте
+RISK_CHUNK_SIZE = 500
+# Поля тендера, от которых зависят правила: их изменение делает риск устаревшим
+RISK_INPUT_COLUMNS = tuple(required_columns())
+# Агрегаты, по которым проверяется актуальность риска (версия статистики
+# категории). Остальные, например поиск похожих тендеров, нужны только
+# при пересчёте.
+STALENESS_AGGREGATES = ("category_price",)
 
-def compute_risk_for_tender(
-    db: Session, tender: Tender
+
+@event.listens_for(Session, "before_flush")
+def _mark_risk_dirty(session: Session, flush_context, instances) -> None:
+    for obj in session.dirty:
+        if isinstance(obj, Tender) and any(
+            inspect(obj).attrs[col].history.has_changes() for col in RISK_INPUT_COLUMNS
+        ):
+            obj.risk_dirty = True
+
+
+def risk_level_for(score: float) -> str:
+    if score >= 60:
+        return "high"
+    if score >= 30:
+        return "medium"
+    return "low"
+
+
+def _evaluate_tender(
+    tender: Tender, aggregates: Dict[str, Any]
 ) -> Tuple[float, str, List[Dict]]:
     """
-    Простая rule-based логика для MVP.
-    Возвращает: (risk_score, risk_level, список флагов в виде dict).
+    Применяет зарегистрированные правила (см. risk_rules) к тендеру,
+    ничего не записывая в БД. aggregates — результат load_aggregates.
     """
-    flags: List[Dict] = []
-    score = 0.0
+    flags = evaluate_rules(tender, aggregates)
 
-    # Правило 1: завышенная цена относительно похожих тендеров
-    if tender.price_amount and tender.category:
-        similar = (
-            db.query(Tender)
-            .filter(
-                Tender.category == tender.category,
-                Tender.id != tender.id,
-                Tender.price_amount.isnot(None),
-            )
-            .all()
-        )
-        if len(similar) >= 3:
-            avg_price = sum(t.price_amount for t in similar) / len(similar)
-            if avg_price > 0 and tender.price_amount > avg_price * 1.3:
-                delta = tender.price_amount - avg_price
-                flags.append(
-                    {
-                        "code": "OVERPRICE",
-                        "description": f"Цена выше средней по категории на {delta:.0f}",
-                        "weight": 25.0,
-                    }
-                )
-                score += 25.0
-
-    # Правило 2: очень короткий срок подачи заявок
-    if tender.bid_start_date and tender.bid_end_date:
-        days = (tender.bid_end_date - tender.bid_start_date).days
-        if days <= 3:
-            flags.append(
-                {
-                    "code": "SHORT_BID_PERIOD",
-                    "description": "Очень короткий срок подачи заявок",
-                    "weight": 20.0,
-                }
-            )
-            score += 20.0
+    # Нормализация и уровень риска
+    score = min(sum(f["weight"] for f in flags), 100.0)
+    return score, risk_level_for(score), flags
 
-    # !!! Здесь можно добавлять новые правила (аффилированность, конкуренция и т.д.)
 
-    # Нормализация и уровень риска
-    score = min(score, 100.0)
-    if score >= 60:
-        level = "high"
-    elif score >= 30:
-        level = "medium"
-    else:
-        level = "low"
+def stats_version_for(tender: Tender, aggregates: Dict[str, Any]):
+    """Версия статистики категории тендера (None — статистики нет)."""
+    agg = aggregates["category_price"].get(tender.category) if tender.category else None
+    return agg.version if agg else None
+
+
+def load_staleness_aggregates(db: Session, tenders: List[Tender]) -> Dict[str, Any]:
+    """Агрегаты для stats_version_for и risk_is_stale (без пересчёта правил)."""
+    return load_aggregates(db, tenders, STALENESS_AGGREGATES)
 
-    # Сохранение флагов и обновление тендера
-    # Сначала удаляем старые флаги
-    db.query(RiskFlag).filter(RiskFlag.tender_id == tender.id).delete()
 
+def risk_is_stale(tender: Tender, aggregates: Dict[str, Any]) -> bool:
+    """
+    Сохранённый риск устарел, если изменились входные поля тендера
+    или статистика его категории (для правила OVERPRICE).
+    aggregates — результат load_staleness_aggregates или load_aggregates.
+    """
+    if tender.risk_dirty:
+        return True
+    if tender.price_amount and tender.category:
+        return tender.risk_stats_version != stats_version_for(tender, aggregates)
+    return False
+
+
+def _save_risk(
+    db: Session,
+    tender: Tender,
+    score: float,
+    level: str,
+    flags: List[Dict],
+    aggregates: Dict[str, Any],
+) -> None:
+    """Добавляет флаги в сессию и обновляет поля риска тендера (без commit)."""
     for f in flags:
-        rf = RiskFlag(
-            tender_id=tender.id,
-            code=f["code"],
-            description=f["description"],
-            weight=f["weight"],
+        db.add(
+            RiskFlag(
+                tender_id=tender.id,
+                code=f["code"],
+                description=f["description"],
+                weight=f["weight"],
+            )
         )
-        db.add(rf)
-
     tender.risk_score = score
     tender.risk_level = level
+    tender.risk_dirty = False
+    tender.risk_stats_version = stats_version_for(tender, aggregates)
     db.add(tender)
+
+
+def compute_risk_for_tender(
+    db: Session, tender: Tender
+) -> Tuple[float, str, List[Dict]]:
+    """
+    Простая rule-based логика для MVP.
+    Возвращает: (risk_score, risk_level, список флагов в виде dict).
+    """
+    aggregates = load_aggregates(db, [tender])
+    score, level, flags = _evaluate_tender(tender, aggregates)
+
+    # Сохранение флагов и обновление тендера
+    # Сначала удаляем старые флаги
+    db.query(RiskFlag).filter(RiskFlag.tender_id == tender.id).delete()
+    _save_risk(db, tender, score, level, flags, aggregates)
     db.commit()
 
     return score, level, flags
+
+
+def ensure_risk_fresh(db: Session, tender: Tender) -> bool:
+    """
+    Пересчитывает риск, только если сохранённый результат устарел.
+    В остальных случаях ничего не пишет в БД. Возвращает True при пересчёте.
+    """
+    if not risk_is_stale(tender, load_staleness_aggregates(db, [tender])):
+        return False
+    compute_risk_for_tender(db, tender)
+    return True
+
+
+def ensure_risk_fresh_many(db: Session, tenders: List[Tender]) -> List[int]:
+    """
+    То же для нескольких тендеров: статистика категорий грузится один раз,
+    устаревшие пересчитываются одним пакетом (все агрегаты правил — только
+    для них). Возвращает id пересчитанных.
+    """
+    if not tenders:
+        return []
+    aggregates = load_staleness_aggregates(db, tenders)
+    stale = [t.id for t in tenders if risk_is_stale(t, aggregates)]
+    if stale:
+        compute_risk_for_tenders(db, stale)
+    return stale
+
+
+def compute_risk_for_tenders(
+    db: Session, tender_ids: List[int], commit: bool = True
+) -> int:
+    """
+    Пакетный расчёт риска для набора тендеров.
+
+    Агрегаты, нужные правилам (например, статистика категорий), загружаются
+    одним запросом на порцию тендеров, а не отдельно для каждого тендера.
+    Возвращает количество пересчитанных тендеров.
+    """
+    processed = 0
+    for start in range(0, len(tender_ids), RISK_CHUNK_SIZE):
+        chunk_ids = tender_ids[start : start + RISK_CHUNK_SIZE]
+        tenders = db.query(Tender).filter(Tender.id.in_(chunk_ids)).all()
+        aggregates = load_aggregates(db, tenders)
+
+        db.query(RiskFlag).filter(RiskFlag.tender_id.in_(chunk_ids)).delete(
+            synchronize_session=False
+        )
+        for tender in tenders:
+            score, level, flags = _evaluate_tender(tender, aggregates)
+            _save_risk(db, tender, score, level, flags, aggregates)
+        db.flush()
+        processed += len(tenders)
+
+    if commit:
+        db.commit()
+    return processed
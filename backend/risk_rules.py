@@ -0,0 +1,343 @@
+"""
+Реестр правил риска.
+
+Каждое правило объявляет колонки тендера и агрегаты, которые ему нужны,
+и умеет проверять как один тендер (check), так и весь DataFrame сразу
+(check_frame). Движок по этим объявлениям один раз загружает данные для всех
+правил, а также собирает по каждому правилу время выполнения, число проверок
+и долю срабатываний.
+
+Новое правило добавляется через register_rule(RiskRule(...)).
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .category_stats import get_category_stats
+from .models import Tender
+from .similarity import comparable_price, similar_to_tenders
+
+# сколько похожих тендеров брать для сравнения цены тендера без категории
+SIMILAR_K = 10
+
+# ---------------------------------------------------------------------
+# Агрегаты, которые правила могут запросить
+# ---------------------------------------------------------------------
+
+
+@dataclass
+class Aggregate:
+    name: str
+    # для проверки отдельных тендеров: один запрос на пачку тендеров
+    load: Callable[[Session, List[Tender]], Any]
+    # для векторизованного пересчёта: вычисление по всему DataFrame
+    frame: Callable[[pd.DataFrame], Dict[str, pd.Series]]
+    columns: Tuple[str, ...] = ()
+
+
+def _load_category_price(db: Session, tenders: List[Tender]):
+    return get_category_stats(db, (t.category for t in tenders))
+
+
+def _frame_category_price(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    price = df["price_amount"]
+    category = df["category"]
+    in_stats = category.notna() & (category != "") & price.notna()
+    grouped = price.where(in_stats).groupby(category.where(in_stats))
+    return {
+        "count": grouped.transform("count").reindex(df.index),
+        "sum": grouped.transform("sum").reindex(df.index),
+    }
+
+
+def _needs_comparables(tender: Tender) -> bool:
+    return bool(tender.price_amount) and not tender.category
+
+
+def _load_similar_price(db: Session, tenders: List[Tender]):
+    ids = [t.id for t in tenders if _needs_comparables(t)]
+    found = similar_to_tenders(ids, SIMILAR_K, db) if ids else {}
+    return {tid: comparable_price(n) for tid, n in found.items()}
+
+
+def _frame_similar_price(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    price = df["price_amount"]
+    category = df["category"]
+    applies = (category.isna() | (category == "")) & price.notna() & (price != 0)
+    count = pd.Series(0, index=df.index)
+    median = pd.Series(float("nan"), index=df.index)
+    rows = df.index[applies]
+    if len(rows):
+        found = similar_to_tenders([int(i) for i in df.loc[rows, "id"]], SIMILAR_K)
+        stats = [comparable_price(found[int(i)]) for i in df.loc[rows, "id"]]
+        count[rows] = [c for c, _ in stats]
+        median[rows] = [m if m is not None else float("nan") for _, m in stats]
+    return {"count": count, "median": median}
+
+
+AGGREGATES: Dict[str, Aggregate] = {
+    "category_price": Aggregate(
+        name="category_price",
+        load=_load_category_price,
+        frame=_frame_category_price,
+        columns=("category", "price_amount"),
+    ),
+    # медиана цен похожих по тексту тендеров (для тендеров без категории)
+    "similar_price": Aggregate(
+        name="similar_price",
+        load=_load_similar_price,
+        frame=_frame_similar_price,
+        columns=("category", "price_amount"),
+    ),
+}
+
+# ---------------------------------------------------------------------
+# Правила
+# ---------------------------------------------------------------------
+
+
+@dataclass
+class RiskRule:
+    code: str
+    weight: float
+    # колонки Tender, от которых зависит правило
+    columns: Tuple[str, ...]
+    # check(tender, aggregates) -> деталь срабатывания или None
+    check: Callable[[Tender, Dict[str, Any]], Any]
+    # check_frame(df, aggregates) -> (маска срабатываний, детали)
+    check_frame: Callable[[pd.DataFrame, Dict], Tuple[pd.Series, pd.Series]]
+    # деталь срабатывания -> текст флага
+    describe: Callable[[Any], str]
+    aggregates: Tuple[str, ...] = ()
+
+
+@dataclass
+class RuleMetrics:
+    evaluations: int = 0
+    hits: int = 0
+    seconds: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, evaluations: int, hits: int, seconds: float) -> None:
+        with self.lock:
+            self.evaluations += evaluations
+            self.hits += hits
+            self.seconds += seconds
+
+
+RULES: Dict[str, RiskRule] = {}
+RULE_METRICS: Dict[str, RuleMetrics] = {}
+
+
+def register_rule(rule: RiskRule) -> RiskRule:
+    unknown = set(rule.aggregates) - set(AGGREGATES)
+    if unknown:
+        raise ValueError(f"Неизвестные агрегаты правила {rule.code}: {unknown}")
+    RULES[rule.code] = rule
+    RULE_METRICS.setdefault(rule.code, RuleMetrics())
+    return rule
+
+
+def required_columns(rules: Optional[Iterable[RiskRule]] = None) -> List[str]:
+    """Объединение колонок всех правил и их агрегатов (в стабильном порядке)."""
+    cols: List[str] = []
+    for rule in rules if rules is not None else RULES.values():
+        for col in rule.columns + sum(
+            (AGGREGATES[a].columns for a in rule.aggregates), ()
+        ):
+            if col not in cols:
+                cols.append(col)
+    return cols
+
+
+def required_aggregates(rules: Optional[Iterable[RiskRule]] = None) -> List[str]:
+    names: List[str] = []
+    for rule in rules if rules is not None else RULES.values():
+        for a in rule.aggregates:
+            if a not in names:
+                names.append(a)
+    return names
+
+
+def load_aggregates(
+    db: Session, tenders: List[Tender], names: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """
+    Один запрос на каждый нужный правилам агрегат для пачки тендеров.
+    names — загрузить только эти агрегаты (по умолчанию все нужные правилам).
+    """
+    if names is None:
+        names = required_aggregates()
+    return {name: AGGREGATES[name].load(db, tenders) for name in names}
+
+
+def frame_aggregates(df: pd.DataFrame) -> Dict[str, Dict[str, pd.Series]]:
+    return {name: AGGREGATES[name].frame(df) for name in required_aggregates()}
+
+
+def evaluate_rules(tender: Tender, aggregates: Dict[str, Any]) -> List[Dict]:
+    """Прогоняет тендер через все правила с учётом метрик."""
+    flags: List[Dict] = []
+    for rule in RULES.values():
+        t = time.perf_counter()
+        detail = rule.check(tender, aggregates)
+        hit = detail is not None
+        RULE_METRICS[rule.code].record(1, int(hit), time.perf_counter() - t)
+        if hit:
+            flags.append(
+                {
+                    "code": rule.code,
+                    "description": rule.describe(detail),
+                    "weight": rule.weight,
+                }
+            )
+    return flags
+
+
+def evaluate_rules_frame(
+    df: pd.DataFrame,
+) -> Dict[str, Tuple[RiskRule, pd.Series, pd.Series]]:
+    """Векторизованная проверка всех правил: код -> (правило, маска, детали)."""
+    aggregates = frame_aggregates(df)
+    result = {}
+    for rule in RULES.values():
+        t = time.perf_counter()
+        mask, detail = rule.check_frame(df, aggregates)
+        mask = mask.fillna(False).astype(bool)
+        RULE_METRICS[rule.code].record(len(df), int(mask.sum()), time.perf_counter() - t)
+        result[rule.code] = (rule, mask, detail)
+    return result
+
+
+def rule_metrics() -> List[Dict]:
+    result = []
+    for code, m in RULE_METRICS.items():
+        result.append(
+            {
+                "code": code,
+                "evaluations": m.evaluations,
+                "hits": m.hits,
+                "hit_rate": m.hits / m.evaluations if m.evaluations else 0.0,
+                "total_ms": m.seconds * 1000,
+                "avg_us": m.seconds * 1e6 / m.evaluations if m.evaluations else 0.0,
+            }
+        )
+    return result
+
+
+# ---------------------------------------------------------------------
+# Правило 1: завышенная цена относительно похожих тендеров
+# ---------------------------------------------------------------------
+
+
+def _overprice_check(tender: Tender, aggregates: Dict[str, Any]) -> Optional[float]:
+    if not (tender.price_amount and tender.category):
+        return None
+    agg = aggregates["category_price"].get(tender.category)
+    # исключаем сам тендер из статистики категории
+    cnt = (agg.count if agg else 0) - 1
+    total = (agg.total if agg else 0.0) - tender.price_amount
+    if cnt >= 3:
+        avg_price = total / cnt
+        if avg_price > 0 and tender.price_amount > avg_price * 1.3:
+            return tender.price_amount - avg_price
+    return None
+
+
+def _overprice_frame(df: pd.DataFrame, aggregates) -> Tuple[pd.Series, pd.Series]:
+    price = df["price_amount"]
+    category = df["category"]
+    stats = aggregates["category_price"]
+    applies = category.notna() & (category != "") & price.notna() & (price != 0)
+    other_count = stats["count"] - 1
+    other_avg = (stats["sum"] - price) / other_count.where(other_count > 0)
+    mask = applies & (other_count >= 3) & (other_avg > 0) & (price > other_avg * 1.3)
+    return mask, price - other_avg
+
+
+register_rule(
+    RiskRule(
+        code="OVERPRICE",
+        weight=25.0,
+        columns=("price_amount", "category"),
+        aggregates=("category_price",),
+        check=_overprice_check,
+        check_frame=_overprice_frame,
+        describe=lambda delta: f"Цена выше средней по категории на {delta:.0f}",
+    )
+)
+
+# ---------------------------------------------------------------------
+# Правило 1б: завышенная цена относительно похожих по тексту тендеров
+# (для тендеров без категории, где OVERPRICE не работает)
+# ---------------------------------------------------------------------
+
+
+def _similar_overprice_check(
+    tender: Tender, aggregates: Dict[str, Any]
+) -> Optional[float]:
+    if not _needs_comparables(tender):
+        return None
+    count, median = aggregates["similar_price"].get(tender.id, (0, None))
+    if count >= 3 and median and tender.price_amount > median * 1.5:
+        return tender.price_amount / median
+    return None
+
+
+def _similar_overprice_frame(
+    df: pd.DataFrame, aggregates
+) -> Tuple[pd.Series, pd.Series]:
+    stats = aggregates["similar_price"]
+    ratio = df["price_amount"] / stats["median"].where(stats["median"] > 0)
+    mask = (stats["count"] >= 3) & (ratio > 1.5)
+    return mask, ratio
+
+
+register_rule(
+    RiskRule(
+        code="OVERPRICE_SIMILAR",
+        weight=20.0,
+        columns=("price_amount", "category"),
+        aggregates=("similar_price",),
+        check=_similar_overprice_check,
+        check_frame=_similar_overprice_frame,
+        describe=lambda ratio: (
+            f"Цена в {ratio:.1f} раза выше медианы цен похожих тендеров"
+        ),
+    )
+)
+
+# ---------------------------------------------------------------------
+# Правило 2: очень короткий срок подачи заявок
+# ---------------------------------------------------------------------
+
+
+def _short_bid_check(tender: Tender, aggregates: Dict[str, Any]) -> Optional[int]:
+    if tender.bid_start_date and tender.bid_end_date:
+        days = (tender.bid_end_date - tender.bid_start_date).days
+        if days <= 3:
+            return days
+    return None
+
+
+def _short_bid_frame(df: pd.DataFrame, aggregates) -> Tuple[pd.Series, pd.Series]:
+    days = (df["bid_end_date"] - df["bid_start_date"]).dt.days
+    return days <= 3, days
+
+
+register_rule(
+    RiskRule(
+        code="SHORT_BID_PERIOD",
+        weight=20.0,
+        columns=("bid_start_date", "bid_end_date"),
+        check=_short_bid_check,
+        check_frame=_short_bid_frame,
+        describe=lambda days: "Очень короткий срок подачи заявок",
+    )
+)
+
+# !!! Здесь можно добавлять новые правила (аффилированность, конкуренция и т.д.)
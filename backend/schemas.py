@@ -1,6 +1,6 @@
 from datetime import datetime, date
-from typing import Optional, List
-from pydantic import BaseModel, ConfigDict
+from typing import Any, Dict, Literal, Optional, List
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class TenderBase(BaseModel):
@@ -55,9 +55,174 @@ class SupplierOut(BaseModel):
     win_rate: float | None = None
 
 
+class TenderAnalysisOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    job_id: Optional[int] = None
+    model: str
+    analysis: str
+    created_at: datetime
+
+
 class TenderReport(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
     tender: TenderOut
     risk_flags: List[RiskFlagOut]
     suppliers: List[SupplierOut]
+    ai_analysis: Optional[TenderAnalysisOut] = None
+
+
+class TenderRisks(BaseModel):
+    tender_id: int
+    risk_score: float
+    risk_level: str
+    # сохранённый риск устарел и будет пересчитан при запросе полного отчёта
+    risk_stale: bool
+    risk_flags: List[RiskFlagOut]
+
+
+class TenderSuppliers(BaseModel):
+    tender_id: int
+    suppliers: List[SupplierOut]
+
+
+class RejectedRow(BaseModel):
+    row: int
+    error: str
+
+
+class IngestSummary(BaseModel):
+    rows_total: int
+    inserted: int
+    updated: int = 0
+    rejected: int
+    rejected_rows: List[RejectedRow]
+    batch_size: int
+    rows_per_second: float
+    total_seconds: float
+
+
+class TenderIngestReport(IngestSummary):
+    parse_seconds: float
+    insert_seconds: float
+    risk_seconds: float
+    commit_seconds: float
+
+
+class IngestJobCreate(BaseModel):
+    kind: Literal["tenders", "suppliers"]
+    batch_size: int = Field(1000, ge=1, le=50000)
+    # размер файла в байтах, если известен: по нему считается progress
+    bytes_total: Optional[int] = Field(None, ge=0)
+
+
+class IngestJobOut(IngestJobCreate):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    status: str
+    bytes_received: int
+    bytes_read: int
+    progress: Optional[float] = None
+    rows_total: int
+    inserted: int
+    updated: int
+    rejected: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class CategoryStatsOut(BaseModel):
+    category: str
+    price_count: int
+    price_mean: float | None = None
+    price_std: float | None = None
+    price_p50: float | None = None
+    price_p90: float | None = None
+
+
+class RiskRecomputeReport(BaseModel):
+    tenders: int
+    flags: int
+    changed: int
+    load_seconds: float
+    evaluate_seconds: float
+    write_seconds: float
+    total_seconds: float
+
+
+class RuleStatsOut(BaseModel):
+    code: str
+    evaluations: int
+    hits: int
+    hit_rate: float
+    total_ms: float
+    avg_us: float
+
+
+class TenderPage(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+class SimilarTenderOut(BaseModel):
+    id: int
+    subject: Optional[str] = None
+    customer_name: Optional[str] = None
+    category: Optional[str] = None
+    region: Optional[str] = None
+    price_amount: Optional[float] = None
+    risk_level: Optional[str] = None
+    similarity: float
+
+
+class SimilarTenders(BaseModel):
+    tender_id: int
+    items: List[SimilarTenderOut]
+    # медиана цен похожих тендеров и отношение к ней цены самого тендера
+    median_price: Optional[float] = None
+    price_ratio: Optional[float] = None
+
+
+class TenderSearchPage(BaseModel):
+    # строки содержат запрошенные поля плюс rank (bm25) и snippet
+    items: List[Dict[str, Any]]
+    next_offset: Optional[int] = None
+
+
+class AnalysisJobCreate(BaseModel):
+    risk_level: Optional[Literal["low", "medium", "high"]] = None
+    category: Optional[str] = None
+    # по дате загрузки тендера (created_at), включительно
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+
+class AnalysisJobOut(AnalysisJobCreate):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    status: str
+    total: int
+    done: int
+    failed: int
+    progress: float
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class AnalysisJobResult(BaseModel):
+    tender_id: int
+    status: str
+    error: Optional[str] = None
+    analysis: Optional[str] = None
+
+
+class AnalysisJobResults(BaseModel):
+    items: List[AnalysisJobResult]
+    next_after: Optional[int] = None
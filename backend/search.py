@@ -0,0 +1,118 @@
+"""
+Полнотекстовый поиск по тендерам (SQLite FTS5).
+
+tenders_fts — external-content таблица над tenders: сам текст хранится только
+в tenders, FTS5 держит инвертированный индекс по subject, description_raw и
+requirements_text. Индекс обновляется триггерами SQLite, поэтому его видят
+любые пути записи — ORM, пакетная загрузка, Core-UPDATE.
+
+Запрос пользователя разбирается на слова, каждое ищется как префикс
+с отброшенным окончанием ("серверное оборудование" находит и "серверного
+оборудования"); слова объединяются по И. Результаты ранжируются bm25 с
+большим весом совпадений в предмете закупки.
+"""
+import re
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import column, func, literal_column, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query
+
+from .models import Tender
+
+FTS_TABLE = "tenders_fts"
+FTS_COLUMNS = ("subject", "description_raw", "requirements_text")
+# веса bm25 в порядке FTS_COLUMNS
+FTS_WEIGHTS = (10.0, 2.0, 1.0)
+# слова длиннее этого ищутся без двух последних букв (грубая замена стемминга)
+STEM_MIN_LENGTH = 6
+SNIPPET_TOKENS = 12
+
+_WORD = re.compile(r"\w+")
+
+fts = table(FTS_TABLE, column("rowid"), *(column(c) for c in FTS_COLUMNS))
+
+_cols = ", ".join(FTS_COLUMNS)
+_new = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+_old = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+
+_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {_cols}, content='tenders', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON tenders BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_cols}) VALUES (new.id, {_new});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON tenders BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_cols})
+        VALUES ('delete', old.id, {_old});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF {_cols} ON tenders BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_cols})
+        VALUES ('delete', old.id, {_old});
+        INSERT INTO {FTS_TABLE}(rowid, {_cols}) VALUES (new.id, {_new});
+    END""",
+]
+
+
+class SearchQueryError(ValueError):
+    pass
+
+
+def ensure_search_index(conn: Connection) -> None:
+    """Создаёт FTS-таблицу и триггеры; на уже заполненной базе строит индекс."""
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+        {"name": FTS_TABLE},
+    ).first()
+    for ddl in _DDL:
+        conn.exec_driver_sql(ddl)
+    if not exists:
+        rebuild_search_index(conn)
+
+
+def rebuild_search_index(conn: Connection) -> None:
+    conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def stem_words(text: str) -> List[str]:
+    """Слова текста в нижнем регистре, длинные — без двух последних букв."""
+    return [
+        word[:-2] if len(word) >= STEM_MIN_LENGTH else word
+        for word in _WORD.findall(text.casefold())
+    ]
+
+
+def match_expression(query: str) -> str:
+    """Строка запроса пользователя -> выражение FTS5 MATCH (без операторов FTS5)."""
+    terms = [f'"{word}"*' for word in stem_words(query)]
+    if not terms:
+        raise SearchQueryError("Пустой поисковый запрос")
+    return " ".join(terms)
+
+
+def search_page(
+    q: Query, query: str, fields: List[str], limit: int, offset: int
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Страница результатов поиска по релевантности. q — запрос по тендерам
+    с уже применёнными фильтрами. Каждая строка — поля fields плюс rank
+    (bm25, меньше — релевантнее) и snippet с выделенными совпадениями.
+    Возвращает (строки, есть ли следующая страница).
+    """
+    fts_ref = literal_column(FTS_TABLE)
+    rank = func.bm25(fts_ref, *FTS_WEIGHTS).label("rank")
+    snippet = func.snippet(fts_ref, -1, "[", "]", "…", SNIPPET_TOKENS).label("snippet")
+    rows = (
+        q.join(fts, fts.c.rowid == Tender.id)
+        .filter(fts_ref.op("MATCH")(match_expression(query)))
+        .with_entities(*(getattr(Tender, f) for f in fields), rank, snippet)
+        .order_by(rank, Tender.id)
+        .offset(offset)
+        .limit(limit + 1)
+        .all()
+    )
+    keys = fields + ["rank", "snippet"]
+    items = [dict(zip(keys, row)) for row in rows[:limit]]
+    return items, len(rows) > limit
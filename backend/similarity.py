@@ -0,0 +1,525 @@
+"""
+Индекс похожих тендеров.
+
+Текст тендера (предмет закупки с двойным весом + описание) превращается
+в вектор TF-IDF, хэшированный в settings.similarity_dim измерений
+(feature hashing со знаком), и нормируется; похожесть — косинус, то есть
+скалярное произведение векторов.
+
+Векторы считаются при записи тендера (слушатель after_flush) и хранятся
+в tender_vectors, документные частоты слов — в similarity_terms; IDF берётся
+на момент записи, пересборка (rebuild_similarity_index) пересчитывает всё по
+текущим частотам. В памяти процесса векторы лежат одной матрицей float32;
+перед каждым поиском догружаются записи с seq больше уже загруженного, так что
+новые тендеры дописываются в конец матрицы без полной перезагрузки.
+
+Пока тендеров меньше IVF_MIN_SIZE, поиск точный (перебор всей матрицы).
+Дальше — приближённый (IVF): векторы разбиты на кластеры сферическим
+k-means, запрос сравнивается только с тендерами IVF_PROBES ближайших
+кластеров, поэтому стоимость запроса растёт как корень из размера индекса,
+а не линейно. Запросы группируются по кластеру: одно умножение матриц
+на кластер. Кластеры обучаются лениво и
+переобучаются, когда индекс вырос вдвое; новые векторы приписываются
+к ближайшему кластеру при догрузке.
+
+Массовые операции в обход ORM событий не вызывают — после них индекс нужно
+пересобрать.
+"""
+import hashlib
+import math
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .category_stats import committed_value
+from .config import settings
+from .db import SessionLocal
+from .models import SimilarityTerm, Tender, TenderVector
+from .search import stem_words
+
+DIM = settings.similarity_dim
+# по сколько строк читать и писать при пересборке / чанк для IN (...)
+CHUNK_SIZE = 1000
+# ниже этой похожести тендер не считается сопоставимым
+MIN_SIMILARITY = 0.3
+# сколько элементов матрицы оценок считать за раз при пакетном поиске
+SCORE_BLOCK = 16 * 1024 * 1024
+# приближённый поиск: с какого размера индекса, предел числа кластеров
+# и сколько ближайших кластеров просматривать на запрос
+IVF_MIN_SIZE = 5000
+IVF_MAX_LISTS = 1024
+IVF_PROBES = 16
+# обучение кластеров: размер выборки и число итераций k-means
+IVF_TRAIN_SAMPLE = 20000
+IVF_TRAIN_ITERATIONS = 6
+
+TEXT_COLUMNS = ("subject", "description_raw")
+
+_vectors = TenderVector.__table__
+_terms = SimilarityTerm.__table__
+
+
+# ---------------------------------------------------------------------
+# Текст -> вектор
+# ---------------------------------------------------------------------
+
+
+@lru_cache(maxsize=200_000)
+def term_hash(word: str) -> int:
+    """Стабильный (между процессами) 63-битный хэш слова."""
+    digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") >> 1
+
+
+def tender_terms(subject: Optional[str], description: Optional[str]) -> Counter:
+    """Хэши слов тендера с числом вхождений; слова предмета считаются дважды."""
+    counts: Counter = Counter()
+    for text, weight in ((subject, 2), (description, 1)):
+        for word in stem_words(text or ""):
+            if len(word) >= 3 and not word.isdigit():
+                counts[term_hash(word)] += weight
+    return counts
+
+
+def vectorize(terms: Counter, df: Dict[int, int], n_docs: int) -> np.ndarray:
+    vec = np.zeros(DIM, dtype=np.float32)
+    for term, count in terms.items():
+        idf = math.log((1 + n_docs) / (1 + df.get(term, 0))) + 1.0
+        sign = 1.0 if (term >> 40) & 1 else -1.0
+        vec[term % DIM] += sign * (1.0 + math.log(count)) * idf
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+def _pack(vec: Optional[np.ndarray]) -> Optional[bytes]:
+    return None if vec is None else vec.astype(np.float16).tobytes()
+
+
+# ---------------------------------------------------------------------
+# Хранение в БД
+# ---------------------------------------------------------------------
+
+
+def _apply_term_deltas(connection: Connection, deltas: Dict[int, int]) -> None:
+    rows = [{"term": t, "df": d} for t, d in deltas.items() if d]
+    if not rows:
+        return
+    stmt = sqlite_insert(_terms)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[_terms.c.term],
+            set_={"df": _terms.c.df + stmt.excluded.df},
+        ),
+        rows,
+    )
+    connection.execute(_terms.delete().where(_terms.c.df <= 0))
+
+
+def _load_df(connection: Connection, terms: Iterable[int]) -> Dict[int, int]:
+    terms = list(terms)
+    df: Dict[int, int] = {}
+    for start in range(0, len(terms), CHUNK_SIZE):
+        chunk = terms[start : start + CHUNK_SIZE]
+        df.update(
+            connection.execute(
+                select(_terms.c.term, _terms.c.df).where(_terms.c.term.in_(chunk))
+            ).all()
+        )
+    return df
+
+
+def _next_seq(connection: Connection) -> int:
+    last = connection.execute(select(func.coalesce(func.max(_vectors.c.seq), 0)))
+    return last.scalar() + 1
+
+
+def _write_vectors(
+    connection: Connection, vectors: Dict[int, Optional[np.ndarray]], seq: int
+) -> None:
+    if not vectors:
+        return
+    stmt = sqlite_insert(_vectors)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[_vectors.c.tender_id],
+            set_={"vector": stmt.excluded.vector, "seq": stmt.excluded.seq},
+        ),
+        [
+            {"tender_id": tid, "vector": _pack(vec), "seq": seq}
+            for tid, vec in vectors.items()
+        ],
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_tender_vectors(session: Session, flush_context) -> None:
+    deltas: Dict[int, int] = defaultdict(int)
+    fresh: Dict[int, Counter] = {}
+    removed: List[int] = []
+
+    for obj in session.new:
+        if isinstance(obj, Tender):
+            fresh[obj.id] = tender_terms(obj.subject, obj.description_raw)
+            for term in fresh[obj.id]:
+                deltas[term] += 1
+    for obj in session.dirty:
+        if not isinstance(obj, Tender):
+            continue
+        attrs = inspect(obj).attrs
+        text_changed = any(attrs[c].history.has_changes() for c in TEXT_COLUMNS)
+        if text_changed:
+            old = tender_terms(*(committed_value(obj, c) for c in TEXT_COLUMNS))
+            for term in old:
+                deltas[term] -= 1
+        if text_changed or attrs.price_amount.history.has_changes():
+            # цена хранится рядом с вектором в памяти — перезапись поднимает seq
+            fresh[obj.id] = tender_terms(obj.subject, obj.description_raw)
+            if text_changed:
+                for term in fresh[obj.id]:
+                    deltas[term] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Tender):
+            removed.append(obj.id)
+            old = tender_terms(*(committed_value(obj, c) for c in TEXT_COLUMNS))
+            for term in old:
+                deltas[term] -= 1
+
+    if not fresh and not removed:
+        return
+    connection = session.connection()
+    _apply_term_deltas(connection, deltas)
+    df = _load_df(connection, {t for terms in fresh.values() for t in terms})
+    n_docs = connection.execute(select(func.count()).select_from(_vectors)).scalar()
+    n_docs += sum(1 for obj in session.new if isinstance(obj, Tender))
+    vectors: Dict[int, Optional[np.ndarray]] = {
+        tid: vectorize(terms, df, n_docs) for tid, terms in fresh.items()
+    }
+    vectors.update((tid, None) for tid in removed)
+    _write_vectors(connection, vectors, _next_seq(connection))
+
+
+def rebuild_similarity_index(db: Session) -> int:
+    """Полный пересчёт частот слов и векторов всех тендеров."""
+    stmt = select(Tender.id, Tender.subject, Tender.description_raw).order_by(Tender.id)
+    df: Counter = Counter()
+    n_docs = 0
+    rows = db.execute(stmt.execution_options(yield_per=CHUNK_SIZE))
+    for _, subject, description in rows:
+        df.update(tender_terms(subject, description).keys())
+        n_docs += 1
+
+    connection = db.connection()
+    # seq продолжает расти, чтобы другие процессы догрузили новые векторы
+    seq = _next_seq(connection)
+    connection.execute(_vectors.delete())
+    connection.execute(_terms.delete())
+    items = [{"term": t, "df": d} for t, d in df.items()]
+    for start in range(0, len(items), CHUNK_SIZE * 10):
+        connection.execute(_terms.insert(), items[start : start + CHUNK_SIZE * 10])
+
+    result = db.execute(stmt.execution_options(yield_per=CHUNK_SIZE))
+    for chunk in result.partitions():
+        _write_vectors(
+            connection,
+            {tid: vectorize(tender_terms(s, d), df, n_docs) for tid, s, d in chunk},
+            seq,
+        )
+    db.commit()
+    similarity_index.reset()
+    return n_docs
+
+
+def ensure_similarity_index(db: Session) -> None:
+    """Строит индекс на уже заполненной базе или после смены размерности."""
+    sample = db.execute(
+        select(_vectors.c.vector).where(_vectors.c.vector.is_not(None)).limit(1)
+    ).first()
+    if sample is None:
+        if db.query(Tender.id).first() is not None:
+            rebuild_similarity_index(db)
+    elif len(sample[0]) != DIM * 2:
+        rebuild_similarity_index(db)
+
+
+# ---------------------------------------------------------------------
+# Матрица в памяти и поиск ближайших
+# ---------------------------------------------------------------------
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._matrix = np.zeros((0, DIM), dtype=np.float32)
+            self._ids = np.zeros(0, dtype=np.int64)
+            self._prices = np.zeros(0, dtype=np.float64)
+            self._rows: Dict[int, int] = {}
+            self._size = 0
+            self._seq = 0
+            # кластеры IVF: центроиды, кластер каждой строки, размер при обучении
+            self._centroids: Optional[np.ndarray] = None
+            self._assign = np.zeros(0, dtype=np.int32)
+            self._trained_size = 0
+            # строки, упорядоченные по кластеру, и начало каждого кластера в них
+            self._order: Optional[np.ndarray] = None
+            self._starts: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        matrix = np.zeros((capacity, DIM), dtype=np.float32)
+        matrix[: self._size] = self._matrix[: self._size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[: self._size] = self._ids[: self._size]
+        prices = np.full(capacity, np.nan)
+        prices[: self._size] = self._prices[: self._size]
+        assign = np.zeros(capacity, dtype=np.int32)
+        assign[: self._size] = self._assign[: self._size]
+        self._matrix, self._ids, self._prices = matrix, ids, prices
+        self._assign = assign
+
+    def refresh(self) -> None:
+        """Догружает векторы, записанные после последней загрузки."""
+        with self._lock, SessionLocal() as db:
+            stmt = (
+                select(
+                    _vectors.c.tender_id,
+                    _vectors.c.vector,
+                    _vectors.c.seq,
+                    Tender.price_amount,
+                )
+                .join(Tender, Tender.id == _vectors.c.tender_id, isouter=True)
+                .where(_vectors.c.seq > self._seq)
+                .order_by(_vectors.c.seq)
+            )
+            touched: List[int] = []
+            result = db.execute(stmt.execution_options(yield_per=CHUNK_SIZE * 10))
+            for chunk in result.partitions():
+                self._grow(self._size + len(chunk))
+                for tender_id, blob, seq, price in chunk:
+                    row = self._rows.get(tender_id)
+                    if row is None:
+                        row = self._rows[tender_id] = self._size
+                        self._ids[row] = tender_id
+                        self._size += 1
+                    if blob is None:
+                        self._matrix[row] = 0.0
+                        self._prices[row] = np.nan
+                    else:
+                        self._matrix[row] = np.frombuffer(blob, dtype=np.float16)
+                        self._prices[row] = np.nan if price is None else price
+                    self._seq = seq
+                    touched.append(row)
+            if touched and self._centroids is not None:
+                rows = np.array(touched, dtype=np.int64)
+                self._assign[rows] = self._closest_lists(self._matrix[rows])
+                self._order = None
+
+    def vector(self, tender_id: int) -> Optional[np.ndarray]:
+        row = self._rows.get(tender_id)
+        return None if row is None else self._matrix[row]
+
+    # ----- кластеры IVF -----
+
+    def _closest_lists(self, vectors: np.ndarray) -> np.ndarray:
+        block = max(1, SCORE_BLOCK // len(self._centroids))
+        return np.concatenate(
+            [
+                np.argmax(vectors[start : start + block] @ self._centroids.T, axis=1)
+                for start in range(0, len(vectors), block)
+            ]
+        ).astype(np.int32)
+
+    def _train(self) -> None:
+        """Сферический k-means по выборке строк, затем разметка всех строк."""
+        n = self._size
+        matrix = self._matrix[:n]
+        rng = np.random.default_rng(0)
+        sample = matrix[rng.choice(n, min(n, IVF_TRAIN_SAMPLE), replace=False)]
+        n_lists = min(int(math.sqrt(n)), IVF_MAX_LISTS)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            # пустой кластер сохраняет прежний центроид
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+        self._centroids = centroids
+        self._assign[:n] = self._closest_lists(matrix)
+        self._trained_size = n
+        self._order = None
+
+    def _lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._order is None:
+            assign = self._assign[: self._size]
+            self._order = np.argsort(assign, kind="stable")
+            self._starts = np.searchsorted(
+                assign[self._order], np.arange(len(self._centroids) + 1)
+            )
+        return self._order, self._starts
+
+    # ----- поиск -----
+
+    def _top(
+        self, rows: np.ndarray, scores: np.ndarray, k: int
+    ) -> List[List[Tuple[int, float, float]]]:
+        """k лучших в каждой строке кандидатов rows с оценками scores."""
+        if scores.shape[1] > k:
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            rows = np.take_along_axis(rows, best, 1)
+            scores = np.take_along_axis(scores, best, 1)
+        ranked = np.argsort(-scores, axis=1)
+        rows = np.take_along_axis(rows, ranked, 1)
+        scores = np.take_along_axis(scores, ranked, 1)
+        return [
+            [
+                # векторы хранятся в float16: косинус бывает чуть больше 1
+                (tender_id, min(sc, 1.0), price)
+                for tender_id, sc, price in zip(ids, row_scores, prices)
+                if sc >= MIN_SIMILARITY
+            ]
+            for ids, row_scores, prices in zip(
+                self._ids[rows].tolist(),
+                scores.tolist(),
+                self._prices[rows].tolist(),
+            )
+        ]
+
+    def nearest(
+        self, queries: np.ndarray, k: int, exclude: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[int, float, float]]]:
+        """
+        k ближайших для каждой строки queries: [(tender_id, похожесть, цена)],
+        по убыванию похожести, не ниже MIN_SIMILARITY. exclude — id тендеров,
+        которые не возвращать для соответствующего запроса (обычно он сам).
+        """
+        with self._lock:
+            if self._size == 0:
+                return [[] for _ in range(len(queries))]
+            if exclude is None:
+                exclude = np.full(len(queries), -1, dtype=np.int64)
+            if self._size < IVF_MIN_SIZE:
+                return self._nearest_exact(queries, k, exclude)
+            if self._centroids is None or self._size >= 2 * self._trained_size:
+                self._train()
+            return self._nearest_ivf(queries, k, exclude)
+
+    def _nearest_exact(self, queries, k, exclude):
+        matrix = self._matrix[: self._size]
+        ids = self._ids[: self._size]
+        result: List[List[Tuple[int, float, float]]] = []
+        block = max(1, SCORE_BLOCK // self._size)
+        for start in range(0, len(queries), block):
+            scores = queries[start : start + block] @ matrix.T
+            own = exclude[start : start + block]
+            scores[ids[None, :] == own[:, None]] = -1.0
+            rows = np.broadcast_to(np.arange(self._size), scores.shape)
+            result.extend(self._top(rows, scores, k))
+        return result
+
+    def _nearest_ivf(self, queries, k, exclude):
+        order, starts = self._lists()
+        n_lists = len(self._centroids)
+        n_probes = min(IVF_PROBES, n_lists)
+        block = max(1, SCORE_BLOCK // n_lists)
+        probes = np.concatenate(
+            [
+                np.argpartition(
+                    -(queries[s : s + block] @ self._centroids.T), n_probes - 1, axis=1
+                )[:, :n_probes]
+                for s in range(0, len(queries), block)
+            ]
+        )
+        # лучшие k из каждого просмотренного кластера, слот на пару (запрос, кластер)
+        cand_rows = np.zeros((len(queries), n_probes * k), dtype=np.int64)
+        cand_scores = np.full((len(queries), n_probes * k), -1.0, dtype=np.float32)
+        # пары (запрос, кластер) группируются по кластеру: одно умножение
+        # матриц на кластер вместо отдельного поиска на каждый запрос
+        pairs = np.argsort(probes.ravel(), kind="stable")
+        pair_starts = np.searchsorted(probes.ravel()[pairs], np.arange(n_lists + 1))
+        for c in range(n_lists):
+            rows = order[starts[c] : starts[c + 1]]
+            if not len(rows):
+                continue
+            matrix, ids = self._matrix[rows], self._ids[rows]
+            kk = min(k, len(rows))
+            cluster_pairs = pairs[pair_starts[c] : pair_starts[c + 1]]
+            step = max(1, SCORE_BLOCK // len(rows))
+            for s in range(0, len(cluster_pairs), step):
+                chunk = cluster_pairs[s : s + step]
+                q, slot = chunk // n_probes, chunk % n_probes
+                scores = queries[q] @ matrix.T
+                scores[ids[None, :] == exclude[q][:, None]] = -1.0
+                top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+                cols = slot[:, None] * k + np.arange(kk)
+                cand_rows[q[:, None], cols] = rows[top]
+                cand_scores[q[:, None], cols] = np.take_along_axis(scores, top, 1)
+        return self._top(cand_rows, cand_scores, k)
+
+
+similarity_index = SimilarityIndex()
+
+
+def similar_to_tenders(
+    tender_ids: List[int], k: int = 10, db: Optional[Session] = None
+) -> Dict[int, List[Tuple[int, float, float]]]:
+    """
+    Похожие тендеры для нескольких тендеров сразу: id -> [(id, похожесть, цена)].
+    С db векторы ещё не закоммиченных тендеров читаются из её транзакции
+    (сами они в матрице появятся после commit).
+    """
+    similarity_index.refresh()
+    queries: Dict[int, np.ndarray] = {}
+    missing = []
+    for tid in tender_ids:
+        vec = similarity_index.vector(tid)
+        if vec is None:
+            missing.append(tid)
+        else:
+            queries[tid] = vec
+    if missing and db is not None:
+        for start in range(0, len(missing), CHUNK_SIZE):
+            rows = db.execute(
+                select(_vectors.c.tender_id, _vectors.c.vector).where(
+                    _vectors.c.tender_id.in_(missing[start : start + CHUNK_SIZE]),
+                    _vectors.c.vector.is_not(None),
+                )
+            )
+            for tid, blob in rows:
+                queries[tid] = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+
+    result: Dict[int, List[Tuple[int, float, float]]] = {t: [] for t in tender_ids}
+    if queries:
+        known = list(queries)
+        found = similarity_index.nearest(
+            np.stack([queries[tid] for tid in known]),
+            k,
+            np.array(known, dtype=np.int64),
+        )
+        result.update(zip(known, found))
+    return result
+
+
+def comparable_price(
+    neighbours: List[Tuple[int, float, float]]
+) -> Tuple[int, Optional[float]]:
+    """(число похожих тендеров с ценой, медиана их цен)."""
+    prices = [p for _, _, p in neighbours if p and not math.isnan(p) and p > 0]
+    return len(prices), float(np.median(prices)) if prices else None
@@ -0,0 +1,133 @@
+"""
+Подбор поставщиков по категории тендера.
+
+Поле Supplier.categories хранит категории строкой через запятую ("IT,Услуги").
+Для поиска оно разбирается в таблицу supplier_categories с нормализованными
+значениями и индексом (category, supplier_id), поэтому поиск поставщиков
+категории — это точное совпадение по индексу, а не ILIKE '%...%' по всей
+таблице (который к тому же находил "IT" внутри любых слов).
+"""
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, case, event, func, inspect, literal
+from sqlalchemy.orm import Query, Session
+
+from .models import Supplier, SupplierCategory, Tender
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_category(value: Optional[str]) -> Optional[str]:
+    """Приводит категорию к виду для сравнения: без лишних пробелов, casefold."""
+    if not value:
+        return None
+    value = _SPACES.sub(" ", value).strip().casefold()
+    return value or None
+
+
+def split_categories(value: Optional[str]) -> List[str]:
+    """Разбирает строку категорий поставщика в список нормализованных значений."""
+    result: List[str] = []
+    for part in (value or "").split(","):
+        norm = normalize_category(part)
+        if norm and norm not in result:
+            result.append(norm)
+    return result
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_supplier_categories(session: Session, flush_context) -> None:
+    # в after_flush у новых поставщиков уже есть id, а история атрибутов ещё доступна
+    changed = [
+        obj
+        for obj in session.dirty
+        if isinstance(obj, Supplier)
+        and inspect(obj).attrs.categories.history.has_changes()
+    ]
+    stale_ids = [obj.id for obj in changed]
+    stale_ids += [obj.id for obj in session.deleted if isinstance(obj, Supplier)]
+    fresh = changed + [obj for obj in session.new if isinstance(obj, Supplier)]
+    if not stale_ids and not fresh:
+        return
+
+    table = SupplierCategory.__table__
+    connection = session.connection()
+    if stale_ids:
+        connection.execute(table.delete().where(table.c.supplier_id.in_(stale_ids)))
+    rows = [
+        {"supplier_id": obj.id, "category": c}
+        for obj in fresh
+        for c in split_categories(obj.categories)
+    ]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def candidate_suppliers_query(db: Session, tender: Tender) -> Query:
+    """Поставщики, подходящие тендеру по категории и региону."""
+    q = db.query(Supplier)
+    category = normalize_category(tender.category)
+    if category:
+        q = q.join(
+            SupplierCategory, SupplierCategory.supplier_id == Supplier.id
+        ).filter(SupplierCategory.category == category)
+    if tender.region:
+        q = q.filter((Supplier.region == tender.region) | (Supplier.region.is_(None)))
+    return q
+
+
+def match_score_expr(tender: Tender):
+    """
+    match_score в SQL: 0.5 базовый балл, +0.3 если цена тендера в пределах
+    0.5–2 средних контрактов поставщика, + win_rate (не больше 0.2).
+    """
+    score = literal(0.5)
+    if tender.price_amount:
+        ratio = literal(tender.price_amount) / Supplier.avg_contract_size
+        score = score + case(
+            (and_(Supplier.avg_contract_size != 0, ratio.between(0.5, 2)), 0.3),
+            else_=0.0,
+        )
+    return score + func.coalesce(func.min(Supplier.win_rate, 0.2), 0.0)
+
+
+def rank_suppliers(
+    db: Session, tender: Tender, k: int = 5
+) -> List[Tuple[Supplier, float]]:
+    """
+    Top-k поставщиков по match_score среди всех кандидатов.
+    Счёт вычисляется и сортируется в SQLite (ORDER BY ... LIMIT k), поэтому
+    Python получает только k строк независимо от размера каталога.
+    """
+    score = match_score_expr(tender).label("match_score")
+    rows = (
+        candidate_suppliers_query(db, tender)
+        .add_columns(score)
+        .order_by(score.desc(), Supplier.id)
+        .limit(k)
+        .all()
+    )
+    return [(s, min(sc, 1.0)) for s, sc in rows]
+
+
+def rebuild_supplier_categories(db: Session) -> int:
+    """Полная пересборка supplier_categories из Supplier.categories."""
+    db.query(SupplierCategory).delete()
+    rows = []
+    for supplier_id, categories in db.query(Supplier.id, Supplier.categories):
+        rows.extend(
+            {"supplier_id": supplier_id, "category": c}
+            for c in split_categories(categories)
+        )
+    if rows:
+        db.execute(SupplierCategory.__table__.insert(), rows)
+    db.commit()
+    return len(rows)
+
+
+def ensure_supplier_categories(db: Session) -> None:
+    """Строит индекс категорий при первом запуске на уже заполненной базе."""
+    has_links = db.query(SupplierCategory.supplier_id).first() is not None
+    if not has_links and db.query(Supplier.id).first() is not None:
+        rebuild_supplier_categories(db)
@@ -0,0 +1,286 @@
+"""
+Контекст тендеров для промптов LLM.
+
+Контекст собирается сразу для всех тендеров запроса: тендеры, флаги риска
+и похожие тендеры загружаются одним запросом на вид данных, устаревший риск
+пересчитывается одним пакетом. Готовые текстовые блоки кэшируются в памяти
+по (tender_id, версия тендера): повторный вопрос про те же тендеры стоит
+только чтения самих тендеров и проверки свежести их риска. Поставщики
+и похожие тендеры в блоке могут отставать от базы не дольше
+context_cache_ttl_seconds.
+
+Контекст укладывается в бюджет токенов: доля каждого тендера — бюджет,
+делённый на число тендеров, описание ужимается до остатка доли (см.
+prompt_budget.fit_text). Доля входит в ключ кэша вместе с версией тендера.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .llm_cache import tender_version
+from .models import RiskFlag, Tender
+from .prompt_budget import estimate_tokens, fit_text
+from .risk_engine import ensure_risk_fresh_many
+from .similarity import comparable_price, similar_to_tenders
+from .suppliers import rank_suppliers
+
+# "тендер 3 и 7", "тендеры №3, №7", "tender #5", "тендер номер 5",
+# "по тендеру под номером 8", "tender id 10"
+_TENDER_REFS = re.compile(
+    r"(?:тендер\w*|tender\w*)"
+    r"(?:\s*(?:под\s+)?(?:номер\w*|id|no\.?|№|#))*\s*"
+    r"(\d+(?:\s*(?:,|и|and|&|/)\s*[№#]?\s*\d+)*)",
+    re.IGNORECASE,
+)
+_NUMBER = re.compile(r"\d+")
+
+# шаг округления доли бюджета на тендер, токены
+SHARE_STEP = 50
+
+
+def extract_tender_ids(text: str, limit: int = settings.chat_max_tenders) -> List[int]:
+    """Упомянутые в тексте id тендеров: по порядку, без повторов, не больше limit."""
+    ids: List[int] = []
+    for refs in _TENDER_REFS.findall(text):
+        for number in _NUMBER.findall(refs):
+            tender_id = int(number)
+            if tender_id not in ids:
+                ids.append(tender_id)
+    return ids[:limit]
+
+
+# ---------------------------------------------------------------------
+# Кэш готовых блоков
+# ---------------------------------------------------------------------
+
+
+class ContextCache:
+    def __init__(
+        self,
+        max_entries: int = settings.context_cache_entries,
+        ttl_seconds: float = settings.context_cache_ttl_seconds,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # tender_id -> (версия, блок, момент сборки)
+        self._items: "OrderedDict[int, Tuple[str, str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tender_id: int, version: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(tender_id)
+            if (
+                item is None
+                or item[0] != version
+                or time.monotonic() - item[2] > self.ttl_seconds
+            ):
+                self.misses += 1
+                return None
+            self._items.move_to_end(tender_id)
+            self.hits += 1
+            return item[1]
+
+    def put(self, tender_id: int, version: str, block: str) -> None:
+        with self._lock:
+            self._items[tender_id] = (version, block, time.monotonic())
+            self._items.move_to_end(tender_id)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def status(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+context_cache = ContextCache()
+
+
+# ---------------------------------------------------------------------
+# Сборка
+# ---------------------------------------------------------------------
+
+
+def find_similar_tenders(
+    db: Session, tender_ids: List[int], k: int
+) -> Dict[int, List[Tuple[Tender, float]]]:
+    """k похожих по тексту тендеров для каждого id (строки — одним запросом)."""
+    neighbours = similar_to_tenders(tender_ids, k, db)
+    wanted = {tid for found in neighbours.values() for tid, _, _ in found}
+    by_id = {t.id: t for t in db.query(Tender).filter(Tender.id.in_(wanted))}
+    return {
+        tender_id: [(by_id[tid], score) for tid, score, _ in found if tid in by_id]
+        for tender_id, found in neighbours.items()
+    }
+
+
+def _format_block(
+    tender: Tender,
+    description: str,
+    flags: List[RiskFlag],
+    suppliers: list,
+    similar: List[Tuple[Tender, float]],
+) -> str:
+    parts = []
+    parts.append(f"ID (в БД): {tender.id}")
+    if tender.external_id:
+        parts.append(f"Внешний номер: {tender.external_id}")
+    if tender.platform:
+        parts.append(f"Площадка: {tender.platform}")
+    if tender.customer_name:
+        parts.append(f"Заказчик: {tender.customer_name}")
+    if tender.subject:
+        parts.append(f"Предмет закупки: {tender.subject}")
+    if description:
+        parts.append(f"Описание: {description}")
+    if tender.price_amount:
+        parts.append(f"Цена: {tender.price_amount} {tender.price_currency or 'KZT'}")
+    if tender.category:
+        parts.append(f"Категория: {tender.category}")
+    if tender.region:
+        parts.append(f"Регион: {tender.region}")
+
+    if flags:
+        parts.append("\nФлаги риска:")
+        for f in flags:
+            parts.append(f"- [{f.code}] {f.description} (вес {f.weight})")
+    else:
+        parts.append("\nФлаги риска: не найдены.")
+
+    if suppliers:
+        parts.append("\nРекомендованные поставщики:")
+        for s in suppliers:
+            parts.append(
+                f"- {s.name} (регион: {s.region or 'не указан'}, "
+                f"средний контракт: {s.avg_contract_size or 'N/A'}, "
+                f"win_rate: {s.win_rate or 'N/A'})"
+            )
+    else:
+        parts.append("\nПодходящие поставщики: не найдены.")
+
+    if similar:
+        parts.append("\nПохожие тендеры (для сравнения цены и условий):")
+        for t, score in similar:
+            price = (
+                f"{t.price_amount} {t.price_currency or 'KZT'}"
+                if t.price_amount
+                else "не указана"
+            )
+            parts.append(
+                f"- #{t.id} {t.subject or 'без названия'} "
+                f"(цена: {price}, категория: {t.category or 'не указана'}, "
+                f"похожесть: {score:.2f})"
+            )
+        _, median = comparable_price(
+            [(t.id, score, t.price_amount) for t, score in similar]
+        )
+        if median:
+            parts.append(f"Медианная цена похожих тендеров: {median:.0f}")
+
+    return "\n".join(parts)
+
+
+def _fit_block(
+    tender: Tender,
+    max_tokens: int,
+    flags: List[RiskFlag],
+    suppliers: list,
+    similar: List[Tuple[Tender, float]],
+) -> str:
+    """
+    Блок примерно в max_tokens: сначала ужимается описание, если и без него
+    не влезает — отбрасываются последние (наименее подходящие) похожие
+    тендеры и поставщики. Флаги риска не режутся.
+    """
+    rest = estimate_tokens(_format_block(tender, "", flags, suppliers, similar))
+    while rest > max_tokens and (similar or suppliers):
+        if len(similar) >= len(suppliers):
+            similar = similar[:-1]
+        else:
+            suppliers = suppliers[:-1]
+        rest = estimate_tokens(_format_block(tender, "", flags, suppliers, similar))
+    description = tender.description_raw or ""
+    if description:
+        limit = min(settings.prompt_field_tokens, max_tokens - rest)
+        query = f"{tender.subject or ''} {tender.category or ''}"
+        description = fit_text(description, limit, query)
+    return _format_block(tender, description, flags, suppliers, similar)
+
+
+def load_tender_contexts(
+    db: Session, tender_ids: List[int], max_tokens: int = settings.prompt_max_tokens
+) -> Dict[int, str]:
+    """
+    Блоки контекста для найденных тендеров из tender_ids: id -> текст.
+    Вместе блоки укладываются примерно в max_tokens.
+    """
+    if not tender_ids:
+        return {}
+    tenders = db.query(Tender).filter(Tender.id.in_(tender_ids)).all()
+    # пересчёт меняет updated_at, поэтому версии берём после него
+    ensure_risk_fresh_many(db, tenders)
+
+    blocks: Dict[int, str] = {}
+    # доля округляется вниз, чтобы вопросы разной длины попадали в кэш
+    share = max_tokens // max(len(tenders), 1) // SHARE_STEP * SHARE_STEP
+    versions = {t.id: f"{tender_version(t)}:{share}" for t in tenders}
+    for t in tenders:
+        cached = context_cache.get(t.id, versions[t.id])
+        if cached is not None:
+            blocks[t.id] = cached
+    missing = [t for t in tenders if t.id not in blocks]
+    if not missing:
+        return blocks
+
+    ids = [t.id for t in missing]
+    flags: Dict[int, List[RiskFlag]] = {tid: [] for tid in ids}
+    flag_rows = db.query(RiskFlag).filter(RiskFlag.tender_id.in_(ids))
+    for f in flag_rows.order_by(RiskFlag.id):
+        flags[f.tender_id].append(f)
+    similar = find_similar_tenders(db, ids, 5)
+
+    for t in missing:
+        suppliers = [s for s, _ in rank_suppliers(db, t, 5)]
+        block = _fit_block(t, share, flags[t.id], suppliers, similar[t.id])
+        context_cache.put(t.id, versions[t.id], block)
+        blocks[t.id] = block
+    return blocks
+
+
+def build_tender_context(
+    db: Session, tender_id: int, max_tokens: int = settings.prompt_max_tokens
+) -> Optional[str]:
+    """Формирует текстовый контекст по тендеру для ИИ."""
+    return load_tender_contexts(db, [tender_id], max_tokens).get(tender_id)
+
+
+def chat_context(
+    db: Session, user_msg: str, max_tokens: int = settings.prompt_max_tokens
+) -> Optional[str]:
+    """Контекст по всем тендерам, упомянутым в сообщении; None — тендеров нет."""
+    tender_ids = extract_tender_ids(user_msg)
+    if not tender_ids:
+        return None
+    if len(tender_ids) == 1:
+        return load_tender_contexts(db, tender_ids, max_tokens).get(tender_ids[0])
+    # заголовки секций тоже занимают бюджет
+    headers = sum(estimate_tokens(f"=== Тендер {i} ===\n\n") for i in tender_ids)
+    blocks = load_tender_contexts(db, tender_ids, max_tokens - headers)
+    sections = []
+    for tender_id in tender_ids:
+        block = blocks.get(tender_id, "нет в базе данных.")
+        sections.append(f"=== Тендер {tender_id} ===\n{block}")
+    return "\n\n".join(sections)
@@ -1,6 +1,8 @@
-import os
-import requests
+import time
 import asyncio
+from collections import OrderedDict
+
+import aiohttp
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.types import Message
 from aiogram.filters import Command
@@ -9,6 +11,175 @@ from aiogram.client.default import DefaultBotProperties
 
 BACKEND_URL = "http://127.0.0.1:8000"
 
+# соединений к backend одновременно (keep-alive, общий пул на все чаты)
+BACKEND_MAX_CONNECTIONS = 100
+# таймауты запроса к backend, секунды (загрузка файла — дольше)
+BACKEND_TIMEOUT = 15
+UPLOAD_TIMEOUT = 300
+# потоковая передача ограничена не общим временем, а паузой без данных
+STREAM_READ_TIMEOUT = 60
+# повторы GET при обрыве связи и 5xx, пауза растёт как backoff * 2^n
+BACKEND_RETRIES = 3
+BACKEND_BACKOFF = 0.5
+# кэш ответов по тендерам: срок жизни и число записей
+CACHE_TTL = 60
+CACHE_MAX_ENTRIES = 1000
+# файлы больше этого загружаются заданием с сообщениями о прогрессе, байты
+LARGE_FILE_BYTES = 1024 * 1024
+# блок передачи файла из Telegram в backend и период опроса задания, секунды
+UPLOAD_CHUNK_BYTES = 64 * 1024
+PROGRESS_INTERVAL = 3
+
+
+# -----------------------
+# HTTP-клиент backend
+# -----------------------
+class BackendClient:
+    """
+    Общий для всех обработчиков асинхронный клиент backend: одна
+    aiohttp-сессия с пулом keep-alive соединений, таймаутами и повторами,
+    плюс небольшой TTL-кэш успешных GET, чтобы повторные запросы одного
+    тендера из разных чатов не доходили до backend. Устаревшая запись
+    перепроверяется по ETag (If-None-Match): если данные не менялись,
+    backend отвечает 304 без тела.
+    """
+
+    def __init__(self, base_url, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._session = None
+        # путь -> (момент устаревания, json, ETag)
+        self._cache = OrderedDict()
+        # путь -> задача запроса, который уже выполняется
+        self._inflight = {}
+
+    def session(self):
+        # сессию создаём внутри работающего event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=BACKEND_MAX_CONNECTIONS, keepalive_timeout=30
+                ),
+                timeout=aiohttp.ClientTimeout(total=BACKEND_TIMEOUT, connect=5),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def get_json(self, path, cache=True):
+        """
+        (статус, json) ответа GET; успешные ответы кэшируются на ttl секунд,
+        одновременные запросы одного пути ждут общий ответ. cache=False —
+        всегда свежий ответ (например, прогресс задания).
+        """
+        if not cache:
+            return await self._fetch(path, cache=False)
+        hit = self._cache.get(path)
+        if hit is not None and hit[0] > time.monotonic():
+            self._cache.move_to_end(path)
+            return 200, hit[1]
+
+        task = self._inflight.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(path))
+            self._inflight[path] = task
+            task.add_done_callback(lambda _: self._inflight.pop(path, None))
+        # shield: отмена одного обработчика не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    async def _fetch(self, path, cache=True):
+        stale = self._cache.get(path) if cache else None
+        headers = {"If-None-Match": stale[2]} if stale and stale[2] else {}
+        for attempt in range(BACKEND_RETRIES + 1):
+            try:
+                async with self.session().get(
+                    self.base_url + path, headers=headers
+                ) as r:
+                    if r.status < 500 or attempt == BACKEND_RETRIES:
+                        data = await r.json() if r.status == 200 else None
+                        etag = r.headers.get("ETag")
+                        break
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == BACKEND_RETRIES:
+                    raise
+            await asyncio.sleep(BACKEND_BACKOFF * 2**attempt)
+
+        status = r.status
+        if status == 304 and stale:
+            status, data = 200, stale[1]
+        if status == 200 and cache:
+            self._cache[path] = (time.monotonic() + self.ttl, data, etag)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return status, data
+
+    async def _send(self, method, path, timeout=None, **kwargs):
+        # без повторов: загрузка не идемпотентна
+        timeout = timeout or aiohttp.ClientTimeout(total=UPLOAD_TIMEOUT, connect=5)
+        async with self.session().request(
+            method, self.base_url + path, timeout=timeout, **kwargs
+        ) as r:
+            data = await r.json() if r.content_type == "application/json" else None
+            # данные в базе поменялись — кэшированные ответы больше не верны
+            self._cache.clear()
+            return r.status, data
+
+    async def post_file(self, path, chunks, filename):
+        """
+        Загрузка файла формой multipart; chunks — байты или асинхронный
+        итератор блоков (тогда тело уходит chunked, целиком в памяти его нет).
+        (статус, json) ответа.
+        """
+        form = aiohttp.FormData()
+        form.add_field("file", chunks, filename=filename, content_type="text/csv")
+        return await self._send("POST", path, data=form)
+
+    async def post_json(self, path, payload):
+        return await self._send("POST", path, json=payload)
+
+    async def put_stream(self, path, chunks):
+        """
+        PUT с телом из асинхронного итератора блоков (chunked). Общего
+        таймаута нет: большой файл передаётся сколько нужно, обрывается
+        только передача, застывшая на STREAM_READ_TIMEOUT.
+        """
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=5, sock_read=STREAM_READ_TIMEOUT
+        )
+        return await self._send(
+            "PUT",
+            path,
+            timeout=timeout,
+            data=chunks,
+            headers={"Content-Type": "text/csv"},
+        )
+
+
+backend = BackendClient(BACKEND_URL)
+
+
+async def fetch_tender(message: Message, tender_id, part="report"):
+    """
+    Отчёт по тендеру (или его часть: "risks", "suppliers") либо None —
+    тогда пользователю уже отправлено сообщение об ошибке.
+    """
+    if not tender_id.isdigit():
+        await message.answer("⚠ Номер тендера должен быть числом.")
+        return None
+    try:
+        status, data = await backend.get_json(f"/tenders/{tender_id}/{part}")
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        await message.answer("⚠ Сервер недоступен, попробуйте позже.")
+        return None
+    if status != 200:
+        await message.answer("⚠ Тендер не найден.")
+        return None
+    return data
+
 bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
 
 dp = Dispatcher()
@@ -44,14 +215,10 @@ async def tender_cmd(message: Message):
         return
 
     tender_id = parts[1]
-    r = requests.get(f"{BACKEND_URL}/tenders/{tender_id}/report")
-
-    if r.status_code != 200:
-        await message.answer("⚠ Тендер не найден.")
+    data = await fetch_tender(message, tender_id)
+    if data is None:
         return
 
-    data = r.json()
-
     t = data["tender"]
 
     txt = (
@@ -77,13 +244,11 @@ async def risks_cmd(message: Message):
         return
 
     tender_id = parts[1]
-    r = requests.get(f"{BACKEND_URL}/tenders/{tender_id}/report")
-
-    if r.status_code != 200:
-        await message.answer("⚠ Тендер не найден.")
+    data = await fetch_tender(message, tender_id, "risks")
+    if data is None:
         return
 
-    flags = r.json()["risk_flags"]
+    flags = data["risk_flags"]
 
     if not flags:
         await message.answer("✔ Риски не обнаружены.")
@@ -107,13 +272,11 @@ async def suppliers_cmd(message: Message):
         return
 
     tender_id = parts[1]
-    r = requests.get(f"{BACKEND_URL}/tenders/{tender_id}/report")
-
-    if r.status_code != 200:
-        await message.answer("⚠ Тендер не найден.")
+    data = await fetch_tender(message, tender_id, "suppliers")
+    if data is None:
         return
 
-    suppliers = r.json()["suppliers"]
+    suppliers = data["suppliers"]
     if not suppliers:
         await message.answer("Нет подходящих поставщиков.")
         return
@@ -147,40 +310,129 @@ async def upload_suppliers(message: Message):
 # -----------------------
 # handle CSV uploads
 # -----------------------
+def telegram_file_chunks(file_path):
+    """Блоки файла прямо из Telegram, без сохранения на диск."""
+    url = bot.session.api.file_url(bot.token, file_path)
+    return bot.session.stream_content(
+        url,
+        timeout=UPLOAD_TIMEOUT,
+        chunk_size=UPLOAD_CHUNK_BYTES,
+        raise_for_status=True,
+    )
+
+
+def ingest_counts(data):
+    return (
+        f"добавлено {data['inserted']}, обновлено {data['updated']}, "
+        f"отклонено {data['rejected']}"
+    )
+
+
+def upload_error(upload):
+    """Текст ошибки завершившейся передачи файла (задача put_stream) или None."""
+    if upload.cancelled():
+        return "передача файла отменена"
+    exc = upload.exception()
+    if exc is not None:
+        return f"передача файла прервана ({type(exc).__name__})"
+    status, data = upload.result()
+    if status != 202:
+        return (data or {}).get("detail") or f"сервер ответил {status}"
+    return None
+
+
+def ingest_progress(job):
+    counts = f"добавлено {job['inserted']}, обновлено {job['updated']}"
+    if job["progress"] is None:
+        return f"⏳ Файл обрабатывается: {counts}"
+    return f"⏳ Обработано {job['progress']:.0%} файла: {counts}"
+
+
+async def ingest_job(message: Message, kind, chunks, size):
+    """
+    Большой файл: задание загрузки на backend, тело — PUT из потока
+    Telegram, прогресс — правкой одного сообщения раз в PROGRESS_INTERVAL.
+    """
+    status, job = await backend.post_json(
+        "/ingest/jobs", {"kind": kind, "bytes_total": size}
+    )
+    if status != 201:
+        await message.answer("⚠ Ошибка обработки файла.")
+        return
+    job_path = f"/ingest/jobs/{job['id']}"
+    shown = ingest_progress(job)
+    progress = await message.answer(shown)
+
+    upload = asyncio.ensure_future(backend.put_stream(job_path + "/data", chunks))
+    try:
+        while job["status"] not in ("done", "failed"):
+            if upload.done():
+                await asyncio.sleep(PROGRESS_INTERVAL)
+            else:
+                # ждём период опроса или конец передачи, если он раньше
+                await asyncio.wait({upload}, timeout=PROGRESS_INTERVAL)
+                error = upload_error(upload) if upload.done() else None
+                if error:
+                    await progress.edit_text(f"⚠ Ошибка обработки файла: {error}")
+                    return
+            status, job = await backend.get_json(job_path, cache=False)
+            if status != 200:
+                await progress.edit_text("⚠ Ошибка обработки файла.")
+                return
+            text = ingest_progress(job)
+            # Telegram отклоняет правку без изменений
+            if text != shown and job["status"] not in ("done", "failed"):
+                await progress.edit_text(text)
+                shown = text
+    finally:
+        # передача ещё идёт, только если backend перестал отвечать на опрос
+        if not upload.done():
+            upload.cancel()
+        await asyncio.gather(upload, return_exceptions=True)
+
+    if job["status"] == "done":
+        await progress.edit_text(f"✅ Файл обработан: {ingest_counts(job)}.")
+    else:
+        await progress.edit_text(f"⚠ Ошибка обработки файла: {job['error']}")
+
+
 @router.message(F.document)
 async def handle_file(message: Message):
     filename = message.document.file_name.lower()
-
-    file_info = await bot.get_file(message.document.file_id)
-    dest = f"temp/{filename}"
-    os.makedirs("temp", exist_ok=True)
-    await bot.download_file(file_info.file_path, dest)
-
     if "tender" in filename:
-        url = f"{BACKEND_URL}/tenders/ingest_csv"
+        kind = "tenders"
     elif "supplier" in filename:
-        url = f"{BACKEND_URL}/suppliers/ingest_csv"
+        kind = "suppliers"
     else:
         await message.answer("❗ Имя файла должно содержать 'tender' или 'supplier'")
         return
 
-    files = {"file": open(dest, "rb")}
-    r = requests.post(url, files=files)
-
-    if r.status_code == 200:
-        await message.answer("✅ Файл успешно обработан.")
+    try:
+        file_info = await bot.get_file(message.document.file_id)
+        chunks = telegram_file_chunks(file_info.file_path)
+        size = message.document.file_size
+        if size and size > LARGE_FILE_BYTES:
+            await ingest_job(message, kind, chunks, size)
+            return
+        status, data = await backend.post_file(f"/{kind}/ingest_csv", chunks, filename)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        status = None
+
+    if status == 200:
+        await message.answer(f"✅ Файл обработан: {ingest_counts(data)}.")
     else:
         await message.answer("⚠ Ошибка обработки файла.")
 
-    os.remove(dest)
-
 
 # -----------------------
 # run bot
 # -----------------------
 async def main():
     print("🚀 Bot started")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await backend.close()
 
 
 if __name__ == "__main__":
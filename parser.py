@@ -1,15 +1,202 @@
 import requests
-import json
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urljoin
 import os
+import threading
+import time
+
+# адрес API; для тестов можно направить на локальную заглушку
+BASE_URL = os.environ.get("GOSZAKUP_BASE_URL", "https://ows.goszakup.gov.kz")
+TENDERS_PATH = "/v3/tender"
+PER_PAGE = 500
+# одновременных запросов страниц и общий предел запросов в секунду
+WORKERS = 4
+REQUESTS_PER_SECOND = 5.0
+# повторы при обрывах связи, 429 и 5xx; пауза растёт как backoff * 2^n
+RETRIES = 5
+BACKOFF_SECONDS = 0.5
+TIMEOUT_SECONDS = 30
+
+# ============================
+#   ЗАГРУЗКА СТРАНИЦ API
+# ============================
+
+
+def make_session(pool_size=WORKERS, retries=RETRIES, backoff=BACKOFF_SECONDS):
+    """Сессия с пулом keep-alive соединений и повторами с экспоненциальной паузой."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RateLimiter:
+    """Не больше rate запросов в секунду на все потоки вместе."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def page_items(payload):
+    """Тендеры страницы: API отдаёт их в "data" или в "items"."""
+    return payload.get("data") or payload.get("items") or []
+
+
+def page_count(payload):
+    """Число страниц из _meta (пагинация по номеру) или None."""
+    meta = payload.get("_meta") or {}
+    if meta.get("pageCount") is not None:
+        return int(meta["pageCount"])
+    return None
+
+
+def next_link(payload):
+    """Ссылка на следующую страницу (курсорная пагинация) или None."""
+    links = payload.get("_links") or payload.get("links") or {}
+    nxt = links.get("next")
+    if isinstance(nxt, dict):
+        nxt = nxt.get("href")
+    return nxt or payload.get("next_page")
+
+
+class GoszakupFetcher:
+    """
+    Постраничная загрузка тендеров из API goszakup.
+
+    Если API сообщает число страниц (_meta.pageCount), страницы со второй
+    запрашиваются параллельно в workers потоках; если только ссылку на
+    следующую страницу — последовательно по ссылкам. Все запросы идут через
+    одну сессию (пул соединений, повторы) и общий ограничитель частоты.
+    """
+
+    def __init__(
+        self,
+        base_url=BASE_URL,
+        session=None,
+        workers=WORKERS,
+        rate=REQUESTS_PER_SECOND,
+        per_page=PER_PAGE,
+        timeout=TIMEOUT_SECONDS,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or make_session(pool_size=workers)
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(rate)
+        self.per_page = per_page
+        self.timeout = timeout
+        self.requests_made = 0
+        self._count_lock = threading.Lock()
+
+    def get(self, url, params=None):
+        self.limiter.wait()
+        # get вызывается из потоков пула
+        with self._count_lock:
+            self.requests_made += 1
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def pages(self, date_from, date_to):
+        """Страницы ответа API (разобранный JSON) по порядку."""
+        url = self.base_url + TENDERS_PATH
+        params = {
+            "filter[announce_date][gte]": date_from,
+            "filter[announce_date][lte]": date_to,
+            "per-page": self.per_page,
+            "page": 1,
+        }
+        first = self.get(url, params)
+        yield first
+
+        count = page_count(first)
+        if count is not None:
+            # в работе не больше workers * 2 страниц: если потребитель
+            # (запись в БД) медленнее API, загрузка ждёт его, а не копит
+            # ответы в памяти
+            pages = iter(range(2, count + 1))
+            window = deque()
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+                def submit(page):
+                    window.append(pool.submit(self.get, url, {**params, "page": page}))
+
+                try:
+                    for page in islice(pages, self.workers * 2):
+                        submit(page)
+                    while window:
+                        payload = window.popleft().result()
+                        for page in islice(pages, 1):
+                            submit(page)
+                        yield payload
+                finally:
+                    # потребитель остановился — незапущенные запросы не нужны
+                    for future in window:
+                        future.cancel()
+            return
+
+        payload = first
+        while page_items(payload) and next_link(payload):
+            payload = self.get(urljoin(self.base_url + "/", next_link(payload)))
+            yield payload
+
+    def tenders(self, date_from, date_to):
+        """Тендеры за период без повторов (страницы могут сдвинуться при загрузке)."""
+        seen = set()
+        for payload in self.pages(date_from, date_to):
+            for t in page_items(payload):
+                key = t.get("id")
+                if key is not None and key in seen:
+                    continue
+                seen.add(key)
+                yield t
+
 
 # ============================
 #   ПАРСИНГ ТЕНДЕРОВ ГОСЗАКУП
 # ============================
 
 
-def get_tenders_last_days(days=1):
+def tender_row(t):
+    """Поля тендера API, подходящие для проекта."""
+    return {
+        "external_id": str(t["id"]) if t.get("id") is not None else None,
+        "platform": "goszakup",
+        "customer_name": (t.get("customer") or {}).get("name_ru"),
+        "subject": t.get("name_ru"),
+        "description_raw": t.get("description_ru"),
+        "price_amount": t.get("amount"),
+        "price_currency": t.get("currency"),
+        "announce_date": t.get("announce_date"),
+    }
+
+
+def get_tenders_last_days(days=1, base_url=BASE_URL):
     """
     Парсит тендеры с ows.goszakup.gov.kz
     без API-ключа (через публичный endpoint).
@@ -20,37 +207,18 @@ def get_tenders_last_days(days=1):
     date_from = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
     date_to = datetime.now().strftime("%Y-%m-%d")
 
-    url = f"https://ows.goszakup.gov.kz/v3/tender?filter[announce_date][gte]={date_from}&filter[announce_date][lte]={date_to}&per-page=500"
-
-    response = requests.get(url)
-    if response.status_code != 200:
-        print("❌ Ошибка запроса:", response.status_code)
+    fetcher = GoszakupFetcher(base_url)
+    try:
+        rows = [tender_row(t) for t in fetcher.tenders(date_from, date_to)]
+    except requests.RequestException as e:
+        print("❌ Ошибка запроса:", e)
         return
 
-    data = response.json()
-    tenders = data.get("data", [])
-
-    if not tenders:
+    if not rows:
         print("⚠ Нет тендеров за выбранный период.")
         return
 
-    print(f"✔ Найдено тендеров: {len(tenders)}")
-
-    # Выбираем поля, подходящие для твоего проекта
-    rows = []
-    for t in tenders:
-        rows.append(
-            {
-                "external_id": t.get("id"),
-                "platform": "goszakup",
-                "customer_name": t.get("customer", {}).get("name_ru"),
-                "subject": t.get("name_ru"),
-                "description_raw": t.get("description_ru"),
-                "price_amount": t.get("amount"),
-                "price_currency": t.get("currency"),
-                "announce_date": t.get("announce_date"),
-            }
-        )
+    print(f"✔ Найдено тендеров: {len(rows)} (запросов к API: {fetcher.requests_made})")
 
     df = pd.DataFrame(rows)
 
@@ -62,6 +230,119 @@ def get_tenders_last_days(days=1):
     print("✔ Готово!")
 
 
+# ============================
+#   ЗАГРУЗКА ПРЯМО В БАЗУ
+# ============================
+
+SYNC_SOURCE = "goszakup"
+
+
+def _print_progress(totals):
+    print(
+        f"  пачка {totals['batches']}: всего новых {totals['inserted']}, "
+        f"обновлено {totals['updated']}"
+    )
+
+
+def _stream_to_db(db, records, batch_size):
+    """Пишет записи в базу пачками; None — если API перестал отвечать."""
+    from backend.ingest import stream_ingest_tenders
+
+    try:
+        summary = stream_ingest_tenders(db, records, batch_size, _print_progress)
+    except requests.RequestException as e:
+        print("❌ Ошибка запроса (принятые пачки сохранены):", e)
+        return None
+    print(
+        f"✔ Записей: {summary['rows_total']}, новых: {summary['inserted']}, "
+        f"обновлено: {summary['updated']}, отклонено: {summary['rejected']} "
+        f"за {summary['total_seconds']:.1f} с"
+    )
+    return summary
+
+
+def sync_tenders_last_days(days=1, base_url=BASE_URL, batch_size=1000):
+    """
+    Режим конвейера: тендеры из API сразу пишутся в базу backend пачками
+    (новые вставляются, известные по external_id обновляются), без
+    DataFrame и промежуточного CSV. Статистика категорий и риск
+    пересчитываются один раз на пачку.
+    """
+    # backend нужен только в режимах загрузки в базу
+    from backend.db import SessionLocal, init_storage
+
+    print(f"▶ Загружаем в базу тендеры за последние {days} дней...")
+
+    date_from = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    date_to = datetime.now().strftime("%Y-%m-%d")
+
+    init_storage()
+    fetcher = GoszakupFetcher(base_url)
+    records = (tender_row(t) for t in fetcher.tenders(date_from, date_to))
+    with SessionLocal() as db:
+        return _stream_to_db(db, records, batch_size)
+
+
+def sync_key(announce_date, external_id):
+    """Порядок записей для отметки синхронизации: дата объявления, затем id."""
+    ext = str(external_id or "")
+    return (announce_date or "", int(ext) if ext.isdigit() else -1, ext)
+
+
+def sync_incremental(days=7, base_url=BASE_URL, batch_size=1000):
+    """
+    Инкрементальная синхронизация: из API запрашиваются тендеры начиная
+    с дня отметки (announce_date + id последнего загруженного), в базу идут
+    только записи новее отметки. Первый запуск берёт последние days дней.
+
+    Отметка сохраняется только после успешного прохода: прерванный запуск
+    повторится с прежней отметки, а повторно пришедшие записи обновят
+    существующие тендеры (upsert по platform + external_id), не создавая
+    дублей. Риск пересчитывается только у новых и изменившихся тендеров.
+    """
+    from backend.db import SessionLocal, init_storage
+    from backend.ingest import load_checkpoint, save_checkpoint
+
+    init_storage()
+    with SessionLocal() as db:
+        mark = load_checkpoint(db, SYNC_SOURCE)
+        if mark:
+            print(f"▶ Синхронизация после {mark[0]} (id {mark[1]})...")
+            date_from = mark[0][:10]
+            mark_key = sync_key(*mark)
+        else:
+            print(f"▶ Первая синхронизация: тендеры за последние {days} дней...")
+            date_from = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+            mark_key = None
+        date_to = datetime.now().strftime("%Y-%m-%d")
+
+        newest = {"key": mark_key, "mark": mark}
+        skipped = 0
+
+        def newer_records():
+            nonlocal skipped
+            fetcher = GoszakupFetcher(base_url)
+            for t in fetcher.tenders(date_from, date_to):
+                row = tender_row(t)
+                key = sync_key(row["announce_date"], row["external_id"])
+                if mark_key is not None and key <= mark_key:
+                    skipped += 1
+                    continue
+                if newest["key"] is None or key > newest["key"]:
+                    newest["key"] = key
+                    newest["mark"] = (row["announce_date"], row["external_id"])
+                yield row
+
+        summary = _stream_to_db(db, newer_records(), batch_size)
+        if summary is None:
+            return None
+        print(f"  пропущено уже загруженных: {skipped}")
+        if newest["mark"] != mark:
+            save_checkpoint(db, SYNC_SOURCE, *newest["mark"])
+            print(f"📌 Новая отметка: {newest['mark'][0]} (id {newest['mark'][1]})")
+    return summary
+
+
 # ============================
 #        ОСНОВНОЕ МЕНЮ
 # ============================
@@ -77,6 +358,8 @@ def main():
     print("2. Парсить за вчера")
     print("3. Парсить за последние 7 дней")
     print("4. Ввести своё количество дней")
+    print("5. Загрузить в базу напрямую (без CSV)")
+    print("6. Синхронизировать новые тендеры с базой")
     print("0. Выйти\n")
 
     choice = input("Выберите пункт: ").strip()
@@ -90,6 +373,11 @@ def main():
     elif choice == "4":
         d = int(input("Введите количество дней: "))
         get_tenders_last_days(d)
+    elif choice == "5":
+        d = int(input("Введите количество дней: "))
+        sync_tenders_last_days(d)
+    elif choice == "6":
+        sync_incremental()
     else:
         print("Выход...")
 
@@ -0,0 +1,20 @@
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def pytest_configure(config):
+    # путь ./ai_procure.db фиксируется при импорте backend.db, то есть уже
+    # при сборе тестов: заранее уходим во временный каталог, чтобы тесты
+    # не писали в базу проекта
+    os.chdir(tempfile.mkdtemp(prefix="ai_procure_tests_"))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from backend.main import app
+
+    with TestClient(app) as c:
+        yield c
@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+import pytest
+
+from backend import main
+from backend.llm import LLMBusyError, LLMClient
+
+TENDERS_CSV = (
+    "external_id,platform,subject,price_amount,price_currency,category,region\n"
+    + "".join(
+        f"JOB-{i},gz.kz,Поставка оборудования {i},{1000 + i},KZT,JOB-CAT,Astana\n"
+        for i in range(6)
+    )
+)
+
+
+class GatedTransport:
+    """Заглушка LLM: ответ после паузы, считает одновременные генерации."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+
+    async def generate(self, model, prompt):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        return f"Анализ #{self.calls}"
+
+    async def stream(self, model, prompt):
+        yield await self.generate(model, prompt)
+
+
+def test_llm_client_rejects_beyond_queue():
+    transport = GatedTransport(delay=0.2)
+    client = LLMClient(transport=transport, max_concurrency=1, max_queue=1)
+
+    async def run():
+        first = asyncio.ensure_future(client.generate("a"))
+        second = asyncio.ensure_future(client.generate("b"))
+        await asyncio.sleep(0.05)
+        assert (client.active, client.waiting) == (1, 1)
+        with pytest.raises(LLMBusyError) as busy:
+            await client.generate("c")
+        assert busy.value.retry_after > 0
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(run()) == ["Анализ #1", "Анализ #2"]
+    assert transport.max_active == 1
+    assert client.rejected == 1
+    assert client.completed == 2
+
+
+def test_llm_busy_is_429(client, monkeypatch):
+    # все места в пуле и очереди заняты
+    llm = main.llm_client
+    monkeypatch.setattr(llm, "active", llm.max_concurrency + llm.max_queue)
+    client.post(
+        "/tenders/ingest_csv",
+        files={"file": ("t.csv", TENDERS_CSV.encode(), "text/csv")},
+    )
+    tender_id = client.get("/tenders", params={"limit": 1}).json()["items"][0]["id"]
+
+    r = client.get(f"/ai/analyze_tender/{tender_id}")
+
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
+
+
+def test_analysis_job_with_stub_llm(client, monkeypatch):
+    transport = GatedTransport()
+    monkeypatch.setattr(main.llm_client, "transport", transport)
+    monkeypatch.setattr(main.analysis_jobs, "workers", 2)
+    client.post(
+        "/tenders/ingest_csv",
+        files={"file": ("t.csv", TENDERS_CSV.encode(), "text/csv")},
+    )
+
+    r = client.post("/ai/jobs", json={"category": "JOB-CAT"})
+    assert r.status_code == 202
+    job = r.json()
+    assert job["total"] == 6
+
+    deadline = time.monotonic() + 10
+    while job["status"] not in ("done", "failed") and time.monotonic() < deadline:
+        time.sleep(0.05)
+        job = client.get(f"/ai/jobs/{job['id']}").json()
+
+    assert job["status"] == "done"
+    assert (job["done"], job["failed"], job["progress"]) == (6, 0, 1.0)
+    # пул ограничен числом воркеров
+    assert 1 <= transport.max_active <= 2
+
+    results = client.get(f"/ai/jobs/{job['id']}/results", params={"limit": 4}).json()
+    assert len(results["items"]) == 4
+    assert all(item["analysis"].startswith("Анализ") for item in results["items"])
+    rest = client.get(
+        f"/ai/jobs/{job['id']}/results", params={"after": results["next_after"]}
+    ).json()
+    assert len(rest["items"]) == 2 and rest["next_after"] is None
+
+
+def test_llm_wait_holds_no_db_connection(client, monkeypatch):
+    from backend.db import engine
+
+    checked_out = []
+
+    class PoolProbe(GatedTransport):
+        async def generate(self, model, prompt):
+            checked_out.append(engine.pool.checkedout())
+            return await super().generate(model, prompt)
+
+    monkeypatch.setattr(main.llm_client, "transport", PoolProbe())
+    # новый тендер: ответа в кэше LLM для него ещё нет
+    client.post(
+        "/tenders/ingest_csv",
+        files={
+            "file": ("t.csv", b"external_id,platform,subject\nPROBE-1,gz.kz,Probe\n")
+        },
+    )
+    items = client.get("/tenders", params={"limit": 1000}).json()["items"]
+    tender_id = next(t["id"] for t in items if t["external_id"] == "PROBE-1")
+
+    assert client.get(f"/ai/analyze_tender/{tender_id}").status_code == 200
+    assert client.post("/chat/send", json={"message": "тендер 1"}).status_code == 200
+    # пока модель генерирует, соединение с БД уже возвращено в пул
+    assert checked_out == [0, 0]
+
+
+def test_cancel_analysis_job_returns_cancelled(client, monkeypatch):
+    monkeypatch.setattr(main.llm_client, "transport", GatedTransport(delay=5))
+    client.post(
+        "/tenders/ingest_csv",
+        files={"file": ("t.csv", TENDERS_CSV.encode(), "text/csv")},
+    )
+    job = client.post("/ai/jobs", json={"category": "JOB-CAT"}).json()
+
+    r = client.post(f"/ai/jobs/{job['id']}/cancel")
+
+    assert r.status_code == 200
+    assert r.json()["status"] == "cancelled"
+    assert client.get(f"/ai/jobs/{job['id']}").json()["status"] == "cancelled"
+    assert client.post(f"/ai/jobs/{job['id']}/cancel").status_code == 409
+
+
+def test_reingest_invalidates_cached_analysis(client, monkeypatch):
+    transport = GatedTransport(delay=0)
+    monkeypatch.setattr(main.llm_client, "transport", transport)
+
+    def ingest(subject):
+        client.post(
+            "/tenders/ingest_csv",
+            files={
+                "file": (
+                    "t.csv",
+                    f"external_id,platform,subject\nCACHE-1,gz.kz,{subject}\n".encode(),
+                )
+            },
+        )
+
+    def analyze():
+        return client.get(f"/ai/analyze_tender/{tender_id}").json()["analysis"]
+
+    ingest("Поставка бумаги")
+    items = client.get("/tenders", params={"limit": 1000}).json()["items"]
+    tender_id = next(t["id"] for t in items if t["external_id"] == "CACHE-1")
+
+    first = analyze()
+    assert analyze() == first  # ответ из кэша
+    ingest("Поставка бумаги")  # без изменений — кэш остаётся
+    assert analyze() == first
+    assert transport.calls == 1
+
+    ingest("Поставка бумаги и картриджей")
+    assert analyze() != first
+    assert transport.calls == 2
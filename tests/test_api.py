@@ -0,0 +1,229 @@
+TENDERS_CSV = (
+    "external_id,platform,subject,price_amount,price_currency,category,region\n"
+    "API-1,gz.kz,Поставка серверов,100000000,KZT,API-IT,Astana\n"
+    "API-2,gz.kz,Поставка ноутбуков,20000000,KZT,API-IT,Almaty\n"
+)
+
+
+def _ingest(client, text):
+    r = client.post(
+        "/tenders/ingest_csv", files={"file": ("t.csv", text.encode(), "text/csv")}
+    )
+    assert r.status_code == 200
+    return r.json()
+
+
+def _tender_id(client, external_id):
+    items = client.get("/tenders", params={"limit": 1000}).json()["items"]
+    return next(t["id"] for t in items if t["external_id"] == external_id)
+
+
+def test_risks_stale_after_category_stats_change(client):
+    _ingest(client, TENDERS_CSV)
+    tender_id = _tender_id(client, "API-1")
+
+    r = client.get(f"/tenders/{tender_id}/risks")
+    assert r.status_code == 200
+    assert r.json()["risk_stale"] is False
+    etag = r.headers["etag"]
+    assert client.get(
+        f"/tenders/{tender_id}/risks", headers={"If-None-Match": etag}
+    ).status_code == 304
+
+    # новый тендер той же категории меняет её статистику цен
+    _ingest(
+        client,
+        "external_id,platform,subject,price_amount,category\n"
+        "API-3,gz.kz,Поставка мониторов,5,API-IT\n",
+    )
+    r = client.get(f"/tenders/{tender_id}/risks", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json()["risk_stale"] is True
+    assert r.headers["etag"] != etag
+
+    # /report пересчитывает риск
+    assert client.get(f"/tenders/{tender_id}/report").status_code == 200
+    assert client.get(f"/tenders/{tender_id}/risks").json()["risk_stale"] is False
+
+
+def test_staleness_check_skips_similar_search(client, monkeypatch):
+    from backend import risk_rules
+    from backend.db import SessionLocal
+    from backend.models import Tender
+
+    calls = []
+    search = risk_rules.similar_to_tenders
+
+    def counted(ids, *args, **kwargs):
+        calls.append(list(ids))
+        return search(ids, *args, **kwargs)
+
+    monkeypatch.setattr(risk_rules, "similar_to_tenders", counted)
+    # без категории цена сравнивается с похожими тендерами
+    _ingest(
+        client, "external_id,platform,subject,price_amount\nSIM-1,gz.kz,Бумага,10\n"
+    )
+    tender_id = _tender_id(client, "SIM-1")
+    calls.clear()
+
+    assert client.get(f"/tenders/{tender_id}/risks").json()["risk_stale"] is False
+    assert client.get(f"/tenders/{tender_id}/report").status_code == 200
+    assert calls == []
+
+    # риск устарел: поиск похожих нужен только для пересчёта
+    with SessionLocal() as db:
+        db.get(Tender, tender_id).price_amount = 20
+        db.commit()
+    assert client.get(f"/tenders/{tender_id}/report").status_code == 200
+    assert calls == [[tender_id]]
+
+
+def _all_pages(client, limit, **params):
+    ids, cursor = [], None
+    while True:
+        query = dict(params, limit=limit, fields="id")
+        if cursor:
+            query["cursor"] = cursor
+        r = client.get("/tenders", params=query)
+        assert r.status_code == 200
+        page = r.json()
+        ids += [t["id"] for t in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def test_keyset_pages_tenders_without_created_at(client):
+    from backend.db import SessionLocal
+    from backend.models import Tender
+
+    _ingest(
+        client,
+        "external_id,platform,subject\n"
+        + "".join(f"NUL-{i},nul.kz,Тендер {i}\n" for i in range(7)),
+    )
+    with SessionLocal() as db:
+        tenders = db.query(Tender).filter(Tender.platform == "nul.kz").all()
+        for t in tenders[::2]:
+            t.created_at = None
+        db.commit()
+        expected = {t.id for t in tenders}
+
+    ids = _all_pages(client, 2, platform="nul.kz")
+
+    assert len(ids) == len(set(ids))
+    assert set(ids) == expected
+
+
+def test_keyset_pages_have_no_duplicates_or_gaps(client):
+    from datetime import datetime
+
+    from backend.db import SessionLocal
+    from backend.models import Tender
+
+    _ingest(
+        client,
+        "external_id,platform,subject\n"
+        + "".join(f"KS-{i},ks.kz,Тендер {i}\n" for i in range(25)),
+    )
+    with SessionLocal() as db:
+        tenders = db.query(Tender).filter(Tender.platform == "ks.kz").all()
+        # одинаковые даты: порядок внутри них задаёт id
+        for i, t in enumerate(tenders):
+            t.created_at = datetime(2024, 1, 1 + i % 3)
+        db.commit()
+        expected = sorted(
+            tenders, key=lambda t: (t.created_at, t.id), reverse=True
+        )
+        expected = [t.id for t in expected]
+
+    first = client.get(
+        "/tenders", params={"platform": "ks.kz", "limit": 4, "fields": "id"}
+    ).json()
+    # новый тендер между страницами не сдвигает следующие
+    _ingest(client, "external_id,platform,subject\nKS-new,ks.kz,Новый\n")
+    rest = _all_pages(client, 4, platform="ks.kz", cursor=first["next_cursor"])
+
+    ids = [t["id"] for t in first["items"]] + rest
+    assert ids == expected
+
+
+def test_reingest_same_csv_is_idempotent(client):
+    from backend.db import SessionLocal
+    from backend.models import RiskFlag, Tender
+
+    csv_text = (
+        "external_id,platform,subject,price_amount,category\n"
+        "IDEM-1,idem.kz,Поставка бумаги,100,IDEM\n"
+        "IDEM-2,idem.kz,Поставка ручек,200000,IDEM\n"
+    )
+
+    def snapshot():
+        with SessionLocal() as db:
+            tenders = db.query(Tender).filter(Tender.platform == "idem.kz").all()
+            ids = [t.id for t in tenders]
+            flags = db.query(RiskFlag).filter(RiskFlag.tender_id.in_(ids)).count()
+            return sorted((t.id, t.price_amount, t.risk_score) for t in tenders), flags
+
+    first = _ingest(client, csv_text)
+    before = snapshot()
+    second = _ingest(client, csv_text)
+
+    assert first["inserted"] == 2
+    assert (second["inserted"], second["updated"], second["rejected"]) == (0, 0, 0)
+    # те же строки, те же id и риск, флаги не задвоены
+    assert snapshot() == before
+
+
+def test_incremental_category_stats_match_full_rebuild(client):
+    from backend.category_stats import rebuild_category_stats
+    from backend.db import SessionLocal
+    from backend.models import CategoryPriceBucket, CategoryStats, Tender
+
+    _ingest(
+        client,
+        "external_id,platform,subject,price_amount,category\n"
+        + "".join(
+            f"CS-{i},cs.kz,Тендер {i},{(i + 1) * 1500},CS-{i % 3}\n" for i in range(12)
+        ),
+    )
+    # повторная загрузка с новыми ценами и категориями (upsert)
+    _ingest(
+        client,
+        "external_id,platform,subject,price_amount,category\n"
+        "CS-0,cs.kz,Тендер 0,99,CS-1\n"
+        "CS-1,cs.kz,Тендер 1,,CS-1\n"
+        "CS-2,cs.kz,Тендер 2,5000,\n",
+    )
+    with SessionLocal() as db:
+        tenders = (
+            db.query(Tender)
+            .filter(Tender.platform == "cs.kz")
+            .order_by(Tender.id)
+            .all()
+        )
+        tenders[3].price_amount = 123456
+        tenders[4].category = "CS-2"
+        db.delete(tenders[5])
+        db.commit()
+
+    def snapshot():
+        with SessionLocal() as db:
+            stats = {
+                s.category: (s.price_count, round(s.price_sum, 6), round(s.price_sumsq))
+                for s in db.query(CategoryStats)
+                if s.price_count
+            }
+            buckets = {
+                (b.category, b.bucket): b.count
+                for b in db.query(CategoryPriceBucket)
+                if b.count
+            }
+            return stats, buckets
+
+    incremental = snapshot()
+    with SessionLocal() as db:
+        rebuild_category_stats(db)
+
+    assert snapshot() == incremental
+    assert {"CS-0", "CS-1", "CS-2"} <= set(incremental[0])
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from backend import ingest_jobs
+from backend.db import SessionLocal
+from backend.ingest_jobs import QUEUE_CHUNKS, IngestJobRunner
+from backend.models import IngestJob
+from backend.schemas import IngestJobCreate
+
+
+def test_put_body_waits_for_slow_ingest(client, monkeypatch):
+    release = threading.Event()
+    ingested = []
+
+    def slow_ingest(db, rows, batch_size, on_batch=None):
+        # загрузка «не успевает»: пока не отпустят, тело не читается
+        release.wait(10)
+        ingested.extend(rows)
+        return {"rows_total": len(ingested), "inserted": 0, "updated": 0, "rejected": 0}
+
+    monkeypatch.setattr(ingest_jobs, "stream_ingest_tenders", slow_ingest)
+    runner = IngestJobRunner()
+    with SessionLocal() as db:
+        job = runner.create_job(db, IngestJobCreate(kind="tenders"))
+
+    sent = 0
+
+    async def body():
+        nonlocal sent
+        yield b"external_id,platform,subject\n"
+        for i in range(QUEUE_CHUNKS * 4):
+            sent += 1
+            yield f"Q-{i},gz.kz,Queue {i}\n".encode()
+
+    async def run():
+        receive = asyncio.ensure_future(runner.receive(job, body()))
+        done, _ = await asyncio.wait({receive}, timeout=0.5)
+        # приём ждёт загрузку: в памяти не больше QUEUE_CHUNKS блоков
+        assert not done
+        assert sent <= QUEUE_CHUNKS + 2
+        release.set()
+        return await receive
+
+    assert asyncio.run(run()) is True
+    assert sent == QUEUE_CHUNKS * 4
+
+    thread = runner._threads.get(job.id)
+    if thread:
+        thread.join(10)
+    assert len(ingested) == QUEUE_CHUNKS * 4
+    with SessionLocal() as db:
+        assert db.get(IngestJob, job.id).status == "done"
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+from backend.llm import LLMClient
+from backend.prompt_budget import estimate_tokens
+
+
+class StubTransport:
+    """Транспорт без модели: отвечает заранее заданными токенами."""
+
+    def __init__(self, parts=("Ответ", " модели")):
+        self.parts = parts
+
+    async def generate(self, model, prompt):
+        return "".join(self.parts)
+
+    async def stream(self, model, prompt):
+        for part in self.parts:
+            yield part
+
+
+def _collect(client, prompt):
+    async def run():
+        return [token async for token in client.stream(prompt)]
+
+    return asyncio.run(run())
+
+
+def test_stream_logs_prompt_tokens(caplog):
+    client = LLMClient(transport=StubTransport())
+    prompt = "Проанализируй тендер " * 20
+
+    with caplog.at_level(logging.INFO, logger="backend.llm"):
+        tokens = _collect(client, prompt)
+
+    assert tokens == ["Ответ", " модели"]
+    records = [r for r in caplog.records if "Потоковая генерация" in r.msg]
+    assert len(records) == 1
+    assert records[0].args[0] == estimate_tokens(prompt)
+    # сообщение форматируется без ошибок
+    assert f"~{estimate_tokens(prompt)} токенов" in records[0].getMessage()
+    assert client.completed == 1
+    assert client.max_prompt_tokens == estimate_tokens(prompt)
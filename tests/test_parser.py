@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from parser import GoszakupFetcher, make_session, tender_row
+
+
+class GoszakupStub:
+    """
+    Локальный HTTP-сервер вместо API goszakup: запросы идут по сети через
+    настоящую сессию requests (пул соединений, повторы Retry).
+    respond(path, query) возвращает JSON-ответ или (статус, заголовки, JSON).
+    """
+
+    def __init__(self):
+        self.respond = lambda path, query: {}
+        self.calls = []
+        self.connections = set()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = dict(parse_qsl(url.query))
+                with stub._lock:
+                    stub.calls.append((url.path, query, time.monotonic()))
+                    stub.connections.add(self.client_address)
+                result = stub.respond(url.path, query)
+                status, headers, payload = (
+                    result if isinstance(result, tuple) else (200, {}, result)
+                )
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                headers = {"Content-Type": "application/json", **headers}
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def pages_requested(self):
+        return [int(q["page"]) for _, q, _ in self.calls if "page" in q]
+
+
+@pytest.fixture
+def goszakup():
+    stub = GoszakupStub()
+    thread = threading.Thread(target=stub.server.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+def _tenders(page, per_page=2):
+    start = (page - 1) * per_page
+    return [{"id": start + i, "name_ru": f"Тендер {i}"} for i in range(per_page)]
+
+
+def _fetcher(stub, **kwargs):
+    kwargs.setdefault("rate", 0)
+    return GoszakupFetcher(base_url=stub.base_url, **kwargs)
+
+
+def test_meta_pagination_fetches_every_page_over_pooled_connections(goszakup):
+    goszakup.respond = lambda path, q: {
+        "data": _tenders(int(q["page"])),
+        "_meta": {"pageCount": 8},
+    }
+    fetcher = _fetcher(goszakup, workers=3)
+
+    tenders = list(fetcher.tenders("2024-01-01", "2024-01-07"))
+
+    assert [t["id"] for t in tenders] == list(range(16))
+    assert sorted(goszakup.pages_requested()) == list(range(1, 9))
+    assert fetcher.requests_made == 8
+    # keep-alive: соединений не больше размера пула, а не по одному на запрос
+    assert len(goszakup.connections) <= 3
+
+
+def test_failed_page_is_retried(goszakup):
+    failures = {2: 2}
+
+    def respond(path, q):
+        page = int(q["page"])
+        if failures.get(page):
+            failures[page] -= 1
+            return 503, {}, {"error": "busy"}
+        return {"data": _tenders(page), "_meta": {"pageCount": 3}}
+
+    goszakup.respond = respond
+    session = make_session(pool_size=2, backoff=0.01)
+    fetcher = _fetcher(goszakup, session=session, workers=2)
+
+    tenders = list(fetcher.tenders("2024-01-01", "2024-01-07"))
+
+    assert [t["id"] for t in tenders] == list(range(6))
+    # повторы делает адаптер сессии: для fetcher это один запрос на страницу
+    assert goszakup.pages_requested().count(2) == 3
+    assert fetcher.requests_made == 3
+
+
+def test_too_many_requests_respects_retry_after(goszakup):
+    limited = {"left": 1}
+
+    def respond(path, q):
+        if limited["left"]:
+            limited["left"] -= 1
+            return 429, {"Retry-After": "1"}, {"error": "rate limit"}
+        return {"data": _tenders(1), "_meta": {"pageCount": 1}}
+
+    goszakup.respond = respond
+    fetcher = _fetcher(goszakup, session=make_session(backoff=0.01))
+
+    start = time.monotonic()
+    tenders = list(fetcher.tenders("2024-01-01", "2024-01-07"))
+
+    assert [t["id"] for t in tenders] == [0, 1]
+    assert time.monotonic() - start >= 0.9
+    assert len(goszakup.calls) == 2
+
+
+def test_rate_limiter_spaces_requests(goszakup):
+    goszakup.respond = lambda path, q: {
+        "data": _tenders(int(q["page"])),
+        "_meta": {"pageCount": 6},
+    }
+    fetcher = _fetcher(goszakup, workers=3, rate=20)
+
+    list(fetcher.tenders("2024-01-01", "2024-01-07"))
+
+    # 6 запросов при 20 в секунду: не быстрее 5 интервалов по 50 мс
+    times = sorted(t for _, _, t in goszakup.calls)
+    assert times[-1] - times[0] >= 5 * 0.05 * 0.9
+
+
+def test_links_pagination_follows_next_until_empty(goszakup):
+    pages = {
+        "1": {"items": _tenders(1), "links": {"next": "/v3/tender?after=2"}},
+        "2": {
+            "items": _tenders(2),
+            "_links": {"next": {"href": "/v3/tender?after=4"}},
+        },
+        "4": {"items": [], "links": {"next": "/v3/tender?after=6"}},
+    }
+    goszakup.respond = lambda path, q: pages[q.get("after", "1")]
+    fetcher = _fetcher(goszakup)
+
+    tenders = list(fetcher.tenders("2024-01-01", "2024-01-07"))
+
+    assert [t["id"] for t in tenders] == [0, 1, 2, 3]
+    assert [path for path, _, _ in goszakup.calls] == ["/v3/tender"] * 3
+    # после пустой страницы дальше по ссылке не идём
+    assert fetcher.requests_made == 3
+
+
+def test_duplicates_across_pages_are_skipped(goszakup):
+    # страницы сдвинулись: первая запись второй страницы повторяет первую
+    items = {1: [{"id": 1}, {"id": 2}], 2: [{"id": 2}, {"id": 3}]}
+    goszakup.respond = lambda path, q: {
+        "data": items[int(q["page"])],
+        "_meta": {"pageCount": 2},
+    }
+
+    tenders = list(_fetcher(goszakup).tenders("2024-01-01", "2024-01-07"))
+
+    assert [t["id"] for t in tenders] == [1, 2, 3]
+
+
+def test_pages_in_flight_are_bounded(goszakup):
+    goszakup.respond = lambda path, q: {
+        "data": _tenders(int(q["page"])),
+        "_meta": {"pageCount": 100},
+    }
+    fetcher = _fetcher(goszakup, workers=2)
+    pages = fetcher.pages("2024-01-01", "2024-01-07")
+
+    next(pages)  # первая страница
+    next(pages)  # вторая
+    time.sleep(0.3)  # даём пулу время забежать вперёд, если он не ограничен
+    # потребитель стоит: запрошено не больше первой страницы + workers * 2 вперёд
+    assert len(goszakup.calls) <= 1 + 1 + 2 * 2
+    pages.close()
+    assert len(goszakup.calls) < 100
+
+
+@pytest.mark.parametrize("external_id", [12345, "12345"])
+def test_tender_row_external_id_is_string(external_id):
+    row = tender_row({"id": external_id, "name_ru": "Поставка"})
+    assert row["external_id"] == "12345"
@@ -0,0 +1,70 @@
+import numpy as np
+
+from backend import similarity
+from backend.similarity import DIM, SimilarityIndex
+
+
+def _index(vectors):
+    """Индекс в памяти без БД: строки vectors получают id 0..n-1 и цену 1."""
+    index = SimilarityIndex()
+    n = len(vectors)
+    index._grow(n)
+    index._matrix[:n] = vectors
+    index._ids[:n] = np.arange(n)
+    index._prices[:n] = 1.0
+    index._rows = {i: i for i in range(n)}
+    index._size = n
+    return index
+
+
+def _clustered(groups, per_group, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(groups, DIM))
+    vectors = np.repeat(centers, per_group, axis=0)
+    vectors += rng.normal(scale=0.5, size=vectors.shape)
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+
+
+def test_ivf_search_matches_exact(monkeypatch):
+    monkeypatch.setattr(similarity, "IVF_MIN_SIZE", 500)
+    vectors = _clustered(groups=40, per_group=50)
+    index = _index(vectors)
+    own = np.arange(len(vectors))
+
+    approx = index.nearest(vectors, 5, own)
+    assert index._centroids is not None  # поиск шёл по кластерам
+    exact = index._nearest_exact(vectors, 5, own)
+
+    found = [
+        len({t for t, _, _ in a} & {t for t, _, _ in e}) / len(e)
+        for a, e in zip(approx, exact)
+    ]
+    assert np.mean(found) > 0.95
+    # сам тендер в соседи не попадает, похожесть по убыванию
+    assert all(t != i for i, a in enumerate(approx) for t, _, _ in a)
+    assert all(
+        [s for _, s, _ in a] == sorted((s for _, s, _ in a), reverse=True)
+        for a in approx
+    )
+
+
+def test_ivf_assigns_appended_rows(monkeypatch):
+    monkeypatch.setattr(similarity, "IVF_MIN_SIZE", 500)
+    vectors = _clustered(groups=20, per_group=50, seed=1)
+    index = _index(vectors[:900])
+    index.nearest(vectors[:1], 5)
+    trained = len(index._centroids)
+
+    # дописанные строки (как после refresh) приписываются к кластерам
+    index._grow(1000)
+    index._matrix[900:1000] = vectors[900:]
+    index._ids[900:1000] = np.arange(900, 1000)
+    index._size = 1000
+    index._assign[900:1000] = index._closest_lists(vectors[900:])
+    index._order = None
+
+    result = index.nearest(vectors[950:951], 5, np.array([950]))
+    assert len(index._centroids) == trained  # без переобучения
+    assert {t for t, _, _ in result[0]} <= set(range(900, 1000))
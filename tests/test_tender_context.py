@@ -0,0 +1,42 @@
+import pytest
+
+from backend.tender_context import extract_tender_ids
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Что с тендером 5?", [5]),
+        ("тендер номер 5", [5]),
+        ("tender id 10", [10]),
+        ("расскажи по тендеру под номером 8", [8]),
+        ("Tender No. 12", [12]),
+        ("тендер №7", [7]),
+        ("tender #5", [5]),
+    ],
+)
+def test_single_tender(text, expected):
+    assert extract_tender_ids(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("сравни тендеры 3, 4 и 5", [3, 4, 5]),
+        ("тендер 3 и тендер 7", [3, 7]),
+        ("тендеры №3, №7", [3, 7]),
+        ("tenders 1 and 2", [1, 2]),
+        ("тендер 2 и тендер 2", [2]),
+    ],
+)
+def test_several_tenders(text, expected):
+    assert extract_tender_ids(text) == expected
+
+
+def test_no_tender_reference():
+    assert extract_tender_ids("какие поставщики есть в Алматы?") == []
+    assert extract_tender_ids("tender identity 5") == []
+
+
+def test_limit():
+    assert extract_tender_ids("тендеры 1, 2, 3, 4", limit=2) == [1, 2]
@@ -1,11 +1,24 @@
+import math
 import os
 import streamlit as st
 import pandas as pd
 import requests
 import streamlit.components.v1 as components
 
-# Базовый URL бэкенда FastAPI
-FASTAPI_URL = "http://127.0.0.1:8000"
+# запросы к backend и их кэш — в data.py (папка ui в sys.path при streamlit run)
+from data import (
+    PAGE_SIZE,
+    RISK_LEVELS,
+    analyze_tender,
+    fetch_categories,
+    fetch_risks,
+    fetch_suppliers,
+    fetch_tender,
+    fetch_tender_page,
+    fetch_tender_total,
+    search_tender_page,
+    upload_csv,
+)
 
 # ----------------------------------------------------------------------
 # НАСТРОЙКА СТРАНИЦЫ
@@ -31,13 +44,12 @@ ai_tender_id = st.sidebar.number_input(
 
 if st.sidebar.button("Запустить AI-анализ"):
     try:
-        resp = requests.get(f"{FASTAPI_URL}/ai/analyze_tender/{ai_tender_id}")
-        if resp.status_code == 200:
-            st.sidebar.success("Готово! Проверьте вывод ниже.")
-            # Выводим результат анализа в основной области
-            st.json(resp.json())
-        else:
-            st.sidebar.error(f"Ошибка анализа: {resp.status_code}")
+        result = analyze_tender(ai_tender_id)
+        st.sidebar.success("Готово! Проверьте вывод ниже.")
+        # Выводим результат анализа в основной области
+        st.json(result)
+    except requests.HTTPError as e:
+        st.sidebar.error(f"Ошибка анализа: {e.response.status_code}")
     except Exception as e:
         st.sidebar.error(f"Ошибка запроса: {e}")
 
@@ -53,11 +65,8 @@ if menu == "Загрузка данных":
 
     if st.button("Загрузить тендеры") and file_t:
         try:
-            resp = requests.post(
-                f"{FASTAPI_URL}/tenders/ingest_csv",
-                files={"file": (file_t.name, file_t.getvalue(), "text/csv")},
-            )
-            st.json(resp.json())
+            # после загрузки кэш ответов сбрасывается
+            st.json(upload_csv("/tenders/ingest_csv", file_t.name, file_t.getvalue()))
         except Exception as e:
             st.error(f"Ошибка загрузки тендеров: {e}")
 
@@ -69,11 +78,8 @@ if menu == "Загрузка данных":
 
     if st.button("Загрузить поставщиков") and file_s:
         try:
-            resp = requests.post(
-                f"{FASTAPI_URL}/suppliers/ingest_csv",
-                files={"file": (file_s.name, file_s.getvalue(), "text/csv")},
-            )
-            st.json(resp.json())
+            # после загрузки кэш ответов сбрасывается
+            st.json(upload_csv("/suppliers/ingest_csv", file_s.name, file_s.getvalue()))
         except Exception as e:
             st.error(f"Ошибка загрузки поставщиков: {e}")
 
@@ -83,13 +89,67 @@ if menu == "Загрузка данных":
 elif menu == "Список тендеров":
     st.title("Список тендеров")
 
+    # фильтры применяются на backend; в UI только текущая страница
+    col_q, col_cat, col_platform, col_risk = st.columns(4)
+    query = col_q.text_input("Поиск по тексту").strip()
+    try:
+        categories = fetch_categories()
+    except Exception:
+        categories = []
+    category = col_cat.selectbox(
+        "Категория", [""] + categories, format_func=lambda v: v or "Все"
+    )
+    platform = col_platform.text_input("Площадка").strip()
+    risk_level = col_risk.selectbox(
+        "Уровень риска", ("",) + RISK_LEVELS, format_func=lambda v: v or "Все"
+    )
+
+    # начала просмотренных страниц (курсоры /tenders или offset поиска);
+    # при смене фильтров список начинается с первой страницы
+    filters = (query, category, platform, risk_level)
+    if st.session_state.get("list_filters") != filters:
+        st.session_state.list_filters = filters
+        st.session_state.list_pages = [None]
+    pages = st.session_state.list_pages
+
+    def next_page(start):
+        st.session_state.list_pages.append(start)
+
+    def prev_page():
+        st.session_state.list_pages.pop()
+
     try:
-        resp = requests.get(f"{FASTAPI_URL}/tenders")
-        if resp.status_code == 200:
-            df = pd.DataFrame(resp.json())
-            st.dataframe(df, use_container_width=True)
+        if query:
+            items, next_start = search_tender_page(
+                query, category, platform, risk_level, offset=pages[-1] or 0
+            )
+            st.caption(f"Страница {len(pages)}, по релевантности")
+        else:
+            items, next_start = fetch_tender_page(
+                category, platform, risk_level, cursor=pages[-1]
+            )
+            total = fetch_tender_total(category, platform, risk_level)
+            st.caption(
+                f"Всего тендеров: {total} · страница {len(pages)} "
+                f"из {max(math.ceil(total / PAGE_SIZE), 1)}"
+            )
+
+        if items:
+            df = pd.DataFrame(items).drop(columns=["rank"], errors="ignore")
+            st.dataframe(df, use_container_width=True, hide_index=True)
         else:
-            st.error(f"Ошибка получения тендеров: {resp.status_code}")
+            st.write("Тендеры не найдены.")
+
+        col_prev, col_next = st.columns(2)
+        col_prev.button("← Назад", disabled=len(pages) == 1, on_click=prev_page)
+        col_next.button(
+            "Вперёд →",
+            disabled=next_start is None,
+            on_click=next_page,
+            args=(next_start,),
+        )
+    except requests.HTTPError as e:
+        st.error(f"Ошибка получения тендеров: {e.response.status_code}")
     except Exception as e:
         st.error(f"Ошибка запроса: {e}")
 
@@ -103,11 +163,36 @@ elif menu == "Карточка тендера":
 
     if st.button("Показать отчёт"):
         try:
-            resp = requests.get(f"{FASTAPI_URL}/tenders/{tid}/report")
-            if resp.status_code == 200:
-                st.json(resp.json())
+            # карточка, риски и поставщики — лёгкие запросы без пересчёта риска,
+            # ответы кэшируются на CACHE_TTL секунд
+            tender = fetch_tender(tid)
+            if tender is not None:
+                st.subheader("Тендер")
+                st.json(tender)
+
+                risks = fetch_risks(tid)
+                st.subheader(f"Риск: {risks['risk_level']} ({risks['risk_score']})")
+                if risks["risk_stale"]:
+                    st.caption("Сохранённый риск устарел и ожидает пересчёта.")
+                if risks["risk_flags"]:
+                    st.dataframe(
+                        pd.DataFrame(risks["risk_flags"]), use_container_width=True
+                    )
+                else:
+                    st.write("Флаги риска не найдены.")
+
+                suppliers = fetch_suppliers(tid)
+                st.subheader("Подходящие поставщики")
+                if suppliers["suppliers"]:
+                    st.dataframe(
+                        pd.DataFrame(suppliers["suppliers"]), use_container_width=True
+                    )
+                else:
+                    st.write("Подходящие поставщики не найдены.")
             else:
-                st.error(f"Ошибка получения отчёта: {resp.status_code}")
+                st.error("Тендер не найден.")
+        except requests.HTTPError as e:
+            st.error(f"Ошибка получения отчёта: {e.response.status_code}")
         except Exception as e:
             st.error(f"Ошибка запроса: {e}")
 
@@ -0,0 +1,196 @@
+"""
+Слой данных Streamlit-интерфейса.
+
+Streamlit перезапускает app.py целиком на каждое действие пользователя,
+поэтому запросы к backend вынесены сюда:
+- одна requests.Session на процесс (st.cache_resource): пул keep-alive
+  соединений и повторы GET при 5xx и обрыве связи;
+- ответы GET кэшируются st.cache_data на CACHE_TTL секунд, и повторный
+  rerun с теми же параметрами не доходит до backend;
+- список тендеров запрашивается страницами (keyset-курсор /tenders или
+  offset /tenders/search), фильтры передаются в API. В памяти UI только
+  текущая страница, сколько бы тендеров ни было в базе.
+
+Ошибки HTTP поднимаются как requests.HTTPError, их ответы не кэшируются.
+После загрузки данных кэш сбрасывается (clear_cache).
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Базовый URL бэкенда FastAPI
+FASTAPI_URL = "http://127.0.0.1:8000"
+
+# сколько секунд ответы backend считаются свежими
+CACHE_TTL = 60
+# справочники (категории) меняются редко
+REFERENCE_TTL = 600
+# таймауты запросов, секунды (загрузка файла — дольше)
+REQUEST_TIMEOUT = 15
+UPLOAD_TIMEOUT = 300
+POOL_SIZE = 10
+RETRIES = 3
+BACKOFF_SECONDS = 0.5
+
+PAGE_SIZE = 100
+# колонки списка: без больших текстовых полей (description_raw, requirements_text)
+LIST_FIELDS = (
+    "id,external_id,platform,customer_name,subject,price_amount,"
+    "category,region,risk_score,risk_level,created_at"
+)
+RISK_LEVELS = ("low", "medium", "high")
+# дальше /tenders/search не листает (ограничение offset в API)
+SEARCH_MAX_OFFSET = 10000
+
+
+@st.cache_resource
+def get_session(retries: int = RETRIES) -> requests.Session:
+    """
+    Общая для всех сессий Streamlit сессия с пулом соединений (своя на
+    каждое значение retries).
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=BACKOFF_SECONDS,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get(path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+    r = get_session().get(FASTAPI_URL + path, params=params, timeout=REQUEST_TIMEOUT)
+    r.raise_for_status()
+    return r.json()
+
+
+def _get_or_none(path: str) -> Optional[Any]:
+    """json ответа или None, если объекта нет (404)."""
+    try:
+        return _get(path)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+
+def clear_cache() -> None:
+    """Сбрасывает кэш ответов (после изменения данных на backend)."""
+    st.cache_data.clear()
+
+
+# ---------------------------------------------------------------------
+# Список тендеров
+# ---------------------------------------------------------------------
+
+
+def _filters(category: str, platform: str, risk_level: str) -> Dict[str, str]:
+    # пустые фильтры не передаём
+    params = {"category": category, "platform": platform, "risk_level": risk_level}
+    return {k: v for k, v in params.items() if v}
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_tender_page(
+    category: str = "",
+    platform: str = "",
+    risk_level: str = "",
+    cursor: Optional[str] = None,
+    limit: int = PAGE_SIZE,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Страница списка (keyset по created_at, id): (строки, курсор следующей)."""
+    params = _filters(category, platform, risk_level)
+    params.update(limit=limit, fields=LIST_FIELDS)
+    if cursor:
+        params["cursor"] = cursor
+    page = _get("/tenders", params)
+    return page["items"], page["next_cursor"]
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_tender_total(
+    category: str = "", platform: str = "", risk_level: str = ""
+) -> int:
+    """Число тендеров под фильтром: считается один раз, а не на каждой странице."""
+    params = _filters(category, platform, risk_level)
+    params.update(limit=1, fields="id", with_total=True)
+    return _get("/tenders", params)["total"]
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def search_tender_page(
+    query: str,
+    category: str = "",
+    platform: str = "",
+    risk_level: str = "",
+    offset: int = 0,
+    limit: int = PAGE_SIZE,
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Страница полнотекстового поиска: (строки, offset следующей)."""
+    params = _filters(category, platform, risk_level)
+    params.update(q=query, offset=offset, limit=limit, fields=LIST_FIELDS)
+    page = _get("/tenders/search", params)
+    next_offset = page["next_offset"]
+    if next_offset is not None and next_offset > SEARCH_MAX_OFFSET:
+        next_offset = None
+    return page["items"], next_offset
+
+
+@st.cache_data(ttl=REFERENCE_TTL, show_spinner=False)
+def fetch_categories() -> List[str]:
+    return [row["category"] for row in _get("/categories/stats")]
+
+
+# ---------------------------------------------------------------------
+# Карточка тендера
+# ---------------------------------------------------------------------
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_tender(tender_id: int) -> Optional[Dict[str, Any]]:
+    return _get_or_none(f"/tenders/{tender_id}")
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_risks(tender_id: int) -> Optional[Dict[str, Any]]:
+    return _get_or_none(f"/tenders/{tender_id}/risks")
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_suppliers(tender_id: int) -> Optional[Dict[str, Any]]:
+    return _get_or_none(f"/tenders/{tender_id}/suppliers")
+
+
+# ---------------------------------------------------------------------
+# Изменение данных (без кэша)
+# ---------------------------------------------------------------------
+
+
+def upload_csv(path: str, name: str, content: bytes) -> Dict[str, Any]:
+    """Загрузка CSV в /tenders/ingest_csv или /suppliers/ingest_csv; отчёт."""
+    r = get_session().post(
+        FASTAPI_URL + path,
+        files={"file": (name, content, "text/csv")},
+        timeout=UPLOAD_TIMEOUT,
+    )
+    r.raise_for_status()
+    clear_cache()
+    return r.json()
+
+
+def analyze_tender(tender_id: int) -> Dict[str, Any]:
+    # без повторов: каждый повтор — ещё один долгий запрос к LLM
+    r = get_session(retries=0).get(
+        f"{FASTAPI_URL}/ai/analyze_tender/{tender_id}", timeout=UPLOAD_TIMEOUT
+    )
+    r.raise_for_status()
+    return r.json()